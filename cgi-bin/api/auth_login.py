@@ -10,18 +10,25 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.database import get_db_connection
 from common.auth import hash_password, verify_password, create_session, set_cookie, cleanup_expired_sessions
 from common.utils import json_response, get_request_data, validate_required_fields, validate_email
+from common.wsgi import run_cgi
 
-def login():
+def login(request):
     """ログイン処理"""
     try:
         # 期限切れセッションをクリーンアップ
         cleanup_expired_sessions()
         
         # リクエストデータ取得
-        data = get_request_data()
+        data = get_request_data(request)
         
         # バリデーション
         valid, error = validate_required_fields(data, ['email', 'password'])
@@ -75,4 +82,4 @@ def login():
         }, status=500)
 
 if __name__ == '__main__':
-    login()
+    run_cgi(login)
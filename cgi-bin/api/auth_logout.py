@@ -10,14 +10,21 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.auth import delete_session, get_cookie_value, delete_cookie
 from common.utils import json_response
+from common.wsgi import run_cgi
 
-def logout():
+def logout(request):
     """ログアウト処理"""
     try:
         # セッションIDを取得
-        session_id = get_cookie_value('session_id')
+        session_id = get_cookie_value(request, 'session_id')
         
         if session_id:
             # セッションを削除
@@ -38,4 +45,4 @@ def logout():
         }, status=500)
 
 if __name__ == '__main__':
-    logout()
+    run_cgi(logout)
@@ -10,22 +10,29 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from common.auth import get_cookie_value, get_session_user
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
+from common.auth import get_cookie_value, get_session_user, refresh_session_cookies
 from common.utils import json_response
+from common.wsgi import run_cgi
 
-def get_current_user():
+def get_current_user(request):
     """現在のユーザー情報を取得"""
     try:
         # セッションIDを取得
-        session_id = get_cookie_value('session_id')
+        session_id = get_cookie_value(request, 'session_id')
         
         if not session_id:
             return json_response({
                 'error': '認証されていません'
             }, status=401)
         
-        # ユーザー情報を取得
-        user = get_session_user(session_id)
+        # ユーザー情報を取得（署名付きトークンの場合はDBで確認して再発行する）
+        user = get_session_user(session_id, verify=True)
         
         if not user:
             return json_response({
@@ -40,7 +47,7 @@ def get_current_user():
                 'role': user['role'],
                 'department': user['department']
             }
-        })
+        }, cookies=refresh_session_cookies(session_id, user))
         
     except Exception as e:
         return json_response({
@@ -49,4 +56,4 @@ def get_current_user():
         }, status=500)
 
 if __name__ == '__main__':
-    get_current_user()
+    run_cgi(get_current_user)
@@ -10,22 +10,29 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.database import get_db_connection
 from common.auth import get_cookie_value, get_session_user
 from common.utils import json_response, get_request_data, validate_required_fields
+from common.wsgi import run_cgi
 
-def create_manual():
+def create_manual(request):
     """手順書を作成"""
     try:
         # 認証チェック
-        session_id = get_cookie_value('session_id')
-        current_user = get_session_user(session_id)
+        session_id = get_cookie_value(request, 'session_id')
+        current_user = get_session_user(session_id, verify=True)
         
         if not current_user:
             return json_response({'error': '認証が必要です'}, status=401)
         
         # リクエストデータ取得
-        data = get_request_data()
+        data = get_request_data(request)
         
         # バリデーション
         valid, error = validate_required_fields(data, ['title'])
@@ -113,4 +120,4 @@ def create_manual():
         }, status=500)
 
 if __name__ == '__main__':
-    create_manual()
+    run_cgi(create_manual)
@@ -10,22 +10,29 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.database import get_db_connection
 from common.auth import get_cookie_value, get_session_user
 from common.utils import json_response, get_query_params
+from common.wsgi import run_cgi
 
-def delete_manual():
+def delete_manual(request):
     """手順書を削除（論理削除）"""
     try:
         # 認証チェック
-        session_id = get_cookie_value('session_id')
-        current_user = get_session_user(session_id)
+        session_id = get_cookie_value(request, 'session_id')
+        current_user = get_session_user(session_id, verify=True)
         
         if not current_user:
             return json_response({'error': '認証が必要です'}, status=401)
         
         # パラメータ取得
-        params = get_query_params()
+        params = get_query_params(request)
         manual_id = params.get('id')
         
         if not manual_id:
@@ -53,7 +60,7 @@ def delete_manual():
             # 論理削除
             cursor.execute('''
                 UPDATE manuals
-                SET is_deleted = 1, updated_at = datetime('now', 'localtime')
+                SET is_deleted = 1, updated_at = datetime('now', 'localtime'), version = version + 1
                 WHERE id = ?
             ''', (manual_id,))
             
@@ -77,4 +84,4 @@ def delete_manual():
         }, status=500)
 
 if __name__ == '__main__':
-    delete_manual()
+    run_cgi(delete_manual)
@@ -10,19 +10,63 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from common.database import get_db_connection
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
+from common.database import get_db_connection, get_change_counter
 from common.auth import get_cookie_value, get_session_user
-from common.utils import json_response, get_query_params
+from common.utils import json_response, get_query_params, make_etag, http_date, check_not_modified
+from common.viewlog import record_view
+from common.wsgi import run_cgi
+
+def fetch_manual_details(cursor, manual_id, manual):
+    """手順書のタグ・ステップ・更新履歴を取得して manual に設定"""
+    # タグを取得
+    cursor.execute('''
+        SELECT t.id, t.name
+        FROM tags t
+        JOIN manual_tags mt ON t.id = mt.tag_id
+        WHERE mt.manual_id = ?
+        ORDER BY mt.id
+    ''', (manual_id,))
+    manual['tags'] = [dict(tag) for tag in cursor.fetchall()]
+
+    # ステップを取得（保存済みの画像は幅・高さ・形式も返す）
+    cursor.execute('''
+        SELECT s.id, s.step_number, s.title, s.content, s.note, s.image_path,
+               i.width AS image_width, i.height AS image_height, i.format AS image_format
+        FROM manual_steps s
+        LEFT JOIN images i
+          ON i.sha256 = substr(s.image_path, instr(s.image_path, '/uploads/images/') + 22, 64)
+         AND instr(s.image_path, '/uploads/images/') > 0
+        WHERE s.manual_id = ?
+        ORDER BY s.step_number ASC
+    ''', (manual_id,))
+    manual['steps'] = [dict(step) for step in cursor.fetchall()]
 
-def get_manual():
+    # 更新履歴を取得
+    cursor.execute('''
+        SELECT h.*, u.name as user_name
+        FROM manual_histories h
+        JOIN users u ON h.user_id = u.id
+        WHERE h.manual_id = ?
+        ORDER BY h.created_at DESC
+        LIMIT 10
+    ''', (manual_id,))
+    manual['histories'] = [dict(history) for history in cursor.fetchall()]
+
+def get_manual(request):
     """手順書の詳細を取得"""
     try:
         # 認証チェック
-        session_id = get_cookie_value('session_id')
+        session_id = get_cookie_value(request, 'session_id')
         current_user = get_session_user(session_id)
         
         # パラメータ取得
-        params = get_query_params()
+        params = get_query_params(request)
         manual_id = params.get('id')
         
         if not manual_id:
@@ -36,9 +80,12 @@ def get_manual():
             
             # 手順書の基本情報
             cursor.execute('''
-                SELECT m.*, u.name as author_name, u.email as author_email
+                SELECT m.*, u.name as author_name, u.email as author_email,
+                       COALESCE(vc.view_count, 0) as view_count,
+                       datetime(vc.last_viewed_at, 'utc') as views_changed_at
                 FROM manuals m
                 JOIN users u ON m.author_id = u.id
+                LEFT JOIN view_counts vc ON vc.manual_id = m.id
                 WHERE m.id = ? AND m.is_deleted = 0
             ''', (manual_id,))
             
@@ -47,49 +94,31 @@ def get_manual():
                 return json_response({'error': '手順書が見つかりません'}, status=404)
             
             manual = dict(row)
+            # 閲覧数の最終反映日時（UTC）は検証用ヘッダーにだけ使う
+            views_changed_at = manual.pop('views_changed_at')
             
             # 下書きは作成者のみ閲覧可能
             if manual['is_published'] == 0 and (not current_user or manual['author_id'] != current_user['id']):
                 return json_response({'error': '閲覧権限がありません'}, status=403)
             
-            # タグを取得
-            cursor.execute('''
-                SELECT t.id, t.name
-                FROM tags t
-                JOIN manual_tags mt ON t.id = mt.tag_id
-                WHERE mt.manual_id = ?
-            ''', (manual_id,))
-            manual['tags'] = [dict(tag) for tag in cursor.fetchall()]
-            
-            # ステップを取得
-            cursor.execute('''
-                SELECT id, step_number, title, content, note, image_path
-                FROM manual_steps
-                WHERE manual_id = ?
-                ORDER BY step_number ASC
-            ''', (manual_id,))
-            manual['steps'] = [dict(step) for step in cursor.fetchall()]
-            
-            # 更新履歴を取得
-            cursor.execute('''
-                SELECT h.*, u.name as user_name
-                FROM manual_histories h
-                JOIN users u ON h.user_id = u.id
-                WHERE h.manual_id = ?
-                ORDER BY h.created_at DESC
-                LIMIT 10
-            ''', (manual_id,))
-            manual['histories'] = [dict(history) for history in cursor.fetchall()]
-            
-            # 閲覧ログを記録
-            cursor.execute('''
-                INSERT INTO view_logs (manual_id, user_id)
-                VALUES (?, ?)
-            ''', (manual_id, current_user['id'] if current_user else None))
+            viewer_id = current_user['id'] if current_user else None
             
-            conn.commit()
+            # 条件付きGET（変更がなければタグ・ステップ・履歴を取得せずに304を返す）
+            # 閲覧数は閲覧ログの反映で変わり change_counter を進めないため、ETag・Last-Modified に別途含める
+            counter, changed_at = get_change_counter(cursor)
+            etag = make_etag('manual', manual_id, manual['updated_at'], counter, viewer_id, manual['view_count'])
+            last_modified = http_date(max(filter(None, (changed_at, views_changed_at)), default=None))
+            not_modified = check_not_modified(request, etag, last_modified)
+            if not not_modified:
+                fetch_manual_details(cursor, manual_id, manual)
+        
+        # 閲覧ログを記録（スプールに追記し、後でまとめて反映する）
+        # CGIでは記録時に反映することがあるため、接続のコンテキストを抜けてから記録する
+        record_view(manual_id, viewer_id)
         
-        return json_response({'manual': manual})
+        if not_modified:
+            return not_modified
+        return json_response({'manual': manual}, etag=etag, last_modified=last_modified)
         
     except Exception as e:
         return json_response({
@@ -98,4 +127,4 @@ def get_manual():
         }, status=500)
 
 if __name__ == '__main__':
-    get_manual()
+    run_cgi(get_manual)
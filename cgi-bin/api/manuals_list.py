@@ -10,29 +10,41 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from common.database import get_db_connection
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
+from common.database import get_db_connection, get_change_counter, SUPPORTS_WINDOW_FUNCTIONS
 from common.auth import get_cookie_value, get_session_user
-from common.utils import json_response, get_query_params
+from common.utils import json_response, get_query_params, make_etag, http_date, check_not_modified
+from common.pagination import encode_cursor, decode_cursor, keyset_condition, InvalidCursor
+from common.search import build_search_filter, fetch_snippets
+from common.wsgi import run_cgi
 
-def get_manuals():
+def get_manuals(request):
     """手順書一覧を取得"""
     try:
         # 認証チェック
-        session_id = get_cookie_value('session_id')
+        session_id = get_cookie_value(request, 'session_id')
         current_user = get_session_user(session_id)
         
         is_guest = current_user is None
         
         # クエリパラメータ取得
-        params = get_query_params()
+        params = get_query_params(request)
         page = int(params.get('page', '1'))
         limit = int(params.get('limit', '20'))
         search = params.get('search', '')
         tag = params.get('tag', '')
         author = params.get('author', '')
         is_published = params.get('is_published', '')
-        sort = params.get('sort', 'updated_at')
+        sort = params.get('sort', '')
         order = params.get('order', 'desc')
+        # cursor パラメータがある場合はキーセットページネーション（空文字は先頭ページ）
+        page_cursor = params.get('cursor')
+        use_cursor = page_cursor is not None
         
         offset = (page - 1) * limit
         
@@ -40,6 +52,14 @@ def get_manuals():
         with get_db_connection() as conn:
             cursor = conn.cursor()
             
+            # 条件付きGET（変更がなければ一覧を取得せずに304を返す）
+            counter, changed_at = get_change_counter(cursor)
+            etag = make_etag('manuals', counter, current_user['id'] if current_user else None, sorted(params.items()))
+            last_modified = http_date(changed_at)
+            not_modified = check_not_modified(request, etag, last_modified)
+            if not_modified:
+                return not_modified
+            
             # WHERE条件を構築
             where_conditions = ['m.is_deleted = 0']
             query_params = []
@@ -58,22 +78,10 @@ def get_manuals():
                 # 未ログインユーザーは公開手順書のみ閲覧可能
                 where_conditions.append('m.is_published = 1')
             
-            # 検索キーワード
-            if search:
-                search_pattern = f'%{search}%'
-                where_conditions.append('''
-                    (
-                        m.title LIKE ?
-                        OR EXISTS (
-                            SELECT 1
-                            FROM manual_tags mt_search
-                            JOIN tags t_search ON mt_search.tag_id = t_search.id
-                            WHERE mt_search.manual_id = m.id
-                              AND t_search.name LIKE ?
-                        )
-                    )
-                ''')
-                query_params.extend([search_pattern, search_pattern])
+            # 検索キーワード（全文検索インデックスとの結合）
+            search_filter = build_search_filter(cursor, search)
+            search_join = search_filter.join if search_filter else ''
+            join_params = list(search_filter.params) if search_filter else []
             
             # 作成者フィルタ
             if author:
@@ -81,83 +89,157 @@ def get_manuals():
                 query_params.append(int(author))
             
             # タグフィルタ
-            tag_join = ''
             if tag:
-                tag_join = '''
-                    JOIN manual_tags mt ON m.id = mt.manual_id
-                    JOIN tags t ON mt.tag_id = t.id
-                '''
-                where_conditions.append('t.name = ?')
+                where_conditions.append('''
+                    EXISTS (
+                        SELECT 1
+                        FROM manual_tags mt_filter
+                        JOIN tags t_filter ON mt_filter.tag_id = t_filter.id
+                        WHERE mt_filter.manual_id = m.id
+                          AND t_filter.name = ?
+                    )
+                ''')
                 query_params.append(tag)
             
             # ソート順
             valid_sorts = ['created_at', 'updated_at', 'title']
             if sort not in valid_sorts:
-                sort = 'updated_at'
+                # 全文検索時は関連度順（カーソルモードでは関連度順に対応しないため更新日時順）
+                if search_filter and search_filter.ranked and not use_cursor:
+                    sort = 'relevance'
+                else:
+                    sort = 'updated_at'
             
             valid_orders = ['asc', 'desc']
             if order.lower() not in valid_orders:
                 order = 'desc'
+            order = order.upper()
+            
+            if sort == 'relevance':
+                score_column = 'hit.score'
+                inner_order = 'hit.score ASC, m.id DESC'
+                outer_order = 'p.score ASC, p.id DESC'
+            else:
+                score_column = 'NULL'
+                inner_order = f'm.{sort} {order}, m.id {order}'
+                outer_order = f'p.{sort} {order}, p.id {order}'
             
-            # クエリ実行
+            page_conditions = list(where_conditions)
+            page_params = join_params + query_params
+            if use_cursor:
+                # 総件数は数えず、次ページの有無を判定するため1件多く取得する
+                if page_cursor:
+                    try:
+                        after_value, after_id = decode_cursor(page_cursor, sort, order)
+                    except InvalidCursor as e:
+                        return json_response({'error': str(e)}, status=400)
+                    page_conditions.append(keyset_condition(f'm.{sort}', 'm.id', order))
+                    page_params.extend([after_value, after_id])
+                total_column = 'NULL'
+                page_params.extend([limit + 1, 0])
+            else:
+                # 総件数はウィンドウ関数で同じクエリから取得する
+                total_column = 'COUNT(*) OVER ()' if SUPPORTS_WINDOW_FUNCTIONS else 'NULL'
+                page_params.extend([limit, offset])
+            
+            # クエリ実行（ステップ数はページ内の行に対してのみ取得する）
             query = f'''
-                SELECT DISTINCT
-                    m.id, m.title, m.description, m.is_published,
-                    m.visibility, m.created_at, m.updated_at,
-                    u.name as author_name, u.id as author_id
-                FROM manuals m
-                JOIN users u ON m.author_id = u.id
-                {tag_join}
-                WHERE {' AND '.join(where_conditions)}
-                ORDER BY m.{sort} {order.upper()}
-                LIMIT ? OFFSET ?
+                SELECT
+                    p.*,
+                    (SELECT COUNT(*) FROM manual_steps s WHERE s.manual_id = p.id) AS step_count
+                FROM (
+                    SELECT
+                        m.id, m.title, m.description, m.is_published,
+                        m.visibility, m.created_at, m.updated_at,
+                        u.name as author_name, u.id as author_id,
+                        {score_column} AS score,
+                        {total_column} AS total_count
+                    FROM manuals m
+                    JOIN users u ON m.author_id = u.id
+                    {search_join}
+                    WHERE {' AND '.join(page_conditions)}
+                    ORDER BY {inner_order}
+                    LIMIT ? OFFSET ?
+                ) p
+                ORDER BY {outer_order}
             '''
-            query_params.extend([limit, offset])
+            cursor.execute(query, tuple(page_params))
+            rows = cursor.fetchall()
             
-            cursor.execute(query, tuple(query_params))
-            manuals = []
+            next_cursor = None
+            if use_cursor and len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(sort, order, rows[-1][sort], rows[-1]['id'])
             
-            for row in cursor.fetchall():
+            manuals = []
+            for row in rows:
                 manual = dict(row)
-                
-                # タグを取得
-                cursor.execute('''
-                    SELECT t.id, t.name
-                    FROM tags t
-                    JOIN manual_tags mt ON t.id = mt.tag_id
-                    WHERE mt.manual_id = ?
-                ''', (manual['id'],))
-                manual['tags'] = [dict(tag) for tag in cursor.fetchall()]
-                
-                # ステップ数を取得
-                cursor.execute('''
-                    SELECT COUNT(*) as count
-                    FROM manual_steps
-                    WHERE manual_id = ?
-                ''', (manual['id'],))
-                manual['step_count'] = cursor.fetchone()['count']
-                
+                del manual['total_count']
+                del manual['score']
+                step_count = manual.pop('step_count')
+                manual['tags'] = []
+                manual['step_count'] = step_count
                 manuals.append(manual)
             
-            # 総件数を取得
-            count_query = f'''
-                SELECT COUNT(DISTINCT m.id) as count
-                FROM manuals m
-                {tag_join}
-                WHERE {' AND '.join(where_conditions)}
-            '''
-            cursor.execute(count_query, tuple(query_params[:-2]))  # LIMIT/OFFSETを除く
-            total = cursor.fetchone()['count']
+            # ページ内の手順書のタグをまとめて取得
+            if manuals:
+                manuals_by_id = {manual['id']: manual for manual in manuals}
+                placeholders = ', '.join('?' * len(manuals_by_id))
+                cursor.execute(f'''
+                    SELECT mt.manual_id, t.id, t.name
+                    FROM manual_tags mt
+                    JOIN tags t ON t.id = mt.tag_id
+                    WHERE mt.manual_id IN ({placeholders})
+                    ORDER BY mt.id
+                ''', tuple(manuals_by_id))
+                for tag_row in cursor.fetchall():
+                    manuals_by_id[tag_row['manual_id']]['tags'].append({
+                        'id': tag_row['id'],
+                        'name': tag_row['name']
+                    })
+                
+                # 全文検索の一致箇所
+                if search_filter and search_filter.match_query:
+                    snippets = fetch_snippets(cursor, search_filter.match_query, list(manuals_by_id))
+                    for manual_id, manual in manuals_by_id.items():
+                        manual['snippet'] = snippets.get(manual_id)
+            
+            # 総件数
+            if use_cursor:
+                total = None
+            elif rows and rows[0]['total_count'] is not None:
+                total = rows[0]['total_count']
+            elif not rows and offset == 0:
+                total = 0
+            else:
+                # 最終ページより後ろを指定された場合、またはウィンドウ関数が使えない場合のみ件数を別途取得
+                count_query = f'''
+                    SELECT COUNT(*) as count
+                    FROM manuals m
+                    JOIN users u ON m.author_id = u.id
+                    {search_join}
+                    WHERE {' AND '.join(where_conditions)}
+                '''
+                cursor.execute(count_query, tuple(join_params + query_params))
+                total = cursor.fetchone()['count']
         
-        return json_response({
-            'manuals': manuals,
-            'pagination': {
+        if use_cursor:
+            pagination = {
+                'limit': limit,
+                'next_cursor': next_cursor
+            }
+        else:
+            pagination = {
                 'page': page,
                 'limit': limit,
                 'total': total,
                 'pages': (total + limit - 1) // limit if total > 0 else 0
             }
-        })
+        
+        return json_response({
+            'manuals': manuals,
+            'pagination': pagination
+        }, etag=etag, last_modified=last_modified)
         
     except Exception as e:
         return json_response({
@@ -166,4 +248,4 @@ def get_manuals():
         }, status=500)
 
 if __name__ == '__main__':
-    get_manuals()
+    run_cgi(get_manuals)
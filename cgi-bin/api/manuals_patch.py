@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+手順書部分更新API
+変更内容を JSON Patch 形式の操作の一覧で受け取り、変更された行だけを更新する
+（本文は操作の配列、または {"operations": [...], "version": 版数}）
+版数を本文の version で指定した場合、他の更新で版数が進んでいれば409と現在の内容を返す
+"""
+
+import sys
+import os
+
+# パスを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
+from common.database import get_db_connection
+from common.auth import get_cookie_value, get_session_user
+from common.utils import json_response, get_request_data, get_query_params, get_expected_version, conflict_response
+from common.manual_sync import VersionConflict, update_manual_row, sync_steps, sync_tags
+from common.manual_patch import MANUAL_FIELDS, PatchError, apply_patch, load_manual_document
+from common.wsgi import run_cgi
+
+def patch_manual(request):
+    """手順書を部分更新"""
+    try:
+        if request.method not in ('PATCH', 'POST'):
+            return json_response({'error': 'PATCH または POST で送信してください'}, status=400)
+
+        # 認証チェック
+        session_id = get_cookie_value(request, 'session_id')
+        current_user = get_session_user(session_id, verify=True)
+
+        if not current_user:
+            return json_response({'error': '認証が必要です'}, status=401)
+
+        # パラメータ取得
+        params = get_query_params(request)
+        manual_id = params.get('id')
+
+        if not manual_id:
+            return json_response({'error': '手順書IDが指定されていません'}, status=400)
+
+        manual_id = int(manual_id)
+
+        # リクエストデータ取得
+        data = get_request_data(request)
+        operations = data.get('operations') if isinstance(data, dict) else data
+        try:
+            expected_version = get_expected_version(data)
+        except ValueError:
+            return json_response({'error': '版数が不正です'}, status=400)
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            # 手順書が存在するか、編集権限があるか確認
+            cursor.execute('''
+                SELECT * FROM manuals
+                WHERE id = ? AND is_deleted = 0
+            ''', (manual_id,))
+
+            manual = cursor.fetchone()
+            if not manual:
+                return json_response({'error': '手順書が見つかりません'}, status=404)
+
+            # 作成者または管理者のみ編集可能
+            if manual['author_id'] != current_user['id'] and current_user['role'] != 'admin':
+                return json_response({'error': '編集権限がありません'}, status=403)
+
+            # 他の更新で版数が進んでいれば、現在の内容を返してクライアント側でマージさせる
+            original = load_manual_document(cursor, manual)
+            if expected_version is not None and expected_version != original['version']:
+                return conflict_response(original)
+
+            # 操作を適用した結果と現在の内容を比較する
+            try:
+                patched = apply_patch(original, operations)
+            except PatchError as e:
+                return json_response({'error': str(e)}, status=400)
+
+            changed_fields = [field for field in MANUAL_FIELDS if patched[field] != original[field]]
+            steps_changed = patched['steps'] != original['steps']
+            tags_changed = patched['tags'] != original['tags']
+
+            if not (changed_fields or steps_changed or tags_changed):
+                return json_response({
+                    'success': True,
+                    'message': '変更はありません',
+                    'changed': False,
+                    'version': original['version']
+                })
+
+            # 手順書の基本情報を更新（変更された項目のみ）し、版数を進める
+            try:
+                version = update_manual_row(cursor, manual_id,
+                                            {field: patched[field] for field in changed_fields},
+                                            expected_version)
+            except VersionConflict:
+                cursor.execute('SELECT * FROM manuals WHERE id = ?', (manual_id,))
+                return conflict_response(load_manual_document(cursor, cursor.fetchone()))
+
+            if steps_changed:
+                sync_steps(cursor, manual_id, patched['steps'])
+
+            if tags_changed:
+                sync_tags(cursor, manual_id, patched['tags'])
+
+            # 履歴を記録
+            cursor.execute('''
+                INSERT INTO manual_histories (manual_id, user_id, action, description)
+                VALUES (?, ?, 'updated', '手順書を更新しました')
+            ''', (manual_id, current_user['id']))
+
+            conn.commit()
+
+        return json_response({
+            'success': True,
+            'message': '手順書を更新しました',
+            'changed': True,
+            'version': version
+        })
+
+    except Exception as e:
+        return json_response({
+            'error': 'サーバーエラーが発生しました',
+            'details': str(e)
+        }, status=500)
+
+if __name__ == '__main__':
+    run_cgi(patch_manual)
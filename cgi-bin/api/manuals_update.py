@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 """
 手順書更新API
+版数を本文の version で指定した場合、他の更新で版数が進んでいれば409と現在の内容を返す
 """
 
 import sys
@@ -10,22 +11,31 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.database import get_db_connection
 from common.auth import get_cookie_value, get_session_user
-from common.utils import json_response, get_request_data, get_query_params
+from common.utils import json_response, get_request_data, get_query_params, get_expected_version, conflict_response
+from common.manual_sync import VersionConflict, update_manual_row, sync_steps, sync_tags
+from common.manual_patch import load_manual_document
+from common.wsgi import run_cgi
 
-def update_manual():
+def update_manual(request):
     """手順書を更新"""
     try:
         # 認証チェック
-        session_id = get_cookie_value('session_id')
-        current_user = get_session_user(session_id)
+        session_id = get_cookie_value(request, 'session_id')
+        current_user = get_session_user(session_id, verify=True)
         
         if not current_user:
             return json_response({'error': '認証が必要です'}, status=401)
         
         # パラメータ取得
-        params = get_query_params()
+        params = get_query_params(request)
         manual_id = params.get('id')
         
         if not manual_id:
@@ -34,7 +44,11 @@ def update_manual():
         manual_id = int(manual_id)
         
         # リクエストデータ取得
-        data = get_request_data()
+        data = get_request_data(request)
+        try:
+            expected_version = get_expected_version(data)
+        except ValueError:
+            return json_response({'error': '版数が不正です'}, status=400)
         
         with get_db_connection() as conn:
             cursor = conn.cursor()
@@ -53,81 +67,41 @@ def update_manual():
             if manual['author_id'] != current_user['id'] and current_user['role'] != 'admin':
                 return json_response({'error': '編集権限がありません'}, status=403)
             
+            # 他の更新で版数が進んでいれば、現在の内容を返してクライアント側でマージさせる
+            if expected_version is not None and expected_version != manual['version']:
+                return conflict_response(load_manual_document(cursor, manual))
+            
             # 更新フィールド
-            update_fields = []
-            update_values = []
+            update_values = {}
             
             if 'title' in data:
-                update_fields.append('title = ?')
-                update_values.append(data['title'])
+                update_values['title'] = data['title']
             
             if 'description' in data:
-                update_fields.append('description = ?')
-                update_values.append(data['description'])
+                update_values['description'] = data['description']
             
             if 'is_published' in data:
-                update_fields.append('is_published = ?')
-                update_values.append(data['is_published'])
+                update_values['is_published'] = data['is_published']
             
             if 'visibility' in data:
                 if data['visibility'] not in ['public', 'private', 'department']:
                     return json_response({'error': '公開範囲が不正です'}, status=400)
-                update_fields.append('visibility = ?')
-                update_values.append(data['visibility'])
+                update_values['visibility'] = data['visibility']
             
-            # 手順書の基本情報を更新
-            if update_fields:
-                update_fields.append("updated_at = datetime('now', 'localtime')")
-                update_values.append(manual_id)
-                
-                query = f"UPDATE manuals SET {', '.join(update_fields)} WHERE id = ?"
-                cursor.execute(query, update_values)
+            # 手順書の基本情報を更新し、版数を進める（ステップ・タグの変更より先に競合を確認する）
+            try:
+                version = update_manual_row(cursor, manual_id, update_values, expected_version)
+            except VersionConflict:
+                cursor.execute('SELECT * FROM manuals WHERE id = ?', (manual_id,))
+                return conflict_response(load_manual_document(cursor, cursor.fetchone()))
             
-            # ステップを更新
+            # ステップを更新（保存済みのステップとの差分だけを反映）
             if 'steps' in data:
-                # 既存のステップを削除
-                cursor.execute('DELETE FROM manual_steps WHERE manual_id = ?', (manual_id,))
-                
-                # 新しいステップを挿入
-                for i, step in enumerate(data['steps'], start=1):
-                    cursor.execute('''
-                        INSERT INTO manual_steps (manual_id, step_number, title, content, note, image_path)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
-                        manual_id,
-                        i,
-                        step.get('title', f'ステップ {i}'),
-                        step.get('content', ''),
-                        step.get('note', ''),
-                        step.get('image_path', '')
-                    ))
+                sync_steps(cursor, manual_id, data['steps'])
             
-            # タグを更新
+            # タグを更新（追加・削除されたタグだけを反映）
             if 'tags' in data:
-                # 既存のタグ関連を削除
-                cursor.execute('DELETE FROM manual_tags WHERE manual_id = ?', (manual_id,))
-                
-                # 新しいタグを処理
-                for tag_name in data['tags']:
-                    if not tag_name:
-                        continue
-                    
-                    # タグが存在するか確認
-                    cursor.execute('SELECT id FROM tags WHERE name = ?', (tag_name,))
-                    tag_row = cursor.fetchone()
-                    
-                    if tag_row:
-                        tag_id = tag_row['id']
-                    else:
-                        # 新しいタグを作成
-                        cursor.execute('INSERT INTO tags (name) VALUES (?)', (tag_name,))
-                        tag_id = cursor.lastrowid
-                    
-                    # 手順書とタグを関連付け
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO manual_tags (manual_id, tag_id)
-                        VALUES (?, ?)
-                    ''', (manual_id, tag_id))
+                sync_tags(cursor, manual_id, data['tags'])
             
             # 履歴を記録
             cursor.execute('''
@@ -139,7 +113,8 @@ def update_manual():
         
         return json_response({
             'success': True,
-            'message': '手順書を更新しました'
+            'message': '手順書を更新しました',
+            'version': version
         })
         
     except Exception as e:
@@ -149,4 +124,4 @@ def update_manual():
         }, status=500)
 
 if __name__ == '__main__':
-    update_manual()
+    run_cgi(update_manual)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+監視用メトリクスAPI
+リクエスト数・応答時間・ステータスコード・ロック待ちの失敗・アップロード量と、
+主なテーブルの行数を Prometheus のテキスト形式で返す
+
+環境変数 MF_METRICS_TOKEN を設定した場合は Authorization: Bearer <トークン> で取得できる
+（設定しない場合は管理者でログインしている場合のみ）
+"""
+
+import sys
+import os
+
+# パスを追加
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
+import hmac
+
+from common.database import get_db_connection
+from common.auth import get_cookie_value, get_session_user
+from common.utils import json_response
+from common.metrics import flush_metrics, load_counters, render_metrics, format_labels
+from common.wsgi import Response, run_cgi
+
+# Prometheus のテキスト形式
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 行数を出力するテーブル
+COUNTED_TABLES = ('manuals', 'manual_steps', 'view_logs', 'sessions')
+
+# スクレイプ用のトークン
+METRICS_TOKEN = os.environ.get('MF_METRICS_TOKEN', '')
+
+def has_valid_token(request):
+    """Authorization ヘッダーのトークンが MF_METRICS_TOKEN と一致するか"""
+    if not METRICS_TOKEN:
+        return False
+    scheme, _, token = (request.header('Authorization') or '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip().encode('utf-8'),
+                                                               METRICS_TOKEN.encode('utf-8'))
+
+def get_database_gauges():
+    """テーブルの行数とデータベースファイルのサイズ"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        rows = []
+        for table in COUNTED_TABLES:
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            rows.append((format_labels(table=table), cursor.fetchone()[0]))
+
+        cursor.execute('PRAGMA page_count')
+        page_count = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+
+    return [
+        ('mf_table_rows', 'テーブルの行数', rows),
+        ('mf_database_size_bytes', 'データベースファイルのサイズ（バイト）', [('', page_count * page_size)]),
+    ]
+
+def get_metrics(request):
+    """メトリクスを取得"""
+    try:
+        # トークンまたは管理者のセッションで認証
+        if not has_valid_token(request):
+            session_id = get_cookie_value(request, 'session_id')
+            current_user = get_session_user(session_id)
+
+            if not current_user:
+                return json_response({'error': '認証が必要です'}, status=401)
+
+            if current_user['role'] != 'admin':
+                return json_response({'error': '管理者権限が必要です'}, status=403)
+
+        # このプロセスで集計中の値も含める
+        flush_metrics()
+        body = render_metrics(load_counters(), get_database_gauges())
+
+        response = Response(body, content_type=CONTENT_TYPE)
+        response.add_header('Cache-Control', 'no-store')
+        return response
+
+    except Exception as e:
+        return json_response({
+            'error': 'サーバーエラーが発生しました',
+            'details': str(e)
+        }, status=500)
+
+if __name__ == '__main__':
+    run_cgi(get_metrics)
@@ -6,20 +6,24 @@
 
 import sys
 import os
-import cgi
 
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from common.auth import get_cookie_value, get_session_user
-from common.utils import json_response, sanitize_filename
-from datetime import datetime
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
 
-# アップロードディレクトリ
-UPLOAD_DIR = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
-    'uploads', 'images'
-)
+from common.auth import get_cookie_value, get_session_user
+from common.database import get_db_connection
+from common.utils import json_response, get_query_params, sanitize_filename
+from common.multipart import parse_multipart, MultipartError, PartTooLarge
+from common.imagestore import find_image, store_image, is_sha256, IMAGES_URL_PATH
+from common.imageinfo import identify_image_file
+from common import metrics
+from common.wsgi import run_cgi
 
 # 許可する拡張子
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
@@ -27,87 +31,119 @@ ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
 # 最大ファイルサイズ（5MB）
 MAX_FILE_SIZE = 5 * 1024 * 1024
 
-def upload_image():
-    """画像をアップロード"""
+# リクエスト全体の最大サイズ（ファイル + 区切り・ヘッダーなどの余裕）
+MAX_REQUEST_SIZE = MAX_FILE_SIZE + 64 * 1024
+
+def file_too_large_response():
+    return json_response({
+        'error': f'ファイルサイズが大きすぎます。最大{MAX_FILE_SIZE // (1024 * 1024)}MBまでです'
+    }, status=400)
+
+def get_app_root(request):
+    """リクエストパスからアプリケーションルートを特定"""
+    script_name = request.environ.get('SCRIPT_NAME', '')
+    # /test/manual_factory/cgi-bin/api/upload_image.py のようなパスから
+    # /test/manual_factory を抽出する
+    script_suffix = '/cgi-bin/api/upload_image.py'
+    if script_name.endswith(script_suffix):
+        return script_name[:-len(script_suffix)]
+    if script_name.startswith('/cgi-bin/'):
+        # ルート配置時のフォールバック
+        return ''
+    if script_name:
+        # 想定外の配置でも upload_image.py までを除去してベースパスを使う
+        return script_name.rsplit('/cgi-bin/', 1)[0]
+    return ''
+
+def image_response(request, image, message, duplicate):
+    """保存済みの画像のパスを返す（アプリケーションルートを考慮した相対パス）"""
+    return json_response({
+        'success': True,
+        'message': message,
+        'filename': image['path'].rsplit('/', 1)[-1],
+        'path': get_app_root(request) + IMAGES_URL_PATH + image['path'],
+        'sha256': image['sha256'],
+        'width': image['width'],
+        'height': image['height'],
+        'format': image['format'],
+        'duplicate': duplicate
+    })
+
+def upload_image(request):
+    """
+    画像をアップロード
+    
+    クエリパラメータ sha256 を指定した場合はアップロードせず、
+    同じ内容の画像が保存済みかどうかだけを確認する
+    """
     try:
         # 認証チェック
-        session_id = get_cookie_value('session_id')
-        current_user = get_session_user(session_id)
+        session_id = get_cookie_value(request, 'session_id')
+        current_user = get_session_user(session_id, verify=True)
         
         if not current_user:
             return json_response({'error': '認証が必要です'}, status=401)
         
-        # フォームデータを取得
-        form = cgi.FieldStorage()
-        
-        if 'image' not in form:
-            return json_response({'error': '画像ファイルが指定されていません'}, status=400)
-        
-        file_item = form['image']
+        # 保存済みかどうかの確認（クライアントで計算したSHA-256）
+        digest = get_query_params(request).get('sha256')
+        if digest is not None:
+            digest = digest.lower()
+            if not is_sha256(digest):
+                return json_response({'error': 'sha256 の形式が不正です'}, status=400)
+            with get_db_connection() as conn:
+                image = find_image(conn.cursor(), digest, touch=True)
+            if not image:
+                return json_response({'success': True, 'exists': False})
+            return image_response(request, image, '同じ画像が保存済みです', True)
         
-        # ファイルが選択されているか確認
-        if not file_item.filename:
-            return json_response({'error': 'ファイルが選択されていません'}, status=400)
+        # フォームデータを取得（一時ファイルに書き出しながら読み込み、上限を超えた時点で中止）
+        try:
+            form = parse_multipart(request, MAX_FILE_SIZE, max_content_length=MAX_REQUEST_SIZE)
+        except PartTooLarge:
+            metrics.increment('mf_uploads_total', result='rejected')
+            return file_too_large_response()
+        except MultipartError as e:
+            return json_response({'error': f'フォームデータが不正です: {e}'}, status=400)
         
-        # ファイル名をサニタイズ
-        original_filename = os.path.basename(file_item.filename)
-        safe_filename = sanitize_filename(original_filename)
+        with form:
+            if 'image' not in form.files:
+                return json_response({'error': '画像ファイルが指定されていません'}, status=400)
+            
+            file_item = form.files['image']
+            
+            # ファイルが選択されているか確認
+            if not file_item.filename:
+                return json_response({'error': 'ファイルが選択されていません'}, status=400)
+            
+            # ファイル名をサニタイズ
+            original_filename = os.path.basename(file_item.filename.replace('\\', '/'))
+            safe_filename = sanitize_filename(original_filename)
+            
+            # 拡張子をチェック
+            _, ext = os.path.splitext(safe_filename.lower())
+            if ext not in ALLOWED_EXTENSIONS:
+                metrics.increment('mf_uploads_total', result='rejected')
+                return json_response({
+                    'error': f'許可されていないファイル形式です。使用可能: {", ".join(ALLOWED_EXTENSIONS)}'
+                }, status=400)
+            
+            # ヘッダーから形式と幅・高さを取得（画像として認識できないファイルは受け付けない）
+            info = identify_image_file(file_item.path)
+            if info is None:
+                metrics.increment('mf_uploads_total', result='rejected')
+                return json_response({'error': '画像ファイルとして認識できません'}, status=400)
+            
+            # 内容のSHA-256で保存（同じ画像が保存済みであれば既存のパスを返す）
+            with get_db_connection() as conn:
+                image, created = store_image(conn.cursor(), file_item, info)
+            
+            # 監視用に受信した量を集計（保存済みの画像と同じ内容でも受信した分は数える）
+            metrics.increment('mf_uploads_total', result='created' if created else 'duplicate')
+            metrics.increment('mf_upload_bytes_total', file_item.size)
         
-        # 拡張子をチェック
-        _, ext = os.path.splitext(safe_filename.lower())
-        if ext not in ALLOWED_EXTENSIONS:
-            return json_response({
-                'error': f'許可されていないファイル形式です。使用可能: {", ".join(ALLOWED_EXTENSIONS)}'
-            }, status=400)
-        
-        # ファイルデータを読み込み
-        file_data = file_item.file.read()
-        
-        # ファイルサイズをチェック
-        if len(file_data) > MAX_FILE_SIZE:
-            return json_response({
-                'error': f'ファイルサイズが大きすぎます。最大{MAX_FILE_SIZE // (1024 * 1024)}MBまでです'
-            }, status=400)
-        
-        # タイムスタンプを追加してユニークにする
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        name, ext = os.path.splitext(safe_filename)
-        unique_filename = f'{name}_{timestamp}{ext}'
-        
-        # 保存先パス
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        filepath = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # ファイルを保存
-        with open(filepath, 'wb') as f:
-            f.write(file_data)
-        
-        # 相対パスを返す
-        # アプリケーションルートを考慮してパスを生成
-        # リクエストパスからアプリケーションルートを特定
-        import os as os_module
-        script_name = os_module.environ.get('SCRIPT_NAME', '')
-        # /test/manual_factory/cgi-bin/api/upload_image.py のようなパスから
-        # /test/manual_factory を抽出する
-        script_suffix = '/cgi-bin/api/upload_image.py'
-        app_root = ''
-        if script_name.endswith(script_suffix):
-            app_root = script_name[:-len(script_suffix)]
-        elif script_name.startswith('/cgi-bin/'):
-            # ルート配置時のフォールバック
-            app_root = ''
-        elif script_name:
-            # 想定外の配置でも upload_image.py までを除去してベースパスを使う
-            app_root = script_name.rsplit('/cgi-bin/', 1)[0]
-
-        relative_path = f'{app_root}/uploads/images/{unique_filename}'
-        
-        return json_response({
-            'success': True,
-            'message': '画像をアップロードしました',
-            'filename': unique_filename,
-            'path': relative_path
-        })
+        if created:
+            return image_response(request, image, '画像をアップロードしました', False)
+        return image_response(request, image, '同じ画像が保存済みです', True)
         
     except Exception as e:
         return json_response({
@@ -116,4 +152,4 @@ def upload_image():
         }, status=500)
 
 if __name__ == '__main__':
-    upload_image()
+    run_cgi(upload_image)
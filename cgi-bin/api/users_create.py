@@ -10,16 +10,23 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.database import get_db_connection
 from common.auth import get_cookie_value, get_session_user, hash_password
 from common.utils import json_response, get_request_data, validate_required_fields, validate_email
+from common.wsgi import run_cgi
 
-def create_user():
+def create_user(request):
     """ユーザーを作成"""
     try:
         # 認証チェック（管理者のみ）
-        session_id = get_cookie_value('session_id')
-        current_user = get_session_user(session_id)
+        session_id = get_cookie_value(request, 'session_id')
+        current_user = get_session_user(session_id, verify=True)
         
         if not current_user:
             return json_response({'error': '認証が必要です'}, status=401)
@@ -28,7 +35,7 @@ def create_user():
             return json_response({'error': '管理者権限が必要です'}, status=403)
         
         # リクエストデータ取得
-        data = get_request_data()
+        data = get_request_data(request)
         
         # バリデーション
         valid, error = validate_required_fields(data, ['email', 'name', 'password', 'role'])
@@ -83,4 +90,4 @@ def create_user():
         }, status=500)
 
 if __name__ == '__main__':
-    create_user()
+    run_cgi(create_user)
@@ -10,16 +10,23 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.database import get_db_connection
 from common.auth import get_cookie_value, get_session_user
 from common.utils import json_response, get_query_params
+from common.wsgi import run_cgi
 
-def delete_user():
+def delete_user(request):
     """ユーザーを削除（論理削除）"""
     try:
         # 認証チェック（管理者のみ）
-        session_id = get_cookie_value('session_id')
-        current_user = get_session_user(session_id)
+        session_id = get_cookie_value(request, 'session_id')
+        current_user = get_session_user(session_id, verify=True)
         
         if not current_user:
             return json_response({'error': '認証が必要です'}, status=401)
@@ -28,7 +35,7 @@ def delete_user():
             return json_response({'error': '管理者権限が必要です'}, status=403)
         
         # パラメータ取得
-        params = get_query_params()
+        params = get_query_params(request)
         user_id = params.get('id')
         
         if not user_id:
@@ -71,4 +78,4 @@ def delete_user():
         }, status=500)
 
 if __name__ == '__main__':
-    delete_user()
+    run_cgi(delete_user)
@@ -10,26 +10,38 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.database import get_db_connection
 from common.auth import get_cookie_value, get_session_user
 from common.utils import json_response, get_query_params
+from common.pagination import encode_cursor, decode_cursor, keyset_condition, InvalidCursor
+from common.wsgi import run_cgi
 
-def get_users():
+def get_users(request):
     """ユーザー一覧を取得"""
     try:
         # 認証チェック
-        session_id = get_cookie_value('session_id')
+        session_id = get_cookie_value(request, 'session_id')
         current_user = get_session_user(session_id)
         
         if not current_user:
             return json_response({'error': '認証が必要です'}, status=401)
         
         # クエリパラメータ取得
-        params = get_query_params()
+        params = get_query_params(request)
         page = int(params.get('page', '1'))
         limit = int(params.get('limit', '20'))
         search = params.get('search', '')
         
+        # cursor パラメータがある場合はキーセットページネーション（空文字は先頭ページ）
+        page_cursor = params.get('cursor')
+        use_cursor = page_cursor is not None
+        
         offset = (page - 1) * limit
         
         # ユーザー一覧を取得
@@ -37,49 +49,64 @@ def get_users():
             cursor = conn.cursor()
             
             # 検索条件
+            where_conditions = ['is_deleted = 0']
+            query_params = []
             if search:
-                query = '''
-                    SELECT id, email, name, role, department, created_at, updated_at
-                    FROM users
-                    WHERE is_deleted = 0
-                    AND (name LIKE ? OR email LIKE ? OR department LIKE ?)
-                    ORDER BY created_at DESC
-                    LIMIT ? OFFSET ?
-                '''
                 search_pattern = f'%{search}%'
-                cursor.execute(query, (search_pattern, search_pattern, search_pattern, limit, offset))
+                where_conditions.append('(name LIKE ? OR email LIKE ? OR department LIKE ?)')
+                query_params.extend([search_pattern, search_pattern, search_pattern])
+            
+            page_conditions = list(where_conditions)
+            page_params = list(query_params)
+            if use_cursor:
+                # 総件数は数えず、次ページの有無を判定するため1件多く取得する
+                if page_cursor:
+                    try:
+                        after_value, after_id = decode_cursor(page_cursor, 'created_at', 'DESC')
+                    except InvalidCursor as e:
+                        return json_response({'error': str(e)}, status=400)
+                    page_conditions.append(keyset_condition('created_at', 'id', 'DESC'))
+                    page_params.extend([after_value, after_id])
+                page_params.extend([limit + 1, 0])
             else:
-                query = '''
-                    SELECT id, email, name, role, department, created_at, updated_at
-                    FROM users
-                    WHERE is_deleted = 0
-                    ORDER BY created_at DESC
-                    LIMIT ? OFFSET ?
-                '''
-                cursor.execute(query, (limit, offset))
+                page_params.extend([limit, offset])
+            
+            cursor.execute(f'''
+                SELECT id, email, name, role, department, created_at, updated_at
+                FROM users
+                WHERE {' AND '.join(page_conditions)}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ? OFFSET ?
+            ''', tuple(page_params))
             
             users = [dict(row) for row in cursor.fetchall()]
             
-            # 総件数を取得
-            if search:
-                cursor.execute('''
-                    SELECT COUNT(*) as count FROM users
-                    WHERE is_deleted = 0
-                    AND (name LIKE ? OR email LIKE ? OR department LIKE ?)
-                ''', (search_pattern, search_pattern, search_pattern))
+            if use_cursor:
+                next_cursor = None
+                if len(users) > limit:
+                    users = users[:limit]
+                    next_cursor = encode_cursor('created_at', 'DESC', users[-1]['created_at'], users[-1]['id'])
+                pagination = {
+                    'limit': limit,
+                    'next_cursor': next_cursor
+                }
             else:
-                cursor.execute('SELECT COUNT(*) as count FROM users WHERE is_deleted = 0')
-            
-            total = cursor.fetchone()['count']
+                # 総件数を取得
+                cursor.execute(f'''
+                    SELECT COUNT(*) as count FROM users
+                    WHERE {' AND '.join(where_conditions)}
+                ''', tuple(query_params))
+                total = cursor.fetchone()['count']
+                pagination = {
+                    'page': page,
+                    'limit': limit,
+                    'total': total,
+                    'pages': (total + limit - 1) // limit
+                }
         
         return json_response({
             'users': users,
-            'pagination': {
-                'page': page,
-                'limit': limit,
-                'total': total,
-                'pages': (total + limit - 1) // limit
-            }
+            'pagination': pagination
         })
         
     except Exception as e:
@@ -89,4 +116,4 @@ def get_users():
         }, status=500)
 
 if __name__ == '__main__':
-    get_users()
+    run_cgi(get_users)
@@ -10,23 +10,30 @@ import os
 # パスを追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from common.shim import forward_to_daemon
+
+# 常駐デーモンが起動していれば転送して終了
+if __name__ == '__main__' and forward_to_daemon():
+    sys.exit(0)
+
 from common.database import get_db_connection
-from common.auth import get_cookie_value, get_session_user, hash_password
+from common.auth import get_cookie_value, get_session_user, hash_password, refresh_session_cookies
 from common.utils import json_response, get_request_data, validate_email, get_query_params
+from common.wsgi import run_cgi
 
-def update_user():
+def update_user(request):
     """ユーザー情報を更新"""
     try:
         # 認証チェック
-        session_id = get_cookie_value('session_id')
-        current_user = get_session_user(session_id)
+        session_id = get_cookie_value(request, 'session_id')
+        current_user = get_session_user(session_id, verify=True)
         
         if not current_user:
             return json_response({'error': '認証が必要です'}, status=401)
         
         # リクエストデータ取得
-        data = get_request_data()
-        params = get_query_params()
+        data = get_request_data(request)
+        params = get_query_params(request)
         
         # 更新対象のユーザーID
         target_user_id = params.get('id')
@@ -96,11 +103,17 @@ def update_user():
             
             query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
             cursor.execute(query, update_values)
+            
+            # 自分自身のパスワード等を変更した場合は署名付きトークンを再発行する
+            cookies = []
+            if target_user_id == current_user['id']:
+                cursor.execute('SELECT * FROM users WHERE id = ?', (target_user_id,))
+                cookies = refresh_session_cookies(session_id, cursor.fetchone())
         
         return json_response({
             'success': True,
             'message': 'ユーザー情報を更新しました'
-        })
+        }, cookies=cookies)
         
     except Exception as e:
         return json_response({
@@ -109,4 +122,4 @@ def update_user():
         }, status=500)
 
 if __name__ == '__main__':
-    update_user()
+    run_cgi(update_user)
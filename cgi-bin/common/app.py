@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+WSGIアプリケーション
+全APIエンドポイントを1つのWSGIアプリケーションとして公開する
+wsgiref・常駐デーモン・任意のWSGIホストから `application` を利用できる
+
+使い方（開発用サーバー）:
+    python cgi-bin/common/app.py --port 8000
+    python cgi-bin/common/app.py --port 8000 --workers 4   # プリフォーク（Linuxのみ）
+"""
+
+import os
+import sys
+import json
+import argparse
+import importlib.util
+import traceback
+
+if __name__ == '__main__':
+    # CGIとして呼び出された場合はサーバーを起動しない
+    if os.environ.get('REQUEST_METHOD'):
+        print('Status: 404 Not Found')
+        print()
+        sys.exit(0)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.wsgi import STATUS_MESSAGES, process_request
+
+# APIディレクトリ
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+
+# エンドポイント名と処理関数名の対応
+ROUTES = {
+    'auth_login': 'login',
+    'auth_logout': 'logout',
+    'auth_me': 'get_current_user',
+    'manuals_create': 'create_manual',
+    'manuals_delete': 'delete_manual',
+    'manuals_get': 'get_manual',
+    'manuals_list': 'get_manuals',
+    'manuals_patch': 'patch_manual',
+    'manuals_update': 'update_manual',
+    'metrics': 'get_metrics',
+    'upload_image': 'upload_image',
+    'users_create': 'create_user',
+    'users_delete': 'delete_user',
+    'users_list': 'get_users',
+    'users_update': 'update_user',
+}
+
+
+def load_handlers(routes=ROUTES):
+    """全APIモジュールを読み込み、エンドポイント名と処理関数の辞書を返す"""
+    handlers = {}
+    for endpoint, func_name in routes.items():
+        path = os.path.join(API_DIR, f'{endpoint}.py')
+        spec = importlib.util.spec_from_file_location(f'mf_api_{endpoint}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        handlers[endpoint] = getattr(module, func_name)
+    return handlers
+
+
+def resolve_endpoint(environ):
+    """
+    リクエストパスからエンドポイント名を解決する
+
+    /manual_factory/cgi-bin/api/manuals_list.py や /api/manuals_list のどちらにも対応する
+    常駐デーモン経由の場合はシムが指定した MF_ENDPOINT を優先する
+    """
+    endpoint = environ.get('MF_ENDPOINT')
+    if endpoint:
+        return endpoint
+
+    path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+    _, found, rest = path.rpartition('/api/')
+    if not found:
+        return None
+    name = rest.split('/', 1)[0]
+    if name.endswith('.py'):
+        name = name[:-3]
+    return name
+
+
+class Application:
+    """パスでハンドラーを振り分けるWSGIアプリケーション"""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+
+    def __call__(self, environ, start_response):
+        endpoint = resolve_endpoint(environ)
+        handler = self.handlers.get(endpoint)
+        if handler is None:
+            return self.error(start_response, 404, 'エンドポイントが見つかりません')
+
+        try:
+            response = process_request(handler, environ, endpoint)
+        except Exception:
+            traceback.print_exc(file=environ.get('wsgi.errors', sys.stderr))
+            return self.error(start_response, 500, 'サーバーエラーが発生しました')
+
+        start_response(response.status_line, response.headers)
+        return [response.body]
+
+    @staticmethod
+    def error(start_response, status, message):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        start_response(f'{status} {STATUS_MESSAGES[status]}', [
+            ('Content-Type', 'application/json; charset=utf-8'),
+        ])
+        return [body]
+
+
+def create_app():
+    """全ハンドラーを読み込んだWSGIアプリケーションを作成"""
+    return Application(load_handlers())
+
+
+# WSGIホストから参照されるアプリケーション
+application = create_app()
+
+
+def main():
+    from wsgiref.simple_server import make_server, WSGIServer
+    from common.wsgi import ThreadPoolMixIn, serve_preforked
+    from common.viewlog import start_background_flusher
+
+    parser = argparse.ArgumentParser(description='Manual Factory WSGIサーバー（開発・検証用）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--threads', type=int, default=8, help='ワーカーごとのスレッド数')
+    parser.add_argument('--workers', type=int, default=1, help='プリフォークするプロセス数（Linuxのみ）')
+    args = parser.parse_args()
+
+    class Server(ThreadPoolMixIn, WSGIServer):
+        pool_size = args.threads
+
+    server = make_server(args.host, args.port, application, server_class=Server)
+    # 閲覧ログを定期的に反映する（プリフォーク時は親プロセスが担当）
+    start_background_flusher()
+    print(f'Manual Factory WSGI server on http://{args.host}:{args.port}/cgi-bin/api/', file=sys.stderr)
+    serve_preforked(server, args.workers)
+
+
+if __name__ == '__main__':
+    main()
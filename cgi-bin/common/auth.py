@@ -4,16 +4,35 @@
 認証・セッション管理モジュール
 """
 
-import hashlib
-import uuid
 import os
-import http.cookies
+import json
+import time
+import hashlib
 from datetime import datetime, timedelta
-from .database import get_db_connection
+from .database import get_db_connection, DB_PATH
+from . import timing
+from .utils import json_response
 
 # セッション有効期限（時間）
 SESSION_LIFETIME_HOURS = 24
 
+# セッション方式（環境変数 MF_SESSION_MODE で指定）
+#   database: セッションIDをCookieに保存し、リクエストごとに sessions テーブルを参照（既定）
+#   signed: 署名付きトークンをCookieに保存し、読み取り系のリクエストではDBを参照しない
+SESSION_MODE = os.environ.get('MF_SESSION_MODE', 'database')
+
+# 署名付きトークンの形式バージョン（Cookie値の接頭辞）
+SIGNED_TOKEN_PREFIX = 'v1.'
+
+# 署名付きトークンを発行してからDBでユーザーの状態を再確認するまでの間隔（秒）
+SESSION_RECHECK_SECONDS = int(os.environ.get('MF_SESSION_RECHECK_SECONDS', '300'))
+
+# 署名用の秘密鍵ファイル（環境変数 MF_SESSION_SECRET で直接指定することも可能）
+SESSION_SECRET_PATH = os.path.join(os.path.dirname(DB_PATH), 'session_secret.key')
+
+# 読み込み済みの秘密鍵
+_session_secret = None
+
 def hash_password(password):
     """パスワードをSHA-256でハッシュ化"""
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
@@ -22,8 +41,113 @@ def verify_password(password, password_hash):
     """パスワードを検証"""
     return hash_password(password) == password_hash
 
+def get_session_secret():
+    """署名用の秘密鍵を取得（初回はランダムに生成してファイルに保存）"""
+    global _session_secret
+    if _session_secret is not None:
+        return _session_secret
+
+    secret = os.environ.get('MF_SESSION_SECRET')
+    if secret:
+        _session_secret = secret.encode('utf-8')
+        return _session_secret
+
+    if not os.path.exists(SESSION_SECRET_PATH):
+        _create_session_secret()
+
+    with open(SESSION_SECRET_PATH, 'r', encoding='ascii') as f:
+        secret = f.read().strip()
+    if not secret:
+        raise RuntimeError(f'セッションの秘密鍵が空です: {SESSION_SECRET_PATH}')
+    _session_secret = secret.encode('ascii')
+    return _session_secret
+
+def _create_session_secret():
+    """
+    秘密鍵ファイルを作成する
+    同じディレクトリの一時ファイルに書き込んでから公開し、作成途中の空のファイルを他のプロセスに読ませない
+    複数のプロセスが同時に作成した場合は、先に公開された鍵を全員が使う
+    """
+    import tempfile
+
+    fd, temp_path = tempfile.mkstemp(prefix='session_secret.', suffix='.tmp',
+                                     dir=os.path.dirname(SESSION_SECRET_PATH))
+    try:
+        with os.fdopen(fd, 'w', encoding='ascii') as f:
+            f.write(os.urandom(32).hex())
+        try:
+            # リンクは既存のファイルを上書きしない
+            os.link(temp_path, SESSION_SECRET_PATH)
+        except FileExistsError:
+            pass
+        except OSError:
+            # ハードリンクに対応していないファイルシステム
+            if not os.path.exists(SESSION_SECRET_PATH):
+                os.replace(temp_path, SESSION_SECRET_PATH)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# hmac・base64 は署名付きトークン、uuid はセッションの作成（ログイン）でのみ使うため、使う関数内で読み込む
+# （ゲストの閲覧などのCGIの起動時間を短くするため）
+
+def _b64encode(data):
+    import base64
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def _b64decode(text):
+    import base64
+    return base64.urlsafe_b64decode((text + '=' * (-len(text) % 4)).encode('ascii'))
+
+def _sign(message):
+    import hmac
+    return _b64encode(hmac.new(get_session_secret(), message.encode('ascii'), hashlib.sha256).digest())
+
+def is_signed_token(session_id):
+    """Cookie値が署名付きトークンかどうか"""
+    return bool(session_id) and session_id.startswith(SIGNED_TOKEN_PREFIX)
+
+def create_signed_token(user):
+    """ユーザー情報（id, role, session_generation）から署名付きトークンを作成"""
+    now = int(time.time())
+    payload = {
+        'uid': user['id'],
+        'role': user['role'],
+        'gen': user['session_generation'] or 0,
+        'iat': now,
+        'exp': now + SESSION_LIFETIME_HOURS * 3600
+    }
+    body = SIGNED_TOKEN_PREFIX + _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    return f'{body}.{_sign(body)}'
+
+def parse_signed_token(token):
+    """署名と有効期限を検証してトークンの内容を返す（不正・期限切れの場合は None）"""
+    import hmac
+
+    body, _, signature = token.rpartition('.')
+    if not body.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        if not hmac.compare_digest(signature.encode('ascii'), _sign(body).encode('ascii')):
+            return None
+        payload = json.loads(_b64decode(body[len(SIGNED_TOKEN_PREFIX):]).decode('utf-8'))
+    except ValueError:
+        # 非ASCII文字・base64/JSONの形式不正（UnicodeError も ValueError の派生）
+        return None
+    if payload.get('exp', 0) <= time.time():
+        return None
+    return payload
+
 def create_session(user_id):
     """新しいセッションを作成"""
+    if SESSION_MODE == 'signed':
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, role, session_generation FROM users WHERE id = ?', (user_id,))
+            return create_signed_token(cursor.fetchone())
+
+    import uuid
+
     session_id = str(uuid.uuid4())
     expires_at = datetime.now() + timedelta(hours=SESSION_LIFETIME_HOURS)
     
@@ -36,11 +160,37 @@ def create_session(user_id):
     
     return session_id
 
-def get_session_user(session_id):
-    """セッションIDからユーザー情報を取得"""
+def get_session_user(session_id, verify=False):
+    """
+    セッションIDからユーザー情報を取得
+
+    署名付きトークンの場合、verify が False かつ発行から SESSION_RECHECK_SECONDS 以内であれば
+    DBを参照せずにトークンの内容（id, role）だけを返す
+    更新系の処理では verify=True を指定し、DBでユーザーの削除・権限変更を確認する
+    """
     if not session_id:
         return None
-    
+
+    with timing.phase('auth'):
+        return _get_session_user(session_id, verify)
+
+def _get_session_user(session_id, verify):
+    if is_signed_token(session_id):
+        payload = parse_signed_token(session_id)
+        if payload is None:
+            return None
+        if not verify and time.time() - payload['iat'] < SESSION_RECHECK_SECONDS:
+            return {'id': payload['uid'], 'role': payload['role']}
+
+        # 削除・権限変更・パスワード変更で世代が進んでいれば無効
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE id = ? AND is_deleted = 0', (payload['uid'],))
+            row = cursor.fetchone()
+        if not row or (row['session_generation'] or 0) != payload['gen']:
+            return None
+        return dict(row)
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
@@ -55,8 +205,29 @@ def get_session_user(session_id):
             return dict(row)
         return None
 
+def refresh_session_cookies(session_id, user):
+    """
+    署名付きトークンを再発行するCookieのリストを返す（DBセッションの場合は空）
+    user はDBから取得したユーザー情報（get_session_user(..., verify=True) の戻り値）
+    """
+    if not is_signed_token(session_id):
+        return []
+    return [set_cookie('session_id', create_signed_token(user), expires_hours=SESSION_LIFETIME_HOURS)]
+
 def delete_session(session_id):
     """セッションを削除（ログアウト）"""
+    if is_signed_token(session_id):
+        # 署名付きトークンは世代を進め、そのユーザーに発行済みのトークンをすべて無効にする
+        payload = parse_signed_token(session_id)
+        if payload:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE users SET session_generation = session_generation + 1
+                    WHERE id = ? AND session_generation = ?
+                ''', (payload['uid'], payload['gen']))
+        return
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
@@ -67,15 +238,9 @@ def cleanup_expired_sessions():
         cursor = conn.cursor()
         cursor.execute("DELETE FROM sessions WHERE expires_at <= datetime('now', 'localtime')")
 
-def get_cookie_value(cookie_name):
+def get_cookie_value(request, cookie_name):
     """Cookieから値を取得"""
-    cookie_string = os.environ.get('HTTP_COOKIE', '')
-    cookie = http.cookies.SimpleCookie()
-    cookie.load(cookie_string)
-    
-    if cookie_name in cookie:
-        return cookie[cookie_name].value
-    return None
+    return request.cookies.get(cookie_name)
 
 def set_cookie(name, value, expires_hours=24):
     """Cookie設定用のヘッダー文字列を生成"""
@@ -89,41 +254,29 @@ def delete_cookie(name):
 
 def require_auth(func):
     """認証が必要な関数のデコレータ"""
-    def wrapper(*args, **kwargs):
-        session_id = get_cookie_value('session_id')
-        user = get_session_user(session_id)
+    def wrapper(request, *args, **kwargs):
+        session_id = get_cookie_value(request, 'session_id')
+        user = get_session_user(session_id, verify=request.method != 'GET')
         
         if not user:
-            return {
-                'status': 401,
-                'error': 'Unauthorized',
-                'message': '認証が必要です'
-            }
+            return json_response({'error': '認証が必要です'}, status=401)
         
-        return func(user, *args, **kwargs)
+        return func(request, user, *args, **kwargs)
     
     return wrapper
 
 def require_admin(func):
     """管理者権限が必要な関数のデコレータ"""
-    def wrapper(*args, **kwargs):
-        session_id = get_cookie_value('session_id')
-        user = get_session_user(session_id)
+    def wrapper(request, *args, **kwargs):
+        session_id = get_cookie_value(request, 'session_id')
+        user = get_session_user(session_id, verify=request.method != 'GET')
         
         if not user:
-            return {
-                'status': 401,
-                'error': 'Unauthorized',
-                'message': '認証が必要です'
-            }
+            return json_response({'error': '認証が必要です'}, status=401)
         
         if user['role'] != 'admin':
-            return {
-                'status': 403,
-                'error': 'Forbidden',
-                'message': '管理者権限が必要です'
-            }
+            return json_response({'error': '管理者権限が必要です'}, status=403)
         
-        return func(user, *args, **kwargs)
+        return func(request, user, *args, **kwargs)
     
     return wrapper
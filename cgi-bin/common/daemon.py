@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+常駐アプリケーションデーモン
+全APIハンドラーを事前に読み込み、CGIシム（common.shim）から転送されたリクエストを
+WSGIアプリケーション（common.app）で処理する
+
+使い方:
+    python cgi-bin/common/daemon.py --bind 127.0.0.1:9310
+    python cgi-bin/common/daemon.py --bind unix:/run/manual_factory.sock
+"""
+
+import os
+import sys
+import json
+import socket
+import struct
+import argparse
+import signal
+import socketserver
+import traceback
+
+if __name__ == '__main__':
+    # CGIとして呼び出された場合はデーモンを起動しない
+    if os.environ.get('REQUEST_METHOD'):
+        print('Status: 404 Not Found')
+        print()
+        sys.exit(0)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import shim
+from common.app import application
+from common.wsgi import LimitedInput, ThreadPoolMixIn, render_cgi
+from common.viewlog import start_background_flusher
+
+
+def error_output(status, message):
+    """デーモン側で発生したエラーのCGI出力を生成"""
+    body = json.dumps({'error': message}, ensure_ascii=False)
+    return (
+        f'Status: {status}\r\n'
+        'Content-Type: application/json; charset=utf-8\r\n\r\n'
+        f'{body}'
+    ).encode('utf-8')
+
+
+def wsgi_environ(environ, stdin):
+    """転送されたCGI環境変数と本文の入力ストリームからWSGI environ を作成"""
+    environ = dict(environ)
+    environ.update({
+        'wsgi.input': stdin,
+        'wsgi.errors': sys.stderr,
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.url_scheme': 'https' if environ.get('HTTPS', 'off').lower() in ('on', '1') else 'http',
+    })
+    return environ
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """シムから転送された1リクエストを処理"""
+
+    def handle(self):
+        header = self.rfile.read(shim.HEADER_SIZE)
+        if len(header) < shim.HEADER_SIZE:
+            return
+        env_length, body_length = struct.unpack(shim.HEADER_FORMAT, header)
+        environ = json.loads(self.rfile.read(env_length).decode('utf-8'))
+        # 本文はハンドラーが読む分だけソケットから受信する
+        stdin = LimitedInput(self.rfile.read, body_length)
+
+        try:
+            output = render_cgi(application, wsgi_environ(environ, stdin))
+        except Exception:
+            traceback.print_exc()
+            output = error_output('500 Internal Server Error', 'サーバーエラーが発生しました')
+
+        if body_length <= shim.MAX_BODY_SIZE:
+            # シムは本文を送り終えるまで応答を読まないため、読み残した本文を受信してから応答する
+            # （上限を超えた本文は読まずに 413 を返して接続を閉じる）
+            stdin.drain()
+        self.wfile.write(output)
+
+
+class TCPDaemon(ThreadPoolMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class UnixDaemon(ThreadPoolMixIn, socketserver.UnixStreamServer):
+        pass
+
+
+def create_server(address):
+    """アドレスに応じたソケットサーバーを作成"""
+    family, sockaddr = shim.parse_address(address)
+    if family == socket.AF_INET:
+        return TCPDaemon(sockaddr, RequestHandler)
+
+    if os.path.exists(sockaddr):
+        os.remove(sockaddr)
+    server = UnixDaemon(sockaddr, RequestHandler)
+    os.chmod(sockaddr, 0o660)
+    return server
+
+
+def serve(address, write_address_file=True, threads=8):
+    """デーモンを起動してリクエストを待ち受ける"""
+    server = create_server(address)
+    server.pool_size = threads
+
+    if write_address_file:
+        with open(shim.DAEMON_ADDRESS_FILE, 'w', encoding='utf-8') as f:
+            f.write(address)
+
+    # SIGTERMでも後片付けを行う
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # 閲覧ログを定期的に反映する
+    start_background_flusher()
+
+    print(f'Manual Factory daemon listening on {address}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if write_address_file and os.path.exists(shim.DAEMON_ADDRESS_FILE):
+            os.remove(shim.DAEMON_ADDRESS_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manual Factory 常駐デーモン')
+    parser.add_argument('--bind', default='127.0.0.1:9310',
+                        help="待ち受けアドレス（'host:port' または 'unix:/path'）")
+    parser.add_argument('--no-address-file', action='store_true',
+                        help='database/daemon.addr を作成しない（MF_DAEMON_ADDRESS で指定する場合）')
+    parser.add_argument('--threads', type=int, default=8, help='リクエストを処理するスレッド数')
+    args = parser.parse_args()
+    serve(args.bind, write_address_file=not args.no_address_file, threads=args.threads)
+
+
+if __name__ == '__main__':
+    main()
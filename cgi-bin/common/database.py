@@ -6,26 +6,247 @@
 
 import sqlite3
 import os
+import time
+import atexit
+import threading
 from contextlib import contextmanager
 
-# データベースパス
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'database', 'manual_factory.db')
+from . import timing
+from . import slowlog
+from . import metrics
+from . import search
 
-@contextmanager
-def get_db_connection():
-    """データベース接続を取得（コンテキストマネージャー）"""
-    conn = sqlite3.connect(DB_PATH)
+# データベースパス（環境変数 MF_DB_PATH で上書き可能）
+DB_PATH = os.environ.get('MF_DB_PATH') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'database', 'manual_factory.db'
+)
+
+# ロック待ちの上限（ミリ秒）
+BUSY_TIMEOUT_MS = 5000
+
+# ページキャッシュサイズ（KiB、PRAGMA cache_size には負の値で指定）
+CACHE_SIZE_KIB = 16 * 1024
+
+# メモリマップI/Oのサイズ（バイト）
+MMAP_SIZE = 64 * 1024 * 1024
+
+# 接続ごとにキャッシュするプリペアドステートメント数
+CACHED_STATEMENTS = 256
+
+# 接続ごとに適用するPRAGMA
+CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}',
+    f'PRAGMA cache_size = -{CACHE_SIZE_KIB}',
+    f'PRAGMA mmap_size = {MMAP_SIZE}',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+)
+
+# ウィンドウ関数（COUNT(*) OVER () など）が使えるか（SQLite 3.25.0 以降）
+SUPPORTS_WINDOW_FUNCTIONS = sqlite3.sqlite_version_info >= (3, 25, 0)
+
+# スレッドごとに保持する接続
+_local = threading.local()
+
+# WALモードへの切り替えを確認済みかどうか（データベースファイルに保存されるため1回でよい）
+_wal_checked = False
+
+def is_lock_error(error):
+    """ロック待ちの上限（busy_timeout）を超えて失敗した場合の例外か"""
+    message = str(error)
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def count_lock_error(error):
+    """ロック待ちで失敗した場合は監視用のメトリクスに数える"""
+    if is_lock_error(error):
+        metrics.increment('mf_db_lock_errors_total')
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    SQLの実行・結果の取得にかかった時間をリクエストの計測（common.timing）に記録するカーソル
+    1つの文の実行と結果の取得の合計が閾値を超えた時点でスロークエリログ（common.slowlog）に記録する
+    """
+
+    _statement = None
+    _statement_time = 0.0
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            count_lock_error(e)
+            raise
+        finally:
+            self._record_statement(sql, parameters, False, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        # ログにパラメーターの形を記録できるよう、ジェネレーターなどはリストにする
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            count_lock_error(e)
+            raise
+        finally:
+            self._record_statement(sql, seq_of_parameters, True, time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            timing.record_sql_time(sql_script, time.perf_counter() - start)
+            self._statement = None
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._record_fetch(time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._record_fetch(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._record_fetch(time.perf_counter() - start)
+
+    def _record_statement(self, sql, parameters, many, elapsed):
+        timing.record_sql_time(sql, elapsed)
+        self._statement = (sql, parameters, many)
+        self._statement_time = elapsed
+        self._check_slow()
+
+    def _record_fetch(self, elapsed):
+        timing.record_sql_time(None, elapsed)
+        if self._statement is not None:
+            self._statement_time += elapsed
+            self._check_slow()
+
+    def _check_slow(self):
+        if slowlog.SLOW_QUERY_SECONDS is not None and self._statement_time >= slowlog.SLOW_QUERY_SECONDS:
+            sql, parameters, many = self._statement
+            # 同じ実行を二重に記録しない
+            self._statement = None
+            slowlog.log_slow_query(self.connection, sql, parameters, self._statement_time, many)
+
+
+class TimedConnection(sqlite3.Connection):
+    """カーソル・conn.execute() に TimedCursor を使う接続（コミットのロック待ちの失敗も数える）"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        # 変更された手順書の全文検索インデックスを、同じトランザクションで1手順書1回だけ再構築する
+        if self.in_transaction:
+            search.refresh_search_index(self.cursor())
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            count_lock_error(e)
+            raise
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def _connect():
+    """新しいデータベース接続を作成し、PRAGMAを適用"""
+    global _wal_checked
+
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=CACHED_STATEMENTS,
+        factory=TimedConnection,
+    )
+    # 実行された文をリクエストごとに数える（トリガー・暗黙のBEGIN/COMMITも含む）
+    conn.set_trace_callback(timing.trace_statement)
     conn.row_factory = sqlite3.Row  # 列名でアクセス可能にする
     # テキストデータをUTF-8文字列として取得
     conn.text_factory = str
+
+    if not _wal_checked:
+        conn.execute('PRAGMA journal_mode = WAL')
+        _wal_checked = True
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _get_thread_connection():
+    """現在のスレッド（プロセス）で保持している接続を取得"""
+    conn = getattr(_local, 'conn', None)
+    # fork後の子プロセスでは親の接続を使わない
+    if conn is None or _local.pid != os.getpid():
+        with timing.phase('connect'):
+            conn = _local.conn = _connect()
+        _local.pid = os.getpid()
+        _local.depth = 0
+    return conn
+
+def close_db_connection():
+    """現在のスレッドで保持している接続を閉じる"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+atexit.register(close_db_connection)
+
+@contextmanager
+def get_db_connection():
+    """
+    データベース接続を取得（コンテキストマネージャー）
+
+    接続はスレッドごとに保持して再利用する。
+    入れ子で使用した場合は最も外側のコンテキストでコミット/ロールバックする。
+    """
+    conn = _get_thread_connection()
+
+    _local.depth += 1
     try:
         yield conn
-        conn.commit()
+        if _local.depth == 1:
+            conn.commit()
     except Exception as e:
-        conn.rollback()
+        if _local.depth == 1:
+            conn.rollback()
         raise e
     finally:
-        conn.close()
+        _local.depth -= 1
+
+def in_db_connection():
+    """現在のスレッドで get_db_connection() のコンテキストの内側か（外側でコミットされるまで変更は確定しない）"""
+    return getattr(_local, 'conn', None) is not None and _local.pid == os.getpid() and _local.depth > 0
+
+def get_change_counter(cursor):
+    """変更カウンターの値と最終変更日時（UTC）を取得"""
+    cursor.execute('SELECT value, changed_at FROM change_counter WHERE id = 1')
+    row = cursor.fetchone()
+    if row is None:
+        return 0, None
+    return row['value'], row['changed_at']
 
 def execute_query(query, params=None):
     """クエリを実行して結果を返す"""
@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+FastCGIレスポンダー（標準ライブラリのみ）
+WSGIアプリケーション（common.app）を常駐ワーカープロセスからFastCGIで提供する
+wfastcgi 等の外部パッケージは使用しない
+
+動作モード:
+    IIS (FastCgiModule)   : 環境変数 _FCGI_X_PIPE_ があれば標準入力の名前付きパイプで待ち受ける
+    mod_fcgid 等          : 標準入力が待ち受けソケットであればそれを使用する
+    TCP / Unixソケット    : --bind で指定したアドレスで待ち受ける（mod_proxy_fcgi, nginx 等）
+
+使い方:
+    python cgi-bin/common/fastcgi.py --bind 127.0.0.1:9000 --workers 4
+    python cgi-bin/common/fastcgi.py --test-request "/cgi-bin/api/manuals_list.py?limit=5" --connect 127.0.0.1:9000
+"""
+
+import os
+import sys
+import socket
+import struct
+import argparse
+import socketserver
+import traceback
+
+if __name__ == '__main__':
+    # CGIとして呼び出された場合はサーバーを起動しない
+    if os.environ.get('REQUEST_METHOD'):
+        print('Status: 404 Not Found')
+        print()
+        sys.exit(0)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.shim import MAX_BODY_SIZE, parse_address
+from common.wsgi import LimitedInput, ThreadPoolMixIn, render_cgi, serve_preforked
+
+FCGI_VERSION = 1
+
+# レコード種別
+FCGI_BEGIN_REQUEST = 1
+FCGI_ABORT_REQUEST = 2
+FCGI_END_REQUEST = 3
+FCGI_PARAMS = 4
+FCGI_STDIN = 5
+FCGI_STDOUT = 6
+FCGI_STDERR = 7
+FCGI_DATA = 8
+FCGI_GET_VALUES = 9
+FCGI_GET_VALUES_RESULT = 10
+FCGI_UNKNOWN_TYPE = 11
+
+# ロール・フラグ・終了ステータス
+FCGI_RESPONDER = 1
+FCGI_KEEP_CONN = 1
+FCGI_REQUEST_COMPLETE = 0
+FCGI_CANT_MPX_CONN = 1
+FCGI_UNKNOWN_ROLE = 3
+
+# 管理レコードのリクエストID
+FCGI_NULL_REQUEST_ID = 0
+
+HEADER_FORMAT = '!BBHHBx'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+BEGIN_REQUEST_FORMAT = '!HB5x'
+END_REQUEST_FORMAT = '!IB3x'
+
+# 1レコードに載せられる最大データ長
+MAX_CONTENT_LENGTH = 65535
+
+
+class ProtocolError(Exception):
+    """FastCGIプロトコル違反"""
+
+
+def encode_record(record_type, request_id, content=b''):
+    """FastCGIレコードをバイト列に変換（8バイト境界にパディング）"""
+    padding = -len(content) % 8
+    header = struct.pack(HEADER_FORMAT, FCGI_VERSION, record_type, request_id, len(content), padding)
+    return header + content + b'\x00' * padding
+
+
+def encode_stream(record_type, request_id, data):
+    """ストリームデータを複数レコードに分割し、終端の空レコードを付与"""
+    records = [
+        encode_record(record_type, request_id, data[i:i + MAX_CONTENT_LENGTH])
+        for i in range(0, len(data), MAX_CONTENT_LENGTH)
+    ]
+    records.append(encode_record(record_type, request_id))
+    return b''.join(records)
+
+
+def encode_name_value_pairs(pairs):
+    """名前-値ペアをFastCGI形式に変換"""
+    result = []
+    for name, value in pairs.items():
+        name = name.encode('utf-8') if isinstance(name, str) else name
+        value = value.encode('utf-8') if isinstance(value, str) else value
+        for length in (len(name), len(value)):
+            if length < 128:
+                result.append(struct.pack('!B', length))
+            else:
+                result.append(struct.pack('!I', length | 0x80000000))
+        result.append(name)
+        result.append(value)
+    return b''.join(result)
+
+
+def decode_name_value_pairs(data):
+    """FastCGI形式の名前-値ペアを辞書に変換"""
+    pairs = {}
+    pos = 0
+    while pos < len(data):
+        lengths = []
+        for _ in range(2):
+            if data[pos] & 0x80:
+                lengths.append(struct.unpack('!I', data[pos:pos + 4])[0] & 0x7fffffff)
+                pos += 4
+            else:
+                lengths.append(data[pos])
+                pos += 1
+        name_length, value_length = lengths
+        name = data[pos:pos + name_length].decode('latin-1')
+        pos += name_length
+        value = data[pos:pos + value_length]
+        pos += value_length
+        # CGI環境変数と同様に文字列として扱う（不正なバイトは置換）
+        pairs[name] = value.decode('utf-8', 'replace')
+    return pairs
+
+
+def read_record(stream):
+    """ストリームから1レコードを読み込む（接続終了時はNone）"""
+    header = stream.read(HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < HEADER_SIZE:
+        raise ProtocolError('レコードヘッダーが途中で終了しました')
+    version, record_type, request_id, content_length, padding = struct.unpack(HEADER_FORMAT, header)
+    if version != FCGI_VERSION:
+        raise ProtocolError(f'未対応のバージョンです: {version}')
+    content = stream.read(content_length + padding)
+    if len(content) < content_length + padding:
+        raise ProtocolError('レコードが途中で終了しました')
+    return record_type, request_id, content[:content_length]
+
+
+class SocketStream:
+    """ソケット接続の読み書き"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+
+    def read(self, size):
+        return self.rfile.read(size)
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+
+class PipeStream:
+    """IISから渡される名前付きパイプの読み書き（Windowsのみ）"""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.buffer = b''
+
+    def read(self, size):
+        import _winapi
+        while len(self.buffer) < size:
+            try:
+                data, _ = _winapi.ReadFile(self.handle, max(size - len(self.buffer), 65536))
+            except BrokenPipeError:
+                break
+            if not data:
+                break
+            self.buffer += data
+        result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+    def write(self, data):
+        import _winapi
+        while data:
+            written, _ = _winapi.WriteFile(self.handle, data)
+            data = data[written:]
+
+
+class Responder:
+    """
+    1接続分のFastCGIリクエストを順に処理する（多重化には対応しない）
+    PARAMS が揃った時点でアプリケーションを呼び出し、本文（STDIN）はアプリケーションが読む分だけ受信する
+    """
+
+    def __init__(self, app, stream):
+        self.app = app
+        self.stream = stream
+        # 応答中のリクエストのSTDINが終端に達していないか
+        self.stdin_open = False
+
+    def run(self):
+        """接続が閉じられるまで（またはKEEP_CONNなしの応答後まで）処理する"""
+        requests = {}
+        while True:
+            record = read_record(self.stream)
+            if record is None:
+                return
+            record_type, request_id, content = record
+
+            if request_id == FCGI_NULL_REQUEST_ID:
+                self.handle_management(record_type, content)
+                continue
+
+            if record_type == FCGI_BEGIN_REQUEST:
+                role, flags = struct.unpack(BEGIN_REQUEST_FORMAT, content)
+                if role != FCGI_RESPONDER:
+                    self.end_request(request_id, FCGI_UNKNOWN_ROLE)
+                    continue
+                if requests:
+                    self.end_request(request_id, FCGI_CANT_MPX_CONN)
+                    continue
+                requests[request_id] = {'flags': flags, 'params': []}
+
+            elif record_type == FCGI_ABORT_REQUEST:
+                if requests.pop(request_id, None) is not None:
+                    self.end_request(request_id, FCGI_REQUEST_COMPLETE)
+
+            elif record_type == FCGI_PARAMS and request_id in requests:
+                state = requests[request_id]
+                if content:
+                    state['params'].append(content)
+                    continue
+                # 空のPARAMSレコードで環境変数が揃ったので応答する（本文は応答中に受信する）
+                del requests[request_id]
+                self.respond(request_id, decode_name_value_pairs(b''.join(state['params'])))
+                if not state['flags'] & FCGI_KEEP_CONN:
+                    return
+
+            # 応答済みのリクエストの読み残したSTDIN、フィルターロール用のDATAは読み捨てる
+
+    def read_stdin(self, request_id):
+        """
+        このリクエストの次のSTDINレコードの内容を返す（終端の空レコード・中止では b''）
+        待っている間に届いた管理レコード・他のリクエストの開始にも応答する
+        """
+        while True:
+            record = read_record(self.stream)
+            if record is None:
+                raise ProtocolError('リクエスト本文の途中で接続が閉じられました')
+            record_type, record_request_id, content = record
+            if record_request_id == FCGI_NULL_REQUEST_ID:
+                self.handle_management(record_type, content)
+            elif record_type == FCGI_BEGIN_REQUEST:
+                self.end_request(record_request_id, FCGI_CANT_MPX_CONN)
+            elif record_request_id != request_id:
+                continue
+            elif record_type in (FCGI_STDIN, FCGI_ABORT_REQUEST):
+                if record_type == FCGI_ABORT_REQUEST or not content:
+                    self.stdin_open = False
+                    return b''
+                return content
+
+    def handle_management(self, record_type, content):
+        """FCGI_GET_VALUES等の管理レコードに応答"""
+        if record_type == FCGI_GET_VALUES:
+            known = {
+                'FCGI_MAX_CONNS': '1',
+                'FCGI_MAX_REQS': '1',
+                'FCGI_MPXS_CONNS': '0',
+            }
+            names = decode_name_value_pairs(content)
+            values = {name: known[name] for name in names if name in known}
+            self.stream.write(encode_record(
+                FCGI_GET_VALUES_RESULT, FCGI_NULL_REQUEST_ID, encode_name_value_pairs(values)))
+        else:
+            self.stream.write(encode_record(
+                FCGI_UNKNOWN_TYPE, FCGI_NULL_REQUEST_ID, struct.pack('!B7x', record_type)))
+
+    def respond(self, request_id, params):
+        """WSGIアプリケーションを実行してSTDOUTとEND_REQUESTを送信"""
+        environ = dict(params)
+        try:
+            content_length = max(int(environ.get('CONTENT_LENGTH') or 0), 0)
+        except ValueError:
+            content_length = 0
+        self.stdin_open = True
+        stdin = LimitedInput(lambda size: self.read_stdin(request_id), content_length)
+        environ.update({
+            'wsgi.input': stdin,
+            'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.url_scheme': 'https' if environ.get('HTTPS', 'off').lower() in ('on', '1') else 'http',
+        })
+        try:
+            output = render_cgi(self.app, environ)
+        except Exception:
+            traceback.print_exc()
+            output = (
+                b'Status: 500 Internal Server Error\r\n'
+                b'Content-Type: application/json; charset=utf-8\r\n\r\n'
+                b'{"error": "internal server error"}'
+            )
+        if content_length <= MAX_BODY_SIZE:
+            # Webサーバーが本文を送り終えてから応答を読む場合に備え、読み残した本文を終端まで受信してから応答する
+            # （上限を超えた本文は読まずに 413 を返し、後から届くSTDINは run() で読み捨てる）
+            stdin.drain()
+            while self.stdin_open and self.read_stdin(request_id):
+                pass
+        self.stream.write(encode_stream(FCGI_STDOUT, request_id, output))
+        self.end_request(request_id, FCGI_REQUEST_COMPLETE)
+
+    def end_request(self, request_id, protocol_status, app_status=0):
+        self.stream.write(encode_record(
+            FCGI_END_REQUEST, request_id, struct.pack(END_REQUEST_FORMAT, app_status, protocol_status)))
+
+
+class FastCGIRequestHandler(socketserver.BaseRequestHandler):
+    """ソケット接続1本分を処理"""
+
+    def handle(self):
+        allowed = self.server.allowed_addresses
+        if allowed and self.client_address and self.client_address[0] not in allowed:
+            return
+        try:
+            Responder(self.server.app, SocketStream(self.request)).run()
+        except (ProtocolError, ConnectionError) as e:
+            print(f'FastCGI connection error: {e}', file=sys.stderr)
+
+
+class TCPFastCGIServer(ThreadPoolMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class UnixFastCGIServer(ThreadPoolMixIn, socketserver.UnixStreamServer):
+        pass
+
+
+def allowed_web_server_addresses():
+    """FCGI_WEB_SERVER_ADDRS で許可された接続元（未設定なら制限なし）"""
+    value = os.environ.get('FCGI_WEB_SERVER_ADDRS', '')
+    return {addr.strip() for addr in value.split(',') if addr.strip()}
+
+
+def inherited_listen_socket():
+    """標準入力が待ち受けソケット（FCGI_LISTENSOCK_FILENO）であれば返す"""
+    if sys.platform == 'win32':
+        return None
+    fd = os.dup(0)
+    try:
+        sock = socket.socket(fileno=fd)
+    except OSError:
+        os.close(fd)
+        return None
+    try:
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN):
+            return sock
+    except OSError:
+        pass
+    sock.close()
+    return None
+
+
+def create_server(app, address=None, listen_socket=None, threads=8):
+    """待ち受けソケットを用意してFastCGIサーバーを作成"""
+    if listen_socket is not None:
+        server_class = UnixFastCGIServer if listen_socket.family == getattr(socket, 'AF_UNIX', None) else TCPFastCGIServer
+        server = server_class(listen_socket.getsockname(), FastCGIRequestHandler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = listen_socket
+    else:
+        family, sockaddr = parse_address(address)
+        if family == socket.AF_INET:
+            server = TCPFastCGIServer(sockaddr, FastCGIRequestHandler)
+        else:
+            if os.path.exists(sockaddr):
+                os.remove(sockaddr)
+            server = UnixFastCGIServer(sockaddr, FastCGIRequestHandler)
+            os.chmod(sockaddr, 0o660)
+
+    server.app = app
+    server.pool_size = threads
+    server.allowed_addresses = allowed_web_server_addresses()
+    return server
+
+
+def serve_iis_pipe(app):
+    """IIS FastCgiModule から標準入力として渡された名前付きパイプで順に処理する"""
+    import ctypes
+    import msvcrt
+    import _winapi
+
+    kernel32 = ctypes.windll.kernel32
+    handle = msvcrt.get_osfhandle(sys.stdin.fileno())
+    while True:
+        try:
+            _winapi.ConnectNamedPipe(handle, False)
+        except OSError as e:
+            # ERROR_PIPE_CONNECTED: 既に接続済み
+            if getattr(e, 'winerror', None) != 535:
+                raise
+        try:
+            Responder(app, PipeStream(handle)).run()
+        except (ProtocolError, OSError) as e:
+            print(f'FastCGI pipe error: {e}', file=sys.stderr)
+        finally:
+            kernel32.FlushFileBuffers(handle)
+            kernel32.DisconnectNamedPipe(handle)
+
+
+class FastCGIClient:
+    """動作確認用のFastCGIクライアント（1接続1リクエスト）"""
+
+    def __init__(self, address, timeout=30.0):
+        self.address = address
+        self.timeout = timeout
+
+    def request(self, params, body=b'', request_id=1):
+        """
+        リクエストを送信し、(ステータス, ヘッダーのリスト, 本文, STDERR) を返す
+        """
+        family, sockaddr = parse_address(self.address)
+        params = dict(params)
+        params.setdefault('CONTENT_LENGTH', str(len(body)))
+
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(sockaddr)
+            sock.sendall(
+                encode_record(FCGI_BEGIN_REQUEST, request_id, struct.pack(BEGIN_REQUEST_FORMAT, FCGI_RESPONDER, 0))
+                + encode_stream(FCGI_PARAMS, request_id, encode_name_value_pairs(params))
+                + encode_stream(FCGI_STDIN, request_id, body)
+            )
+            stream = SocketStream(sock)
+            stdout, stderr = [], []
+            while True:
+                record = read_record(stream)
+                if record is None:
+                    raise ProtocolError('END_REQUEST を受信する前に接続が閉じられました')
+                record_type, _, content = record
+                if record_type == FCGI_STDOUT:
+                    stdout.append(content)
+                elif record_type == FCGI_STDERR:
+                    stderr.append(content)
+                elif record_type == FCGI_END_REQUEST:
+                    break
+
+        return parse_cgi_output(b''.join(stdout)) + (b''.join(stderr),)
+
+
+def parse_cgi_output(output):
+    """CGI形式の出力を (ステータス, ヘッダーのリスト, 本文) に分解"""
+    head, _, body = output.partition(b'\r\n\r\n')
+    status = '200 OK'
+    headers = []
+    for line in head.decode('latin-1').split('\r\n'):
+        name, _, value = line.partition(':')
+        if name.lower() == 'status':
+            status = value.strip()
+        elif name:
+            headers.append((name, value.strip()))
+    return status, headers, body
+
+
+def test_request(address, url, method='GET', data=None, cookie=None):
+    """--test-request: FastCGIサーバーへリクエストを送り、応答を表示する"""
+    path, _, query = url.partition('?')
+    body = data.encode('utf-8') if data else b''
+    params = {
+        'GATEWAY_INTERFACE': 'CGI/1.1',
+        'SERVER_SOFTWARE': 'manual-factory-fcgi-client',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'REMOTE_ADDR': '127.0.0.1',
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': path,
+        'QUERY_STRING': query,
+        'REQUEST_URI': url,
+        'CONTENT_TYPE': 'application/json',
+    }
+    if cookie:
+        params['HTTP_COOKIE'] = cookie
+
+    status, headers, response_body, stderr = FastCGIClient(address).request(params, body)
+    print(f'Status: {status}')
+    for name, value in headers:
+        print(f'{name}: {value}')
+    print()
+    sys.stdout.flush()
+    getattr(sys.stdout, 'buffer', sys.stdout).write(response_body + b'\n')
+    if stderr:
+        sys.stderr.write(stderr.decode('utf-8', 'replace'))
+    return 0 if status.startswith(('2', '3')) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manual Factory FastCGIレスポンダー')
+    parser.add_argument('--bind', default='127.0.0.1:9000',
+                        help="待ち受けアドレス（'host:port' または 'unix:/path'）")
+    parser.add_argument('--workers', type=int, default=1, help='プリフォークするプロセス数（Linuxのみ）')
+    parser.add_argument('--threads', type=int, default=8, help='ワーカーごとのスレッド数')
+    parser.add_argument('--test-request', metavar='URL',
+                        help='サーバーを起動せず、--connect のFastCGIサーバーへテストリクエストを送信する')
+    parser.add_argument('--connect', default='127.0.0.1:9000', help='テストリクエストの送信先')
+    parser.add_argument('--method', default='GET', help='テストリクエストのメソッド')
+    parser.add_argument('--data', help='テストリクエストの本文')
+    parser.add_argument('--cookie', help='テストリクエストのCookieヘッダー')
+    args = parser.parse_args()
+
+    if args.test_request:
+        sys.exit(test_request(args.connect, args.test_request, args.method, args.data, args.cookie))
+
+    from common.app import application
+    from common.viewlog import start_background_flusher
+
+    # 閲覧ログはこのプロセスで定期的に反映する（プリフォーク時は親プロセスが担当）
+    start_background_flusher()
+
+    if os.environ.get('_FCGI_X_PIPE_'):
+        serve_iis_pipe(application)
+        return
+
+    listen_socket = inherited_listen_socket()
+    server = create_server(application, args.bind, listen_socket, threads=args.threads)
+    if listen_socket is None:
+        print(f'Manual Factory FastCGI responder listening on {args.bind}', file=sys.stderr)
+    serve_preforked(server, args.workers)
+
+
+if __name__ == '__main__':
+    main()
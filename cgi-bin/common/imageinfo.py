@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+画像のヘッダー解析
+PNG・JPEG・GIF・WebP・BMP のファイル先頭を読み、形式と幅・高さを取得する
+（画像全体は読み込まない。外部ライブラリは使用しない）
+"""
+
+import struct
+from collections import namedtuple
+
+# 画像の情報
+#   format: 形式（png, jpeg, gif, webp, bmp）
+#   width, height: 表示時の幅と高さ（JPEGのEXIFで90度回転している場合は入れ替え済み）
+#   mime_type: MIMEタイプ
+ImageInfo = namedtuple('ImageInfo', ['format', 'width', 'height', 'mime_type'])
+
+MIME_TYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'bmp': 'image/bmp',
+}
+
+# 形式の判定と固定位置のヘッダーの解析に読み込むバイト数
+HEADER_SIZE = 32
+
+# JPEGのフレーム開始マーカー（SOF0〜SOF15、DHT・JPG・DAC を除く）
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# パラメーターを持たないJPEGマーカー（RST0〜RST7, TEM）
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01}
+
+# EXIFの向き（Orientation）のうち、90度回転して表示するもの
+EXIF_ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def identify_image_file(path):
+    """画像ファイルの情報を取得（対応していない形式・壊れたファイルの場合は None）"""
+    with open(path, 'rb') as f:
+        return identify_image(f)
+
+
+def identify_image(f):
+    """バイナリファイルオブジェクトの先頭から画像の情報を取得（対応していない形式の場合は None）"""
+    header = f.read(HEADER_SIZE)
+    try:
+        if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', header[16:24])
+            return _info('png', width, height)
+
+        if header[:6] in (b'GIF87a', b'GIF89a'):
+            width, height = struct.unpack('<HH', header[6:10])
+            return _info('gif', width, height)
+
+        if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+            return _identify_webp(header)
+
+        if header[:2] == b'BM':
+            return _identify_bmp(header)
+
+        if header[:2] == b'\xff\xd8':
+            return _identify_jpeg(f, header[2:])
+    except struct.error:
+        # ヘッダーが途中で終わっている
+        return None
+    return None
+
+
+def _info(image_format, width, height):
+    if width <= 0 or height <= 0:
+        return None
+    return ImageInfo(image_format, width, height, MIME_TYPES[image_format])
+
+
+def _identify_webp(header):
+    chunk = header[12:16]
+    if chunk == b'VP8X':
+        # 拡張形式: キャンバスの幅・高さ（24ビット、1を引いた値）
+        width = int.from_bytes(header[24:27], 'little') + 1
+        height = int.from_bytes(header[27:30], 'little') + 1
+        return _info('webp', width, height)
+    if chunk == b'VP8 ':
+        # 非可逆: キーフレームの開始コードの後に14ビットの幅・高さ
+        if header[23:26] != b'\x9d\x01\x2a':
+            return None
+        width, height = struct.unpack('<HH', header[26:30])
+        return _info('webp', width & 0x3FFF, height & 0x3FFF)
+    if chunk == b'VP8L':
+        # 可逆: 署名の後に14ビットずつ（1を引いた値）
+        if header[20] != 0x2F:
+            return None
+        bits = int.from_bytes(header[21:25], 'little')
+        return _info('webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    return None
+
+
+def _identify_bmp(header):
+    dib_size = struct.unpack('<I', header[14:18])[0]
+    if dib_size == 12:
+        # OS/2 形式
+        width, height = struct.unpack('<HH', header[18:22])
+    else:
+        # 高さが負の場合は上から下への並び
+        width, height = struct.unpack('<ii', header[18:26])
+    return _info('bmp', width, abs(height))
+
+
+def _identify_jpeg(f, data):
+    """マーカーを順にたどってフレーム開始（SOF）の幅・高さを取得"""
+    reader = _JpegReader(f, data)
+    orientation = 1
+    while True:
+        # マーカー（0xFF の後の1バイト、0xFF の連続は詰め物）
+        if reader.read(1) != b'\xff':
+            return None
+        marker = reader.read(1)
+        while marker == b'\xff':
+            marker = reader.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            # 画像の終わり・スキャン開始までにSOFがなかった
+            return None
+
+        length = struct.unpack('>H', reader.read(2))[0]
+        if length < 2:
+            return None
+        if marker in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', reader.read(5))
+            if orientation in EXIF_ROTATED_ORIENTATIONS:
+                width, height = height, width
+            return _info('jpeg', width, height)
+        if marker == 0xE1:
+            segment = reader.read(length - 2)
+            orientation = _exif_orientation(segment) or orientation
+        else:
+            reader.skip(length - 2)
+
+
+def _exif_orientation(segment):
+    """APP1（EXIF）セグメントから向き（Orientation）を取得"""
+    if not segment.startswith(b'Exif\x00\x00'):
+        return None
+    tiff = segment[6:]
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    try:
+        offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+        count = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, _, _ = struct.unpack(endian + 'HHI', tiff[entry:entry + 8])
+            if tag == 0x0112:
+                return struct.unpack(endian + 'H', tiff[entry + 8:entry + 10])[0]
+    except struct.error:
+        return None
+    return None
+
+
+class _JpegReader:
+    """先に読み込んだヘッダーの残りとファイルを続けて読む"""
+
+    def __init__(self, f, data):
+        self.f = f
+        self.data = data
+
+    def read(self, size):
+        if self.data:
+            chunk, self.data = self.data[:size], self.data[size:]
+            if len(chunk) < size:
+                chunk += self.f.read(size - len(chunk))
+            return chunk
+        return self.f.read(size)
+
+    def skip(self, size):
+        if self.data:
+            skipped = min(size, len(self.data))
+            self.data = self.data[skipped:]
+            size -= skipped
+        if size > 0:
+            self.f.seek(size, 1)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+画像の保存（内容のSHA-256による重複排除）
+画像は uploads/images/<先頭2文字>/<次の2文字>/<sha256><拡張子> に保存し、
+images テーブルにサイズ・MIMEタイプ・ステップからの参照数を記録する
+同じ内容の画像は一度だけ保存し、既存のパスを返す
+"""
+
+import os
+
+# アップロードディレクトリ
+UPLOAD_ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'uploads'
+)
+IMAGES_DIR = os.path.join(UPLOAD_ROOT, 'images')
+
+# ステップの image_path に含まれる画像のURLパス（この後に相対パスが続く）
+IMAGES_URL_PATH = '/uploads/images/'
+
+# 画像の形式（common.imageinfo で判定）と保存時の拡張子
+FORMAT_EXTENSIONS = {
+    'jpeg': '.jpg',
+    'png': '.png',
+    'gif': '.gif',
+    'bmp': '.bmp',
+    'webp': '.webp',
+}
+
+
+def is_sha256(value):
+    """16進数64文字のSHA-256かどうか"""
+    return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def image_relative_path(sha256, ext):
+    """SHA-256と拡張子から uploads/images 以下の相対パス（URL形式）を作成"""
+    return f'{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}'
+
+
+def image_file_path(relative_path):
+    """相対パスからファイルシステム上のパスを作成"""
+    return os.path.join(IMAGES_DIR, *relative_path.split('/'))
+
+
+def find_image(cursor, sha256, touch=False):
+    """
+    保存済みの画像を取得（未登録またはファイルがない場合は None）
+    touch=True の場合はファイルの更新日時を現在にする（再利用した画像を tools/gc_uploads.py の猶予期間で保護する）
+    """
+    cursor.execute('SELECT * FROM images WHERE sha256 = ?', (sha256,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    path = image_file_path(row['path'])
+    try:
+        if touch:
+            os.utime(path)
+        elif not os.path.exists(path):
+            return None
+    except OSError:
+        return None
+    return dict(row)
+
+
+def store_image(cursor, uploaded, info):
+    """
+    アップロードされた一時ファイル（common.multipart.UploadedFile）を保存し、
+    (images の行, 新しく保存したかどうか) を返す
+    info はヘッダーから取得した画像の情報（common.imageinfo.ImageInfo）で、拡張子は実際の形式に合わせる
+    同じ内容の画像が保存済みであれば一時ファイルは破棄し、既存の画像を返す
+    """
+    ext = FORMAT_EXTENSIONS[info.format]
+    existing = find_image(cursor, uploaded.sha256, touch=True)
+    if existing:
+        uploaded.discard()
+        return existing, False
+
+    relative_path = image_relative_path(uploaded.sha256, ext)
+    destination = image_file_path(relative_path)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.exists(destination):
+        # 同じ内容を同時にアップロードした別のリクエストが先に保存した
+        uploaded.discard()
+    else:
+        try:
+            uploaded.save(destination)
+        except OSError:
+            if not os.path.exists(destination):
+                raise
+            uploaded.discard()
+
+    cursor.execute('''
+        INSERT OR IGNORE INTO images (sha256, path, size, mime_type, width, height, format)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (uploaded.sha256, relative_path, uploaded.size, info.mime_type, info.width, info.height, info.format))
+    # 登録済みでファイルが失われていた場合は、保存し直したファイルを指すようにする
+    cursor.execute('UPDATE images SET path = ? WHERE sha256 = ? AND path <> ?',
+                   (relative_path, uploaded.sha256, relative_path))
+    cursor.execute('SELECT * FROM images WHERE sha256 = ?', (uploaded.sha256,))
+    return dict(cursor.fetchone()), True
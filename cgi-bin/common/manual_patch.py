@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+手順書の部分更新（JSON Patch 形式の操作の適用）
+手順書を {title, description, is_published, visibility, steps, tags} の文書とみなし、
+RFC 6902 の操作（add / remove / replace / move / test）を順に適用する
+
+使用できるパス:
+    /title, /description, /is_published, /visibility    基本情報（replace）
+    /steps/<番号>, /steps/-                             ステップの追加・削除・置換・移動
+    /steps/<番号>/<title|content|note|image_path>       ステップの項目（replace）
+    /tags/<番号>, /tags/-                               タグ名の追加・削除・置換
+番号は0から始まる配列の位置で、操作はそれまでの操作を適用した後の配列に対して行う
+"""
+
+import copy
+
+from .manual_sync import STEP_FIELDS
+
+# 置換できる手順書の基本情報
+MANUAL_FIELDS = ('title', 'description', 'is_published', 'visibility')
+
+# 公開範囲
+VISIBILITIES = ('public', 'private', 'department')
+
+# 一度に適用できる操作の数
+MAX_OPERATIONS = 1000
+
+
+class PatchError(ValueError):
+    """操作の形式が不正、または適用できない"""
+
+
+def load_manual_document(cursor, manual):
+    """
+    手順書（manuals の行）の現在の内容を操作の適用対象の文書にする
+    ステップ・タグの並びは手順書詳細APIと同じで、version は比較用に含める（操作では変更できない）
+    """
+    cursor.execute(f'''
+        SELECT id, {', '.join(STEP_FIELDS)} FROM manual_steps
+        WHERE manual_id = ?
+        ORDER BY step_number
+    ''', (manual['id'],))
+    steps = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute('''
+        SELECT t.name FROM manual_tags mt
+        JOIN tags t ON mt.tag_id = t.id
+        WHERE mt.manual_id = ?
+        ORDER BY mt.id
+    ''', (manual['id'],))
+    tags = [row['name'] for row in cursor.fetchall()]
+
+    document = {field: manual[field] for field in MANUAL_FIELDS}
+    document['steps'] = steps
+    document['tags'] = tags
+    document['version'] = manual['version']
+    return document
+
+
+def parse_pointer(path):
+    """JSON Pointer（RFC 6901）を要素の一覧に分解"""
+    if not isinstance(path, str) or not path.startswith('/'):
+        raise PatchError(f'パスが不正です: {path}')
+    return [token.replace('~1', '/').replace('~0', '~') for token in path[1:].split('/')]
+
+
+def apply_patch(document, operations):
+    """
+    操作を順に適用した新しい文書を返す（document は変更しない）
+    いずれかの操作が適用できない場合は PatchError を送出する（途中までの結果も返さない）
+    """
+    if not isinstance(operations, list):
+        raise PatchError('操作の一覧を配列で指定してください')
+    if len(operations) > MAX_OPERATIONS:
+        raise PatchError(f'操作が多すぎます（最大{MAX_OPERATIONS}件）')
+
+    document = copy.deepcopy(document)
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise PatchError(f'{index + 1}件目の操作が不正です')
+        try:
+            _apply_operation(document, operation)
+        except PatchError as e:
+            raise PatchError(f'{index + 1}件目の操作（{operation.get("op")} {operation.get("path")}）: {e}')
+    return document
+
+
+def _apply_operation(document, operation):
+    op = operation.get('op')
+    tokens = parse_pointer(operation.get('path'))
+    if op in ('add', 'replace', 'test') and 'value' not in operation:
+        raise PatchError('value が指定されていません')
+    value = operation.get('value')
+    target = tokens[0]
+
+    if target in MANUAL_FIELDS and len(tokens) == 1:
+        if op == 'test':
+            _test(document[target], value)
+        elif op in ('add', 'replace'):
+            document[target] = _manual_field_value(target, value)
+        else:
+            raise PatchError('基本情報に使用できない操作です')
+        return
+
+    if target == 'steps' and len(tokens) == 3:
+        step = document['steps'][_index(document['steps'], tokens[1])]
+        field = tokens[2]
+        if field not in STEP_FIELDS:
+            raise PatchError(f'ステップの項目が不正です: {field}')
+        if op == 'test':
+            _test(step.get(field), value)
+        elif op in ('add', 'replace'):
+            step[field] = _text(value)
+        else:
+            raise PatchError('ステップの項目に使用できない操作です')
+        return
+
+    if target in ('steps', 'tags') and len(tokens) == 2:
+        items = document[target]
+        convert = _step_value if target == 'steps' else _tag_value
+        if op == 'add':
+            items.insert(_index(items, tokens[1], insert=True), convert(value))
+        elif op == 'remove':
+            del items[_index(items, tokens[1])]
+        elif op == 'replace':
+            position = _index(items, tokens[1])
+            replacement = convert(value)
+            if target == 'steps':
+                # 同じ位置のステップの内容を置き換える（保存済みのステップはそのまま更新する）
+                replacement['id'] = items[position].get('id')
+            items[position] = replacement
+        elif op == 'move':
+            source = parse_pointer(operation.get('from'))
+            if len(source) != 2 or source[0] != target:
+                raise PatchError('from は同じ配列の要素を指定してください')
+            item = items.pop(_index(items, source[1]))
+            items.insert(_index(items, tokens[1], insert=True), item)
+        elif op == 'test':
+            _test(items[_index(items, tokens[1])], value)
+        else:
+            raise PatchError(f'操作が不正です: {op}')
+        return
+
+    raise PatchError('変更できないパスです')
+
+
+def _index(items, token, insert=False):
+    """配列の位置を整数に変換（insert=True の場合は末尾を表す "-" と配列の長さを許可する）"""
+    if insert and token == '-':
+        return len(items)
+    if not token.isdigit() or (len(token) > 1 and token[0] == '0'):
+        raise PatchError(f'配列の位置が不正です: {token}')
+    index = int(token)
+    if index > len(items) or (index == len(items) and not insert):
+        raise PatchError(f'配列の位置が範囲外です: {token}')
+    return index
+
+
+def _test(actual, expected):
+    if actual != expected:
+        raise PatchError('値が一致しません')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise PatchError('文字列を指定してください')
+    return value
+
+
+def _manual_field_value(field, value):
+    if field == 'visibility':
+        if value not in VISIBILITIES:
+            raise PatchError('公開範囲が不正です')
+        return value
+    if field == 'is_published':
+        if value not in (0, 1, True, False):
+            raise PatchError('is_published は0または1を指定してください')
+        return int(value)
+    value = _text(value)
+    if field == 'title' and not value:
+        raise PatchError('タイトルは空にできません')
+    return value
+
+
+def _step_value(value):
+    """追加・置換するステップ（IDは受け付けず、新しいステップとして扱う）"""
+    if not isinstance(value, dict):
+        raise PatchError('ステップはオブジェクトで指定してください')
+    step = {}
+    for field in STEP_FIELDS:
+        if field in value:
+            step[field] = _text(value[field])
+    return step
+
+
+def _tag_value(value):
+    if not isinstance(value, str) or not value.strip():
+        raise PatchError('タグ名を指定してください')
+    return value.strip()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+手順書のステップ・タグの差分更新
+保存済みの内容と送信された内容を比較し、必要な INSERT / UPDATE / DELETE だけを実行する
+（全件削除して挿入し直すと、誤字の修正だけでもステップの行とIDがすべて作り直されるため）
+
+ステップは id で対応付ける。id がない・この手順書のものでないステップは新規として追加し、
+送信されなかった保存済みのステップは削除する
+"""
+
+# ステップの内容の列
+STEP_FIELDS = ('title', 'content', 'note', 'image_path')
+
+
+class VersionConflict(Exception):
+    """手順書が、更新の前提とした版数の後に他の更新で変更されていた"""
+
+    def __init__(self, current_version):
+        super().__init__(f'手順書は版数 {current_version} に更新されています')
+        self.current_version = current_version
+
+
+def update_manual_row(cursor, manual_id, values, expected_version=None):
+    """
+    手順書の基本情報（values: 列名と値の辞書、空でもよい）を更新し、版数を1つ進めて新しい版数を返す
+    expected_version を指定した場合は、その版数のときだけ更新する（異なれば VersionConflict）
+    ステップ・タグを変更する前に呼び出し、競合した場合は何も書き込まないようにする
+    """
+    assignments = [f'{field} = ?' for field in values]
+    assignments.append("updated_at = datetime('now', 'localtime')")
+    assignments.append('version = version + 1')
+    params = list(values.values()) + [manual_id]
+    condition = 'id = ?'
+    if expected_version is not None:
+        condition += ' AND version = ?'
+        params.append(expected_version)
+    cursor.execute(f"UPDATE manuals SET {', '.join(assignments)} WHERE {condition}", params)
+    updated = cursor.rowcount
+
+    cursor.execute('SELECT version FROM manuals WHERE id = ?', (manual_id,))
+    version = cursor.fetchone()['version']
+    if not updated:
+        raise VersionConflict(version)
+    return version
+
+
+def step_values(step, step_number):
+    """送信されたステップから保存する列の値を作成（未指定の列は従来どおりの既定値）"""
+    return {
+        'title': step.get('title', f'ステップ {step_number}'),
+        'content': step.get('content', ''),
+        'note': step.get('note', ''),
+        'image_path': step.get('image_path', ''),
+    }
+
+
+def parse_step_id(value):
+    """ステップIDを整数に変換（新規のステップなど、IDでない場合は None）"""
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def sync_steps(cursor, manual_id, steps):
+    """
+    手順書のステップを送信された並び・内容に合わせる
+    実行した件数の辞書（inserted, updated, moved, deleted）を返す
+    """
+    cursor.execute(f'''
+        SELECT id, step_number, {', '.join(STEP_FIELDS)} FROM manual_steps
+        WHERE manual_id = ?
+    ''', (manual_id,))
+    existing = {row['id']: row for row in cursor.fetchall()}
+
+    kept = set()
+    inserts = []
+    moves = []
+    updates = []
+    for step_number, step in enumerate(steps, start=1):
+        values = step_values(step, step_number)
+        step_id = parse_step_id(step.get('id'))
+        row = existing.get(step_id)
+        if row is None or step_id in kept:
+            inserts.append((manual_id, step_number) + tuple(values[field] for field in STEP_FIELDS))
+            continue
+
+        kept.add(step_id)
+        if row['step_number'] != step_number:
+            moves.append((step_number, step_id))
+        changed = [field for field in STEP_FIELDS if row[field] != values[field]]
+        if changed:
+            updates.append((changed, [values[field] for field in changed] + [step_id]))
+
+    deletes = [(step_id,) for step_id in existing if step_id not in kept]
+    if deletes:
+        cursor.executemany('DELETE FROM manual_steps WHERE id = ?', deletes)
+    if moves:
+        cursor.executemany('UPDATE manual_steps SET step_number = ? WHERE id = ?', moves)
+    for changed, params in updates:
+        # 変更された列だけを更新する（画像の参照数・検索インデックスのトリガーを不要に動かさない）
+        assignments = ', '.join(f'{field} = ?' for field in changed)
+        cursor.execute(f'UPDATE manual_steps SET {assignments} WHERE id = ?', params)
+    if inserts:
+        cursor.executemany(f'''
+            INSERT INTO manual_steps (manual_id, step_number, {', '.join(STEP_FIELDS)})
+            VALUES (?, ?, {', '.join('?' for _ in STEP_FIELDS)})
+        ''', inserts)
+
+    return {
+        'inserted': len(inserts),
+        'updated': len(updates),
+        'moved': len(moves),
+        'deleted': len(deletes),
+    }
+
+
+def normalize_tags(tag_names):
+    """空のタグと重複を除いたタグ名の一覧（順序は保つ）"""
+    names = []
+    for name in tag_names:
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def sync_tags(cursor, manual_id, tag_names):
+    """
+    手順書のタグを送信された一覧に合わせる（未登録のタグは作成する）
+    (追加した件数, 外した件数) を返す
+    """
+    names = normalize_tags(tag_names)
+    cursor.execute('''
+        SELECT t.id, t.name FROM manual_tags mt
+        JOIN tags t ON mt.tag_id = t.id
+        WHERE mt.manual_id = ?
+    ''', (manual_id,))
+    current = {row['name']: row['id'] for row in cursor.fetchall()}
+
+    removed = [(manual_id, tag_id) for name, tag_id in current.items() if name not in names]
+    if removed:
+        cursor.executemany('DELETE FROM manual_tags WHERE manual_id = ? AND tag_id = ?', removed)
+
+    added = [name for name in names if name not in current]
+    if added:
+        cursor.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(name,) for name in added])
+        cursor.execute(f"SELECT id, name FROM tags WHERE name IN ({', '.join('?' for _ in added)})", added)
+        tag_ids = {row['name']: row['id'] for row in cursor.fetchall()}
+        # 指定された順に関連付ける（手順書詳細APIはこの順でタグを返す）
+        cursor.executemany('''
+            INSERT OR IGNORE INTO manual_tags (manual_id, tag_id)
+            VALUES (?, ?)
+        ''', [(manual_id, tag_ids[name]) for name in added])
+
+    return len(added), len(removed)
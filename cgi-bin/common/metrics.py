@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+監視用のメトリクスの集計
+リクエスト数・応答時間の分布（エンドポイントごと）・ステータスコード・データベースのロック待ちの失敗・
+アップロード量をプロセス内で集計し、別ファイルのメトリクス用データベースに加算する
+（CGIはリクエストごとにプロセスが終了するため、プロセスをまたいで合計するにはファイルに残す必要がある）
+
+加算のタイミング:
+    - CGIではリクエストの終了時
+    - 常駐デーモン・FastCGI・WSGIサーバーでは FLUSH_INTERVAL 秒ごとのリクエストの終了時と、プロセスの終了時
+
+環境変数:
+    MF_METRICS          0 にすると集計しない（既定は集計する）
+    MF_METRICS_PATH     メトリクス用データベースのパス（既定 database/metrics.db）
+    MF_METRICS_FLUSH_INTERVAL  常駐プロセスで加算する間隔（秒、既定5）
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import threading
+
+METRICS_ENABLED = os.environ.get('MF_METRICS', '1') != '0'
+
+METRICS_PATH = os.environ.get('MF_METRICS_PATH') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'database', 'metrics.db'
+)
+
+FLUSH_INTERVAL = float(os.environ.get('MF_METRICS_FLUSH_INTERVAL', '5'))
+
+# メトリクス用データベースのロック待ちの上限（ミリ秒）
+BUSY_TIMEOUT_MS = 2000
+
+# 応答時間のヒストグラムの区切り（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT NOT NULL,
+        labels TEXT NOT NULL,
+        value REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (name, labels)
+    )
+'''
+
+# 出力するメトリクスの種類と説明（この順に出力する）
+METRIC_FAMILIES = (
+    ('mf_http_requests_total', 'counter', 'APIリクエスト数（エンドポイント・メソッド・ステータスコード別）'),
+    ('mf_http_request_duration_seconds', 'histogram', 'APIの応答時間（秒）'),
+    ('mf_db_lock_errors_total', 'counter', 'ロック待ちの上限を超えて失敗したSQLの数'),
+    ('mf_uploads_total', 'counter', '画像のアップロード数（結果別）'),
+    ('mf_upload_bytes_total', 'counter', 'アップロードされた画像の合計バイト数'),
+)
+
+# ラベルのないカウンター（まだ加算されていなくても 0 を出力する）
+UNLABELLED_COUNTERS = ('mf_db_lock_errors_total', 'mf_upload_bytes_total')
+
+# 集計中の値（(名前, ラベル) -> 加算する値）
+_pending = {}
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_atexit_registered = False
+
+
+def format_labels(**labels):
+    """ラベルをPrometheusのテキスト形式（name="value",...）にする"""
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return ','.join(parts)
+
+
+def increment(name, value=1, **labels):
+    """カウンター name に value を加算する（集計しない設定の場合は何もしない）"""
+    global _atexit_registered
+    if not METRICS_ENABLED:
+        return
+    key = (name, format_labels(**labels))
+    with _lock:
+        _pending[key] = _pending.get(key, 0) + value
+        if not _atexit_registered:
+            atexit.register(flush_metrics)
+            _atexit_registered = True
+
+
+def record_request(endpoint, method, status, elapsed):
+    """1リクエストの結果を集計する"""
+    endpoint = endpoint or 'unknown'
+    increment('mf_http_requests_total', endpoint=endpoint, method=method or '', status=status)
+    # ヒストグラムの区切りごとの件数は累積せずに保存し、出力時に累積する
+    bucket = next((f'{le:g}' for le in DURATION_BUCKETS if elapsed <= le), '+Inf')
+    increment('mf_http_request_duration_seconds_bucket', endpoint=endpoint, le=bucket)
+    increment('mf_http_request_duration_seconds_sum', elapsed, endpoint=endpoint)
+    increment('mf_http_request_duration_seconds_count', endpoint=endpoint)
+
+
+def request_finished(run_once=False):
+    """リクエストの終了時に呼び出す（CGI、または前回から FLUSH_INTERVAL 秒経過していれば加算する）"""
+    if run_once or time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush_metrics()
+
+
+def _connect():
+    # トランザクションは明示的に管理する
+    conn = sqlite3.connect(METRICS_PATH, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    # メトリクスは停電時に直近の値を失っても問題ないため同期しない
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute(METRICS_SCHEMA)
+    return conn
+
+
+def flush_metrics():
+    """集計中の値をメトリクス用データベースに加算する（失敗しても処理には影響させず、値は次回に持ち越す）"""
+    global _last_flush
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+
+    try:
+        conn = _connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT OR IGNORE INTO counters (name, labels, value) VALUES (?, ?, 0)',
+                list(pending)
+            )
+            conn.executemany(
+                'UPDATE counters SET value = value + ? WHERE name = ? AND labels = ?',
+                [(value, name, labels) for (name, labels), value in pending.items()]
+            )
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        with _lock:
+            for key, value in pending.items():
+                _pending[key] = _pending.get(key, 0) + value
+
+
+def load_counters():
+    """メトリクス用データベースの値を {名前: [(ラベル, 値), ...]} で取得"""
+    counters = {}
+    if not os.path.exists(METRICS_PATH):
+        return counters
+    conn = _connect()
+    try:
+        for name, labels, value in conn.execute('SELECT name, labels, value FROM counters ORDER BY name, labels'):
+            counters.setdefault(name, []).append((labels, value))
+    finally:
+        conn.close()
+    return counters
+
+
+def render_metrics(counters, gauges=()):
+    """
+    Prometheusのテキスト形式（version 0.0.4）で出力する文字列を作成
+    gauges は (名前, 説明, [(ラベル, 値), ...]) の一覧
+    """
+    lines = []
+    for name, kind, description in METRIC_FAMILIES:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            lines.extend(_render_histogram(name, counters))
+        else:
+            samples = counters.get(name) or ([('', 0)] if name in UNLABELLED_COUNTERS else [])
+            lines.extend(_sample(name, labels, value) for labels, value in samples)
+
+    for name, description, samples in gauges:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.extend(_sample(name, labels, value) for labels, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+def _render_histogram(name, counters):
+    """区切りごとの件数を累積し、エンドポイントごとに _bucket / _sum / _count を出力"""
+    buckets = {}
+    for labels, value in counters.get(name + '_bucket', ()):
+        endpoint_labels, _, le = labels.rpartition(',le=')
+        buckets.setdefault(endpoint_labels, {})[le.strip('"')] = value
+    sums = dict(counters.get(name + '_sum', ()))
+    counts = dict(counters.get(name + '_count', ()))
+
+    lines = []
+    for endpoint_labels in sorted(set(buckets) | set(counts)):
+        observed = buckets.get(endpoint_labels, {})
+        cumulative = 0
+        for le in [f'{le:g}' for le in DURATION_BUCKETS] + ['+Inf']:
+            cumulative += observed.get(le, 0)
+            lines.append(_sample(name + '_bucket', f'{endpoint_labels},le="{le}"', cumulative))
+        lines.append(_sample(name + '_sum', endpoint_labels, sums.get(endpoint_labels, 0)))
+        lines.append(_sample(name + '_count', endpoint_labels, counts.get(endpoint_labels, 0)))
+    return lines
+
+
+def _sample(name, labels, value):
+    value = int(value) if float(value).is_integer() else value
+    return f'{name}{{{labels}}} {value}' if labels else f'{name} {value}'
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+multipart/form-data のストリーミング解析
+cgi.FieldStorage（Python 3.13 で削除）の代わりに使用する
+
+リクエスト本文を一定の大きさずつ読み込み、ファイルは一時ファイルへ書き出しながら
+SHA-256 を計算する。サイズの上限を超えた時点で読み込みを中止するため、
+メモリ上にはファイル全体を保持しない
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+# 一度に読み込む大きさ（バイト）
+CHUNK_SIZE = 64 * 1024
+
+# 各パートのヘッダーの最大サイズ
+MAX_HEADER_SIZE = 16 * 1024
+
+# ファイル以外の項目の最大サイズ
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class MultipartError(ValueError):
+    """multipart/form-data の形式が不正"""
+
+
+class PartTooLarge(MultipartError):
+    """リクエスト本文・ファイル・項目がサイズの上限を超えた"""
+
+    def __init__(self, message, limit):
+        super().__init__(message)
+        self.limit = limit
+
+
+class UploadedFile:
+    """一時ファイルに保存されたアップロードファイル"""
+
+    def __init__(self, name, filename, content_type, path):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        """内容のSHA-256（16進数）"""
+        return self._hash.hexdigest()
+
+    def write(self, data, file):
+        self.size += len(data)
+        self._hash.update(data)
+        file.write(data)
+
+    def save(self, destination):
+        """一時ファイルを保存先へ移動（同じファイルシステムであればコピーしない）"""
+        shutil.move(self.path, destination)
+        # 一時ファイルは所有者のみ読み書き可能で作成されるため、Webサーバーから配信できるようにする
+        os.chmod(destination, 0o644)
+        self.path = None
+
+    def discard(self):
+        """保存しなかった一時ファイルを削除"""
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+class MultipartForm:
+    """解析結果（fields: 項目名と文字列、files: 項目名と UploadedFile）"""
+
+    def __init__(self):
+        self.fields = {}
+        self.files = {}
+
+    def close(self):
+        """保存されなかった一時ファイルをすべて削除"""
+        for uploaded in self.files.values():
+            uploaded.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def parse_header_value(value):
+    """Content-Type / Content-Disposition の値を (値, パラメーターの辞書) に分解"""
+    parts = _split_params(value)
+    main = parts[0].strip().lower() if parts else ''
+    params = {}
+    for item in parts[1:]:
+        key, sep, param = item.partition('=')
+        if not sep:
+            continue
+        param = param.strip()
+        if len(param) >= 2 and param[0] == param[-1] == '"':
+            param = param[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+        params[key.strip().lower()] = param
+    return main, params
+
+
+def _split_params(value):
+    """引用符の中の ; を区切りとみなさずに分割"""
+    parts, current, quoted, escaped = [], [], False, False
+    for char in value:
+        if escaped:
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == ';' and not quoted:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append(''.join(current))
+    return parts
+
+
+class _BodyReader:
+    """Content-Length を超えて読まないリクエスト本文の読み込み"""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=CHUNK_SIZE):
+        if self.remaining <= 0:
+            return b''
+        data = self.stream.read(min(size, self.remaining))
+        if not data:
+            raise MultipartError('リクエスト本文が途中で終わっています')
+        self.remaining -= len(data)
+        return data
+
+
+def parse_multipart(request, max_file_size, max_content_length=None, tmp_dir=None):
+    """
+    multipart/form-data のリクエスト本文を解析して MultipartForm を返す
+
+    ファイルが max_file_size を超えた場合、または Content-Length が max_content_length を
+    超えた場合は、その時点で PartTooLarge を送出する（作成済みの一時ファイルは削除する）
+    """
+    content_type, params = parse_header_value(request.environ.get('CONTENT_TYPE', ''))
+    boundary = params.get('boundary')
+    if content_type != 'multipart/form-data' or not boundary:
+        raise MultipartError('multipart/form-data ではありません')
+
+    length = request.content_length
+    if max_content_length is not None and length > max_content_length:
+        # 本文を読み込まずに中止する
+        raise PartTooLarge('リクエストが大きすぎます', max_content_length)
+
+    form = MultipartForm()
+    try:
+        _parse(_BodyReader(request.stream, length), boundary.encode('latin-1'), form, max_file_size, tmp_dir)
+    except BaseException:
+        form.close()
+        raise
+    return form
+
+
+def _parse(reader, boundary, form, max_file_size, tmp_dir):
+    delimiter = b'\r\n--' + boundary
+    buffer = bytearray(b'\r\n')
+
+    # 最初の区切りまでを読み飛ばす（区切りの前のプリアンブルは無視する）
+    while True:
+        index = buffer.find(delimiter)
+        if index >= 0:
+            del buffer[:index + len(delimiter)]
+            break
+        del buffer[:max(0, len(buffer) - len(delimiter))]
+        chunk = reader.read()
+        if not chunk:
+            raise MultipartError('区切り文字が見つかりません')
+        buffer += chunk
+
+    while True:
+        # 区切りの直後: "--" なら終端、CRLF なら次のパート
+        while len(buffer) < 2:
+            chunk = reader.read()
+            if not chunk:
+                raise MultipartError('リクエスト本文が途中で終わっています')
+            buffer += chunk
+        if buffer[:2] == b'--':
+            return
+        if buffer[:2] != b'\r\n':
+            raise MultipartError('区切り文字の形式が不正です')
+        del buffer[:2]
+
+        # パートのヘッダー
+        while True:
+            index = buffer.find(b'\r\n\r\n')
+            if index >= 0:
+                break
+            if len(buffer) > MAX_HEADER_SIZE:
+                raise PartTooLarge('ヘッダーが大きすぎます', MAX_HEADER_SIZE)
+            chunk = reader.read()
+            if not chunk:
+                raise MultipartError('リクエスト本文が途中で終わっています')
+            buffer += chunk
+        headers = _parse_part_headers(bytes(buffer[:index]))
+        del buffer[:index + 4]
+
+        _, disposition = parse_header_value(headers.get('content-disposition', ''))
+        name = disposition.get('name')
+        filename = disposition.get('filename')
+
+        if filename is not None:
+            fd, path = tempfile.mkstemp(prefix='mf_upload_', suffix='.tmp', dir=tmp_dir)
+            uploaded = UploadedFile(name, filename, headers.get('content-type'), path)
+            previous = form.files.get(name)
+            form.files[name] = uploaded
+            if previous:
+                # 同名の項目は最後のファイルを採用する
+                previous.discard()
+            with os.fdopen(fd, 'wb') as file:
+                def sink(data):
+                    if uploaded.size + len(data) > max_file_size:
+                        raise PartTooLarge('ファイルサイズが大きすぎます', max_file_size)
+                    uploaded.write(data, file)
+                buffer = _read_part(reader, buffer, delimiter, sink)
+        else:
+            value = bytearray()
+            def sink(data):
+                if len(value) + len(data) > MAX_FIELD_SIZE:
+                    raise PartTooLarge('項目が大きすぎます', MAX_FIELD_SIZE)
+                value.extend(data)
+            buffer = _read_part(reader, buffer, delimiter, sink)
+            if name is not None:
+                form.fields[name] = value.decode('utf-8', 'replace')
+
+
+def _read_part(reader, buffer, delimiter, sink):
+    """次の区切りまでのデータを sink に渡し、区切りより後のバッファーを返す"""
+    while True:
+        index = buffer.find(delimiter)
+        if index >= 0:
+            if index:
+                sink(bytes(buffer[:index]))
+            del buffer[:index + len(delimiter)]
+            return buffer
+        # 区切りの一部かもしれない末尾だけを残して書き出す
+        keep = len(delimiter) - 1
+        if len(buffer) > keep:
+            sink(bytes(buffer[:-keep]))
+            del buffer[:-keep]
+        chunk = reader.read()
+        if not chunk:
+            raise MultipartError('リクエスト本文が途中で終わっています')
+        buffer += chunk
+
+
+def _parse_part_headers(data):
+    """パートのヘッダーを辞書（小文字の名前と値）に変換"""
+    headers = {}
+    for line in data.decode('utf-8', 'replace').split('\r\n'):
+        key, sep, value = line.partition(':')
+        if sep:
+            headers[key.strip().lower()] = value.strip()
+    return headers
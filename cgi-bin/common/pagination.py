@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+キーセット（カーソル）ページネーション
+OFFSET を使わず、前ページ最後の行の (ソート列の値, id) より後ろの行を取得する
+カーソルはクライアントにとって不透明な文字列として扱う
+"""
+
+import json
+import base64
+
+
+class InvalidCursor(ValueError):
+    """カーソルが不正な場合の例外"""
+
+
+def encode_cursor(sort, order, value, row_id):
+    """ソート条件と最後の行のキーからカーソル文字列を作成"""
+    payload = json.dumps({'s': sort, 'o': order, 'v': value, 'id': row_id},
+                         ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort, order):
+    """
+    カーソル文字列を (ソート列の値, id) に変換
+    ソート条件が作成時と異なる場合は InvalidCursor を送出する
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        value, row_id = payload['v'], int(payload['id'])
+        matches = payload['s'] == sort and payload['o'] == order
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('カーソルが不正です')
+    if not matches:
+        raise InvalidCursor('カーソルとソート条件が一致しません')
+    return value, row_id
+
+
+def keyset_condition(column, id_column, order):
+    """
+    カーソル位置より後ろの行を絞り込むWHERE句を返す
+    パラメータは (値, id) の順で渡す
+    行値の比較にすることで (ソート列, id) の複合インデックスを範囲検索に使える（SQLite 3.15.0 以降）
+    """
+    operator = '<' if order.upper() == 'DESC' else '>'
+    return f'({column}, {id_column}) {operator} (?, ?)'
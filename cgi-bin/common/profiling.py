@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+リクエストのプロファイル取得（cProfile）
+指定されたリクエストを cProfile で計測し、エンドポイント名と日時を付けた .prof ファイルに保存する
+保存したファイルは tools/profile_report.py でエンドポイントごとに集計できる
+
+取得するリクエスト:
+    - 環境変数 MF_PROFILE が 1（全エンドポイント）またはエンドポイント名のカンマ区切り（manuals_get,manuals_list）
+    - MF_PROFILE に header を含めた場合（header、manuals_get,header など）、
+      X-MF-Profile: 1 ヘッダーを付けた管理者のリクエスト（本番環境のCGIで再現させる場合）
+
+MF_PROFILE でエンドポイントを指定した場合、CGIでは共通モジュールの読み込み前（common.shim の読み込み時）から
+計測を始めるため、モジュールの読み込みやサーバー環境の設定にかかる時間も含まれる
+ヘッダーによる取得は管理者であることを確認してから計測を始めるため、読み込みの時間は含まれない
+（認証前のリクエストで計測を始めさせない）
+
+環境変数:
+    MF_PROFILE      取得するエンドポイント・header（上記）
+    MF_PROFILE_DIR  保存先のディレクトリ（既定 database/profiles）
+"""
+
+import os
+import re
+import sys
+import time
+import itertools
+
+PROFILE_SETTING = os.environ.get('MF_PROFILE', '').strip()
+
+PROFILE_DIR = os.environ.get('MF_PROFILE_DIR') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'database', 'profiles'
+)
+
+# MF_PROFILE の指定（カンマ区切り）
+PROFILE_NAMES = {name.strip().lower() for name in PROFILE_SETTING.split(',') if name.strip()}
+
+# ヘッダーによる取得を許可する MF_PROFILE の値
+HEADER_SETTING = 'header'
+
+# 管理者がプロファイルの取得を指定するヘッダー（WSGI environ のキー）
+PROFILE_HEADER_KEY = 'HTTP_X_MF_PROFILE'
+
+# 保存したファイル名を返すレスポンスヘッダー
+PROFILE_RESPONSE_HEADER = 'X-MF-Profile-File'
+
+# プロセスの開始時から計測しているプロファイラー（CGIのみ）
+_startup_profiler = None
+
+# 同じ秒に保存したファイルを区別する連番
+_sequence = itertools.count(1)
+
+
+def _new_profiler():
+    """計測を開始したプロファイラー（他のプロファイラーが動作中で開始できない場合は None）"""
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+def start_startup_profile(endpoint):
+    """
+    CGIのプロセスで、MF_PROFILE でこのエンドポイントが指定されていればモジュールの読み込み前から計測を始める
+    （リクエストのヘッダーでは開始しない）
+    """
+    global _startup_profiler
+    if _startup_profiler is None and is_enabled_for(endpoint):
+        _startup_profiler = _new_profiler()
+
+
+def is_enabled_for(endpoint):
+    """環境変数 MF_PROFILE でこのエンドポイントのプロファイルの取得が指定されているか"""
+    if PROFILE_NAMES & {'1', 'all'}:
+        return True
+    return endpoint in PROFILE_NAMES - {'0', HEADER_SETTING}
+
+
+def is_requested_by_admin(environ):
+    """ヘッダーによる取得が許可されていて、X-MF-Profile ヘッダーを付けたリクエストが管理者のセッションか"""
+    if HEADER_SETTING not in PROFILE_NAMES:
+        return False
+    if environ.get(PROFILE_HEADER_KEY, '').strip() in ('', '0'):
+        return False
+    from .auth import get_session_user
+    from .wsgi import Request
+
+    try:
+        current_user = get_session_user(Request(environ).cookies.get('session_id'), verify=True)
+    except Exception:
+        # 確認できない場合は取得せず、リクエストの処理は続ける
+        return False
+    return bool(current_user) and current_user['role'] == 'admin'
+
+
+def start_request(endpoint, environ):
+    """
+    このリクエストのプロファイルを取得する場合は計測中のプロファイラーを返す（取得しない場合は None）
+    CGIではプロセスの開始時からの計測を引き継ぐ
+    """
+    global _startup_profiler
+    startup_profiler, _startup_profiler = _startup_profiler, None
+    if not (is_enabled_for(endpoint) or is_requested_by_admin(environ)):
+        if startup_profiler is not None:
+            startup_profiler.disable()
+        return None
+    return startup_profiler or _new_profiler()
+
+
+def finish_request(profiler, endpoint):
+    """計測を終了して .prof ファイルに保存し、ファイル名を返す（保存できなかった場合は None）"""
+    profiler.disable()
+    name = re.sub(r'[^\w-]', '_', endpoint or 'unknown')
+    filename = f'{name}.{time.strftime("%Y%m%d-%H%M%S")}.{os.getpid()}.{next(_sequence)}.prof'
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+    except OSError as e:
+        # 保存できなくてもレスポンスには影響させない
+        print(f'プロファイルを保存できません: {e}', file=sys.stderr)
+        return None
+    return filename
+
+
+def parse_filename(filename):
+    """保存したファイル名からエンドポイント名を取得（このモジュールが保存したファイルでなければ None）"""
+    parts = os.path.basename(filename).split('.')
+    if len(parts) != 5 or parts[-1] != 'prof':
+        return None
+    return parts[0]
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+手順書の全文検索
+FTS5（trigram）インデックス manuals_fts があればBM25で順位付けして検索し、
+なければ従来どおり LIKE で検索する
+"""
+
+import sqlite3
+from collections import namedtuple
+
+# trigram で検索できる最短の文字数（これより短い語は部分一致で絞り込む）
+MIN_TERM_LENGTH = 3
+
+# BM25の列ごとの重み（title, description, steps, tags）
+RANK_WEIGHTS = (10.0, 5.0, 1.0, 3.0)
+
+# スニペットの一致箇所を囲む制御文字（フロントエンドでエスケープ後に <mark> へ置き換える）
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+SNIPPET_TOKENS = 32
+
+# manuals_fts の列
+FTS_COLUMNS = ('title', 'description', 'steps', 'tags')
+
+# 検索条件
+#   join: 手順書 m と結合する副問い合わせ（hit.manual_id, hit.score）
+#   params: join のパラメータ
+#   ranked: hit.score がBM25スコア（小さいほど関連度が高い）かどうか
+#   match_query: スニペット取得用のFTS5クエリ（なければ None）
+SearchFilter = namedtuple('SearchFilter', ['join', 'params', 'ranked', 'match_query'])
+
+# 全文検索インデックスが利用可能と確認済みか（未作成の場合は移行後に検出できるよう毎回確認する）
+_fts_available = False
+
+
+def is_fts_available(cursor):
+    """manuals_fts が作成済みで、この環境のSQLiteで利用できるか"""
+    global _fts_available
+    if _fts_available:
+        return True
+    if sqlite3.sqlite_version_info < (3, 34, 0):
+        return False
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'manuals_fts'")
+    _fts_available = cursor.fetchone() is not None
+    return _fts_available
+
+
+def refresh_search_index(cursor):
+    """
+    トリガーが manuals_fts_pending に記録した手順書のインデックスを再構築する（コミット前に呼び出す）
+    ステップ・タグを何行変更しても、1手順書につき1回だけ全ステップ・タグを連結し直す
+    """
+    if not is_fts_available(cursor):
+        return 0
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'manuals_fts_pending'")
+    if cursor.fetchone() is None:
+        # 移行前のデータベース（行ごとに再構築するトリガーのまま）
+        return 0
+    cursor.execute('SELECT manual_id FROM manuals_fts_pending')
+    manual_ids = [row[0] for row in cursor.fetchall()]
+    if not manual_ids:
+        return 0
+
+    cursor.execute('DELETE FROM manuals_fts WHERE rowid IN (SELECT manual_id FROM manuals_fts_pending)')
+    # 削除された手順書は manuals_search_source に含まれないため、インデックスから消えたままになる
+    cursor.execute('''
+        INSERT INTO manuals_fts (rowid, title, description, steps, tags)
+        SELECT id, title, description, steps, tags FROM manuals_search_source
+        WHERE id IN (SELECT manual_id FROM manuals_fts_pending)
+    ''')
+    cursor.execute('DELETE FROM manuals_fts_pending')
+    return len(manual_ids)
+
+
+def split_terms(text):
+    """検索語を空白（全角スペースを含む）で分割"""
+    return [term for term in text.split() if term]
+
+
+def quote_term(term):
+    """FTS5クエリのフレーズとして引用符で囲む"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def build_search_filter(cursor, text):
+    """
+    検索語から手順書を絞り込む条件を作成
+
+    3文字以上の語は FTS5 の MATCH（AND検索）でBM25の順位を付け、
+    2文字以下の語はインデックス内のテキストに対する部分一致で絞り込む
+    """
+    terms = split_terms(text)
+    if not terms:
+        return None
+
+    if not is_fts_available(cursor):
+        return _build_like_filter(terms)
+
+    long_terms = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    short_terms = [term for term in terms if len(term) < MIN_TERM_LENGTH]
+
+    conditions = []
+    params = []
+    match_query = None
+    if long_terms:
+        match_query = ' AND '.join(quote_term(term) for term in long_terms)
+        conditions.append('manuals_fts MATCH ?')
+        params.append(match_query)
+    for term in short_terms:
+        # trigram インデックスは3文字未満の LIKE に一致しないため instr で判定する
+        conditions.append('(' + ' OR '.join(f'instr(lower({column}), lower(?)) > 0' for column in FTS_COLUMNS) + ')')
+        params.extend([term] * len(FTS_COLUMNS))
+
+    if match_query:
+        weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+        score = f'bm25(manuals_fts, {weights})'
+    else:
+        score = '0'
+
+    join = f'''
+        JOIN (
+            SELECT rowid AS manual_id, {score} AS score
+            FROM manuals_fts
+            WHERE {' AND '.join(conditions)}
+        ) hit ON hit.manual_id = m.id
+    '''
+    return SearchFilter(join, params, match_query is not None, match_query)
+
+
+def _build_like_filter(terms):
+    """全文検索インデックスがない場合の LIKE 検索（タイトル・説明・タグ）"""
+    conditions = []
+    params = []
+    for term in terms:
+        pattern = f'%{term}%'
+        conditions.append('''
+            (
+                m_search.title LIKE ?
+                OR m_search.description LIKE ?
+                OR EXISTS (
+                    SELECT 1
+                    FROM manual_tags mt_search
+                    JOIN tags t_search ON mt_search.tag_id = t_search.id
+                    WHERE mt_search.manual_id = m_search.id
+                      AND t_search.name LIKE ?
+                )
+            )
+        ''')
+        params.extend([pattern, pattern, pattern])
+
+    join = f'''
+        JOIN (
+            SELECT m_search.id AS manual_id, 0 AS score
+            FROM manuals m_search
+            WHERE {' AND '.join(conditions)}
+        ) hit ON hit.manual_id = m.id
+    '''
+    return SearchFilter(join, params, False, None)
+
+
+def fetch_snippets(cursor, match_query, manual_ids):
+    """指定した手順書の一致箇所のスニペットをまとめて取得（手順書IDとスニペットの辞書）"""
+    if not match_query or not manual_ids:
+        return {}
+    placeholders = ', '.join('?' * len(manual_ids))
+    cursor.execute(f'''
+        SELECT rowid AS manual_id, snippet(manuals_fts, -1, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet
+        FROM manuals_fts
+        WHERE manuals_fts MATCH ? AND rowid IN ({placeholders})
+    ''', (SNIPPET_START, SNIPPET_END, match_query, *manual_ids))
+    return {row['manual_id']: row['snippet'] for row in cursor.fetchall()}
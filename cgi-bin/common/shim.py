@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+常駐デーモン転送モジュール
+CGIスクリプトから常駐デーモンへリクエストを転送する
+重い共通モジュールを読み込む前に呼び出すため、標準ライブラリの軽量なモジュールのみを使用する
+"""
+
+import os
+import sys
+import json
+import struct
+
+# CGIで MF_PROFILE にこのエンドポイントが指定されていれば、以降のモジュールの読み込みも含めて計測する
+# （リクエストのヘッダーによる取得は認証後に開始するため、ここでは参照しない）
+if os.environ.get('REQUEST_METHOD') and os.environ.get('MF_PROFILE'):
+    from . import profiling
+    profiling.start_startup_profile(os.path.splitext(os.path.basename(sys.argv[0]))[0])
+
+# デーモンのアドレスを記録するファイル（デーモン起動時に作成される）
+DAEMON_ADDRESS_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'database', 'daemon.addr'
+)
+
+# 接続タイムアウト（秒）
+CONNECT_TIMEOUT = 1.0
+
+# 応答待ちタイムアウト（秒）
+RESPONSE_TIMEOUT = 120.0
+
+# 転送するCGI環境変数（HTTP_* は全て転送する）
+CGI_VARIABLES = (
+    'AUTH_TYPE', 'CONTENT_LENGTH', 'CONTENT_TYPE', 'GATEWAY_INTERFACE',
+    'PATH_INFO', 'PATH_TRANSLATED', 'QUERY_STRING', 'REMOTE_ADDR',
+    'REMOTE_HOST', 'REMOTE_USER', 'REQUEST_METHOD', 'REQUEST_URI',
+    'SCRIPT_NAME', 'SERVER_NAME', 'SERVER_PORT', 'SERVER_PROTOCOL',
+    'SERVER_SOFTWARE', 'HTTPS',
+)
+
+# リクエストヘッダー: 環境変数JSONの長さ, 本文の長さ
+HEADER_FORMAT = '!II'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# リクエスト本文の上限（バイト、環境変数 MF_MAX_BODY_SIZE で変更可能）
+# 超えたリクエストは本文を読み込まずに 413 で拒否する（common.wsgi.process_request）
+MAX_BODY_SIZE = int(os.environ.get('MF_MAX_BODY_SIZE') or 8 * 1024 * 1024)
+
+# 本文を転送する単位（バイト）
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+def get_daemon_address():
+    """転送先のデーモンアドレスを取得（未設定の場合はNone）"""
+    address = os.environ.get('MF_DAEMON_ADDRESS')
+    if address:
+        # off の場合は daemon.addr があっても転送しない（起動時間の計測など）
+        return None if address == 'off' else address
+    try:
+        with open(DAEMON_ADDRESS_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def parse_address(address):
+    """'unix:/path/to.sock' または 'host:port' 形式のアドレスを解析"""
+    import socket
+
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+def connect(address, timeout=CONNECT_TIMEOUT):
+    """デーモンへ接続"""
+    import socket
+
+    family, sockaddr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(sockaddr)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def encode_request(environ, body_length):
+    """CGI環境変数と本文の長さを転送用のバイト列に変換（本文はこの後に続けて送る）"""
+    env_bytes = json.dumps(environ, ensure_ascii=False).encode('utf-8')
+    return struct.pack(HEADER_FORMAT, len(env_bytes), body_length) + env_bytes
+
+
+def collect_environ(endpoint):
+    """転送するCGI環境変数を収集"""
+    environ = {
+        key: value for key, value in os.environ.items()
+        if key in CGI_VARIABLES or key.startswith('HTTP_')
+    }
+    environ['MF_ENDPOINT'] = endpoint
+    return environ
+
+
+def get_content_length():
+    """リクエスト本文の長さ（Content-Length）"""
+    try:
+        return max(int(os.environ.get('CONTENT_LENGTH') or 0), 0)
+    except ValueError:
+        return 0
+
+
+def send_body(sock, content_length):
+    """標準入力のリクエスト本文を BODY_CHUNK_SIZE ずつデーモンへ送る（全体をメモリに読み込まない）"""
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    remaining = content_length
+    while remaining > 0:
+        chunk = stdin.read(min(BODY_CHUNK_SIZE, remaining))
+        if not chunk:
+            # 本文が Content-Length より短い（デーモン側では本文の途中で終わったものとして扱う）
+            break
+        sock.sendall(chunk)
+        remaining -= len(chunk)
+
+
+def forward_to_daemon():
+    """
+    常駐デーモンが起動していればリクエストを転送する
+
+    Returns:
+        bool: 転送して応答を出力した場合はTrue、
+              デーモンが利用できずCGIとして処理を続行すべき場合はFalse
+    """
+    address = get_daemon_address()
+    if not address:
+        return False
+
+    content_length = get_content_length()
+    if content_length > MAX_BODY_SIZE:
+        # 本文を読み込まずにCGIとして 413 を返す
+        return False
+
+    # デーモンを使わない場合（CGIのみ）には読み込まない
+    import socket
+
+    try:
+        sock = connect(address)
+    except (OSError, ValueError):
+        # デーモン停止中はCGIとしてそのまま処理する
+        return False
+
+    endpoint = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+
+    received = False
+    with sock:
+        try:
+            sock.settimeout(RESPONSE_TIMEOUT)
+            sock.sendall(encode_request(collect_environ(endpoint), content_length))
+            send_body(sock, content_length)
+            sock.shutdown(socket.SHUT_WR)
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                stdout.write(chunk)
+                received = True
+        except OSError:
+            if received:
+                raise
+            # 本文を読み込み済みのためCGIへ戻ることはできない
+            stdout.write(
+                b'Status: 502 Bad Gateway\r\n'
+                b'Content-Type: application/json; charset=utf-8\r\n\r\n'
+                b'{"error": "daemon connection failed"}'
+            )
+        stdout.flush()
+
+    return True
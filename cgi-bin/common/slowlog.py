@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+遅いSQLの記録（スロークエリログ）
+実行と結果の取得にかかった時間が閾値を超えたSQLを、正規化したSQL・パラメーターの形（値は記録しない）・
+EXPLAIN QUERY PLAN の結果とともにJSONで1行ずつ記録する
+実行計画は同じSQL（正規化後）につき最初の1回だけ取得する（CGIの別プロセスとも共有する）
+
+環境変数:
+    MF_SLOW_QUERY_MS        閾値（ミリ秒、既定100）。off で記録しない
+    MF_SLOW_QUERY_LOG       ログファイル（既定 database/slow_query.log）
+    MF_SLOW_QUERY_LOG_SIZE  ローテーションするサイズ（バイト、既定5MB。5世代まで残す）
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from . import timing
+
+_threshold = os.environ.get('MF_SLOW_QUERY_MS', '100').strip().lower()
+# 閾値（秒）。記録しない場合は None
+SLOW_QUERY_SECONDS = None if _threshold in ('', 'off') else float(_threshold) / 1000
+
+SLOW_QUERY_LOG_PATH = os.environ.get('MF_SLOW_QUERY_LOG') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'database', 'slow_query.log'
+)
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('MF_SLOW_QUERY_LOG_SIZE', str(5 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = 5
+
+# 実行計画を取得済みのSQLのハッシュを記録するファイル（CGIの各プロセスで重複して取得しないため）
+PLANS_PATH = SLOW_QUERY_LOG_PATH + '.plans'
+
+# 実行計画を取得する文の種類
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+_lock = threading.Lock()
+_logger = None
+_explained = None
+
+
+def normalize_sql(sql):
+    """リテラルを ? に置き換え、空白をまとめたSQL（IN (?, ?, ...) は IN (?...) にまとめる）"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('IN (?...)', sql)
+
+
+def parameter_shape(parameters, many=False):
+    """パラメーターの型の一覧（値は記録しない）。executemany の場合は1件目の形と件数"""
+    if many:
+        rows = parameters if isinstance(parameters, (list, tuple)) else None
+        first = rows[0] if rows else None
+        return {'rows': len(rows) if rows is not None else None,
+                'first': parameter_shape(first) if first is not None else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def statement_id(normalized):
+    """正規化したSQLの識別子"""
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+def log_slow_query(conn, sql, parameters, elapsed, many=False):
+    """閾値を超えたSQLを記録する（記録に失敗してもSQLの処理には影響させない）"""
+    try:
+        request_timing = timing.current()
+        normalized = normalize_sql(sql)
+        sid = statement_id(normalized)
+        plan = None
+        if _claim_plan(sid):
+            plan = explain(conn, sql, parameters[0] if many and parameters else parameters)
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'endpoint': request_timing.endpoint if request_timing else None,
+            'elapsed_ms': round(elapsed * 1e3, 2),
+            'threshold_ms': round(SLOW_QUERY_SECONDS * 1e3, 2),
+            'statement_id': sid,
+            'sql': normalized,
+            'params': parameter_shape(parameters, many),
+        }
+        if plan is not None:
+            record['plan'] = plan
+            record['full_scan'] = has_full_scan(plan)
+        _get_logger().warning(json.dumps(record, ensure_ascii=False))
+    except Exception:
+        pass
+
+
+def explain(conn, sql, parameters):
+    """EXPLAIN QUERY PLAN の結果（各行の detail）。取得できない文の場合は None"""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    # 実行計画の取得はリクエストの文の数に含めない
+    conn.set_trace_callback(None)
+    try:
+        cursor = conn.cursor(sqlite3.Cursor)
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters or ())
+        return [row[-1] for row in cursor.fetchall()]
+    except Exception:
+        return None
+    finally:
+        conn.set_trace_callback(timing.trace_statement)
+
+
+def has_full_scan(plan):
+    """
+    実行計画にインデックスを使わないテーブルの全件走査（"SCAN m" / "SCAN TABLE manuals AS m"）があるか
+    副問い合わせ（CO-ROUTINE / MATERIALIZE）の結果の走査や全文検索インデックスは除く
+    """
+    subqueries = {line.split(' ', 1)[1] for line in plan
+                  if line.startswith(('CO-ROUTINE ', 'MATERIALIZE ')) and ' ' in line}
+    for line in plan:
+        if not line.startswith('SCAN ') or 'USING' in line:
+            continue
+        target = line[len('SCAN '):]
+        if target.startswith(('(subquery', 'CONSTANT ROW', 'SUBQUERY')) or 'VIRTUAL TABLE' in target:
+            continue
+        if target.split(' ', 1)[0] in subqueries:
+            continue
+        return True
+    return False
+
+
+def _claim_plan(sid):
+    """この文の実行計画をまだ取得していなければ取得済みとして記録し、True を返す"""
+    global _explained
+    with _lock:
+        if _explained is None:
+            try:
+                with open(PLANS_PATH, encoding='ascii') as f:
+                    _explained = set(f.read().split())
+            except OSError:
+                _explained = set()
+        if sid in _explained:
+            return False
+        _explained.add(sid)
+        try:
+            with open(PLANS_PATH, 'a', encoding='ascii') as f:
+                f.write(sid + '\n')
+        except OSError:
+            pass
+        return True
+
+
+def _get_logger():
+    """ローテーションするファイルに書き込むロガー（最初の記録時に作成）"""
+    global _logger
+    with _lock:
+        if _logger is None:
+            import logging
+            from logging.handlers import RotatingFileHandler
+
+            logger = logging.getLogger('manual_factory.slow_query')
+            logger.propagate = False
+            if not logger.handlers:
+                handler = RotatingFileHandler(SLOW_QUERY_LOG_PATH, maxBytes=SLOW_QUERY_LOG_SIZE,
+                                              backupCount=SLOW_QUERY_LOG_BACKUPS, encoding='utf-8', delay=True)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger.addHandler(handler)
+            _logger = logger
+        return _logger
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+リクエストごとの処理時間の計測
+SQLの実行回数・合計時間・最も遅い文と、認証・ハンドラー・JSON化・圧縮の各段階の時間を記録し、
+Server-Timing レスポンスヘッダー（ブラウザの開発者ツールで確認できる）と任意のログに出力する
+
+環境変数:
+    MF_SERVER_TIMING  0 にすると Server-Timing ヘッダーを付けない（既定は付ける）
+    MF_TIMING_LOG     指定したファイル（- の場合は標準エラー）にリクエストごとのJSONを1行ずつ追記する
+
+計測はスレッドごとに行う（常駐デーモンのスレッドプールでも混ざらない）
+リクエストの処理中でなければ記録しない（tools/ のスクリプトなどには影響しない）
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+SERVER_TIMING_ENABLED = os.environ.get('MF_SERVER_TIMING', '1') != '0'
+TIMING_LOG_PATH = os.environ.get('MF_TIMING_LOG')
+
+# ログに記録するSQLの最大文字数
+SQL_LOG_LENGTH = 300
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+class RequestTiming:
+    """1リクエストの計測結果"""
+
+    def __init__(self, endpoint=None, method=None):
+        self.endpoint = endpoint
+        self.method = method
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.slowest_sql = None
+        self.slowest_time = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        """ブロックの処理時間を段階 name に加算する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def record_statement(self):
+        self.query_count += 1
+
+    def record_sql_time(self, sql, elapsed):
+        self.sql_time += elapsed
+        if sql is not None and elapsed > self.slowest_time:
+            self.slowest_sql = sql
+            self.slowest_time = elapsed
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """Server-Timing ヘッダーの値"""
+        metrics = [f'db;dur={self.sql_time * 1e3:.1f};desc="{self.query_count} queries"']
+        metrics.extend(f'{name};dur={elapsed * 1e3:.1f}' for name, elapsed in self.phases.items())
+        metrics.append(f'total;dur={self.total * 1e3:.1f}')
+        return ', '.join(metrics)
+
+    def to_dict(self, status=None):
+        """ログ用の辞書（時間はミリ秒）"""
+        slowest = ' '.join(self.slowest_sql.split())[:SQL_LOG_LENGTH] if self.slowest_sql else None
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'status': status,
+            'total_ms': round(self.total * 1e3, 2),
+            'phases_ms': {name: round(elapsed * 1e3, 2) for name, elapsed in self.phases.items()},
+            'queries': self.query_count,
+            'sql_ms': round(self.sql_time * 1e3, 2),
+            'slowest_sql': slowest,
+            'slowest_sql_ms': round(self.slowest_time * 1e3, 2),
+        }
+
+
+def start_request(endpoint=None, method=None):
+    """現在のスレッドで計測を開始し、RequestTiming を返す"""
+    timing = _local.timing = RequestTiming(endpoint, method)
+    return timing
+
+
+def end_request():
+    """現在のスレッドの計測を終了"""
+    _local.timing = None
+
+
+def current():
+    """処理中のリクエストの RequestTiming（リクエストの処理中でなければ None）"""
+    return getattr(_local, 'timing', None)
+
+
+@contextmanager
+def phase(name):
+    """処理中のリクエストの段階 name の時間を計測する（リクエストの処理中でなければ何もしない）"""
+    timing = current()
+    if timing is None:
+        yield
+        return
+    with timing.phase(name):
+        yield
+
+
+def trace_statement(statement):
+    """sqlite3 の set_trace_callback に登録する関数（SQLiteが実行した文を数える）"""
+    timing = current()
+    # トリガー内の文は "-- TRIGGER 名前" として通知されるため数えない
+    if timing is not None and not statement.startswith('--'):
+        timing.record_statement()
+
+
+def record_sql_time(sql, elapsed):
+    """SQLの実行・結果の取得にかかった時間を記録（sql は結果の取得の場合 None）"""
+    timing = current()
+    if timing is not None:
+        timing.record_sql_time(sql, elapsed)
+
+
+def finish_response(timing, response, errors=None):
+    """Server-Timing ヘッダーを付け、設定されていればログに1行出力する"""
+    if SERVER_TIMING_ENABLED:
+        response.add_header('Server-Timing', timing.server_timing())
+    if TIMING_LOG_PATH:
+        write_log(timing.to_dict(response.status), errors)
+
+
+def write_log(record, errors=None):
+    """計測結果をJSONの1行としてログに追記"""
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    try:
+        if TIMING_LOG_PATH == '-':
+            stream = errors or sys.stderr
+            stream.write(line)
+            stream.flush()
+            return
+        with _log_lock, open(TIMING_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(line)
+    except OSError:
+        # ログに書き込めなくてもレスポンスには影響させない
+        pass
@@ -7,15 +7,16 @@
 import json
 import sys
 import os
-import cgi
 import io
+import re
+import hashlib
 from datetime import datetime
 
 # Webサーバー自動判定機能をインポート
-from .webserver import setup_server_environment, detect_web_server
-
-# Webサーバー環境のセットアップを実行
-setup_server_environment()
+# （環境のセットアップは common.webserver の読み込み時に1回だけ実行される）
+from .webserver import detect_web_server
+from .wsgi import Response
+from . import timing
 
 # Windowsでのデフォルトエンコーディング問題を回避
 # CGI環境では標準入出力がバイナリモードで開始されるため、UTF-8ラッパーを設定
@@ -41,63 +42,125 @@ if sys.platform == 'win32' or server_type == 'iis':
             newline=None
         )
 
-def json_response(data, status=200, cookies=None):
-    """JSON レスポンスを出力"""
-    
-    # ステータスコード
-    status_messages = {
-        200: 'OK',
-        201: 'Created',
-        400: 'Bad Request',
-        401: 'Unauthorized',
-        403: 'Forbidden',
-        404: 'Not Found',
-        500: 'Internal Server Error'
-    }
-    
-    status_message = status_messages.get(status, 'Unknown')
-    
-    # ヘッダー出力
-    print(f'Status: {status} {status_message}')
-    print('Content-Type: application/json; charset=utf-8')
-    
-    # Cookie設定
-    if cookies:
-        for cookie in cookies:
-            print(f'Set-Cookie: {cookie}')
-    
-    print()  # ヘッダーと本文の区切り
+# JSONの字下げ（環境変数 MF_DEBUG を設定した場合のみ整形して出力する）
+JSON_INDENT = 2 if os.environ.get('MF_DEBUG') else None
+JSON_SEPARATORS = (',', ': ') if JSON_INDENT else (',', ':')
+
+# データベースに保存するUTCの日時（YYYY-MM-DD HH:MM:SS）
+UTC_DATETIME_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})$')
+
+# HTTPの日付形式の曜日・月（ロケールによらず英語の略称）
+HTTP_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+HTTP_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# 条件付きGETに対応するレスポンスのキャッシュ制御（共有キャッシュには保存させず、毎回再検証させる）
+CACHE_CONTROL = 'private, no-cache'
+
+def json_response(data, status=200, cookies=None, etag=None, last_modified=None):
+    """JSON レスポンスを作成（etag / last_modified を指定すると検証用ヘッダーを付ける）"""
+    with timing.phase('json'):
+        body = json.dumps(data, ensure_ascii=False, indent=JSON_INDENT, separators=JSON_SEPARATORS)
+    response = Response(body, status=status, cookies=cookies)
+    if etag:
+        add_cache_headers(response, etag, last_modified)
+    return response
+
+def make_etag(*parts):
+    """値の組み合わせから弱いETagを作成"""
+    digest = hashlib.sha1('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+def http_date(utc_string):
+    """UTCの日時文字列（YYYY-MM-DD HH:MM:SS）をHTTPの日付形式に変換"""
+    if not utc_string:
+        return None
+    # strptime・email.utils は初回の呼び出しで _strptime・calendar・locale・email を読み込み、
+    # CGIでは毎回の起動時間に加わるため、固定の形式を直接分解して組み立てる
+    match = UTC_DATETIME_PATTERN.match(utc_string)
+    if not match:
+        return None
+    try:
+        value = datetime(*(int(part) for part in match.groups()))
+    except ValueError:
+        return None
+    return (f'{HTTP_WEEKDAYS[value.weekday()]}, {value.day:02d} {HTTP_MONTHS[value.month - 1]} {value.year:04d} '
+            f'{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT')
+
+def add_cache_headers(response, etag, last_modified=None):
+    """ETag・Last-Modified・キャッシュ制御ヘッダーを追加"""
+    response.add_header('ETag', etag)
+    if last_modified:
+        response.add_header('Last-Modified', last_modified)
+    response.add_header('Cache-Control', CACHE_CONTROL)
+    # 閲覧者によって内容が変わるため
+    response.add_header('Vary', 'Cookie')
+    return response
+
+def check_not_modified(request, etag, last_modified=None):
+    """
+    If-None-Match / If-Modified-Since を確認し、変更がなければ304レスポンスを返す
+    変更がある（または条件付きリクエストでない）場合は None を返す
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
     
-    # JSON出力
-    print(json.dumps(data, ensure_ascii=False, indent=2))
+    if_none_match = request.header('If-None-Match')
+    if if_none_match is not None:
+        # If-None-Match がある場合は If-Modified-Since より優先する（弱い比較）
+        tags = {tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')}
+        if '*' not in tags and etag.replace('W/', '', 1) not in tags:
+            return None
+    else:
+        if_modified_since = request.header('If-Modified-Since')
+        if not if_modified_since or not last_modified:
+            return None
+        from email.utils import parsedate_to_datetime
+        try:
+            if parsedate_to_datetime(last_modified) > parsedate_to_datetime(if_modified_since):
+                return None
+        except (TypeError, ValueError):
+            return None
+    
+    response = Response(b'', status=304, content_type=None)
+    return add_cache_headers(response, etag, last_modified)
 
-def get_request_data():
+def get_request_data(request):
     """POSTリクエストのJSONデータを取得"""
-    try:
-        content_length = int(os.environ.get('CONTENT_LENGTH', 0))
-        if content_length > 0:
-            if hasattr(sys.stdin, 'buffer'):
-                request_bytes = sys.stdin.buffer.read(content_length)
-                request_body = request_bytes.decode('utf-8')
-            else:
-                request_body = sys.stdin.read(content_length)
-            return json.loads(request_body)
-        return {}
-    except (UnicodeDecodeError, ValueError, json.JSONDecodeError):
-        return {}
-
-def get_query_params():
-    """GETクエリパラメータを取得"""
-    query_string = os.environ.get('QUERY_STRING', '')
-    params = {}
+    return request.get_json()
+
+def get_expected_version(data):
+    """
+    更新の前提とする手順書の版数（リクエストデータの version）を取得（指定がなければ None）
+    形式が不正な場合は ValueError を送出する
     
-    if query_string:
-        for pair in query_string.split('&'):
-            if '=' in pair:
-                key, value = pair.split('=', 1)
-                params[key] = value
+    If-Match ヘッダーは使わない（手順書詳細APIの ETag は閲覧者・閲覧数などを含む弱いETagで、
+    版数とは対応しないため）
+    """
+    value = data.get('version') if isinstance(data, dict) else None
     
-    return params
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('版数が不正です')
+    version = int(value)
+    if version < 1:
+        raise ValueError('版数が不正です')
+    return version
+
+def conflict_response(manual):
+    """
+    手順書の版数の競合（409 Conflict）
+    manual は現在の内容（version を含む）。クライアントは再読み込みせずにこの内容とマージできる
+    """
+    return json_response({
+        'error': '他のユーザーが手順書を更新しています',
+        'current_version': manual['version'],
+        'manual': manual
+    }, status=409)
+
+def get_query_params(request):
+    """GETクエリパラメータを取得"""
+    return request.query
 
 def validate_required_fields(data, required_fields):
     """必須フィールドの検証"""
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+閲覧ログの一時保存（スプール）と一括反映
+閲覧のたびにメインのデータベースへ書き込むと書き込みロックを奪い合うため、
+閲覧イベントは別ファイルのスプール用データベースに追記し、
+まとめて view_logs / view_counts に反映する
+
+反映のタイミング:
+    - 常駐デーモン・FastCGI・WSGIサーバーではバックグラウンドスレッドが一定間隔で反映
+    - CGIのみで運用する場合は FLUSH_BATCH_SIZE 件ごとに、その閲覧リクエストで反映
+    - tools/flush_view_logs.py で手動（タスクスケジューラ・cron）で反映
+"""
+
+import os
+import sys
+import time
+import atexit
+import sqlite3
+import threading
+from .database import get_db_connection, in_db_connection, DB_PATH, BUSY_TIMEOUT_MS
+
+# スプール用データベースのパス（環境変数 MF_VIEW_SPOOL_PATH で上書き可能）
+SPOOL_PATH = os.environ.get('MF_VIEW_SPOOL_PATH') or os.path.join(os.path.dirname(DB_PATH), 'view_spool.db')
+
+# この件数ごとに閲覧リクエスト内で反映する（0で無効）
+FLUSH_BATCH_SIZE = int(os.environ.get('MF_VIEW_FLUSH_BATCH', '500'))
+
+# バックグラウンドで反映する間隔（秒）
+FLUSH_INTERVAL = float(os.environ.get('MF_VIEW_FLUSH_INTERVAL', '10'))
+
+# 1回のトランザクションで反映する最大件数
+FLUSH_CHUNK_SIZE = 5000
+
+SPOOL_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS view_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        manual_id INTEGER NOT NULL,
+        user_id INTEGER,
+        viewed_at TEXT DEFAULT (datetime('now', 'localtime'))
+    )
+'''
+
+# スレッドごとに保持するスプールへの接続
+_local = threading.local()
+
+# バックグラウンドの反映スレッド
+_flusher = None
+
+
+def _get_spool_connection():
+    """現在のスレッド（プロセス）で保持しているスプールへの接続を取得"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        # トランザクションは明示的に管理する
+        conn = sqlite3.connect(SPOOL_PATH, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        # スプールは停電時に直近の数件を失っても問題ないため同期しない
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        conn.execute(SPOOL_SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def record_view(manual_id, user_id=None):
+    """
+    閲覧イベントをスプールに追記
+    CGIでは反映することがあるため、get_db_connection() のコンテキストの外で呼び出す
+    """
+    conn = _get_spool_connection()
+    event_id = conn.execute(
+        'INSERT INTO view_events (manual_id, user_id) VALUES (?, ?)', (manual_id, user_id)
+    ).lastrowid
+
+    # 定期的に反映する仕組みがない環境（CGIのみ）でも溜まり続けないようにする
+    if FLUSH_BATCH_SIZE > 0 and _flusher is None and event_id % FLUSH_BATCH_SIZE == 0:
+        try:
+            flush_view_logs()
+        except sqlite3.Error:
+            # 反映に失敗してもイベントはスプールに残るため、閲覧自体は成功させる
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+
+
+def _flush_chunk(spool):
+    """スプールの先頭から最大 FLUSH_CHUNK_SIZE 件を反映し、(処理した件数, 反映した件数) を返す"""
+    # 反映中は他のプロセスが同じイベントを反映しないよう、スプールの書き込みロックを保持する
+    spool.execute('BEGIN IMMEDIATE')
+    try:
+        events = spool.execute(
+            'SELECT id, manual_id, user_id, viewed_at FROM view_events ORDER BY id LIMIT ?',
+            (FLUSH_CHUNK_SIZE,)
+        ).fetchall()
+        if not events:
+            spool.execute('ROLLBACK')
+            return 0, 0
+        last_id = events[-1][0]
+        processed = len(events)
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            # 存在しない手順書への閲覧は反映しない（外部キー制約）
+            manual_ids = sorted({event[1] for event in events})
+            placeholders = ', '.join('?' * len(manual_ids))
+            cursor.execute(f'SELECT id FROM manuals WHERE id IN ({placeholders})', manual_ids)
+            existing = {row['id'] for row in cursor.fetchall()}
+            events = [event for event in events if event[1] in existing]
+
+            cursor.executemany(
+                'INSERT INTO view_logs (manual_id, user_id, viewed_at) VALUES (?, ?, ?)',
+                [(manual_id, user_id, viewed_at) for _, manual_id, user_id, viewed_at in events]
+            )
+
+            # 手順書ごとの閲覧数を集計
+            counts = {}
+            for _, manual_id, _, viewed_at in events:
+                count, last_viewed_at = counts.get(manual_id, (0, viewed_at))
+                counts[manual_id] = (count + 1, max(last_viewed_at, viewed_at))
+
+            cursor.executemany(
+                'INSERT OR IGNORE INTO view_counts (manual_id, view_count) VALUES (?, 0)',
+                [(manual_id,) for manual_id in counts]
+            )
+            cursor.executemany('''
+                UPDATE view_counts
+                SET view_count = view_count + ?,
+                    last_viewed_at = MAX(COALESCE(last_viewed_at, ''), ?)
+                WHERE manual_id = ?
+            ''', [(count, last_viewed_at, manual_id) for manual_id, (count, last_viewed_at) in counts.items()])
+
+        # メインのデータベースへのコミット後にスプールから削除する
+        # （この間に異常終了した場合は次回に重複して反映されることがある）
+        spool.execute('DELETE FROM view_events WHERE id <= ?', (last_id,))
+        spool.execute('COMMIT')
+        return processed, len(events)
+    except Exception:
+        spool.execute('ROLLBACK')
+        raise
+
+
+def flush_view_logs():
+    """
+    スプールの閲覧イベントをすべて view_logs / view_counts に反映し、反映した件数を返す
+    get_db_connection() のコンテキストの内側では反映しない（イベントはスプールに残し、次回に反映する）
+    """
+    if in_db_connection():
+        # 外側のコンテキストがコミットするまで反映が確定しないため、先にスプールから削除すると
+        # ロールバックされた場合にイベントを失う。外側のトランザクションの書き込みロックも長引かせない
+        return 0
+    spool = _get_spool_connection()
+    total = 0
+    while True:
+        processed, applied = _flush_chunk(spool)
+        total += applied
+        if processed < FLUSH_CHUNK_SIZE:
+            return total
+
+
+def _flush_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush_view_logs()
+        except Exception:
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+
+
+def start_background_flusher(interval=FLUSH_INTERVAL):
+    """一定間隔で反映するバックグラウンドスレッドを開始（プロセスごとに1回）"""
+    global _flusher
+    if _flusher is not None or interval <= 0:
+        return
+    _flusher = threading.Thread(target=_flush_loop, args=(interval,), name='view-log-flusher', daemon=True)
+    _flusher.start()
+    # 終了時に残りを反映する
+    atexit.register(flush_view_logs)
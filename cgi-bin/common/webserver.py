@@ -77,10 +77,20 @@ def get_server_config():
     
     return configs.get(server_type, configs['unknown'])
 
+# セットアップ済みのWebサーバーの種類（セットアップ前は None）
+_configured_server_type = None
+
 def setup_server_environment():
     """
     Webサーバー環境に応じたセットアップ処理を実行
+    
+    このモジュールの読み込み時に実行される。api/__init__.py などから再度呼び出しても
+    セットアップは1回だけ行い、判定済みの種類を返す
     """
+    global _configured_server_type
+    if _configured_server_type is not None:
+        return _configured_server_type
+    
     server_type = detect_web_server()
     
     if server_type == 'apache':
@@ -100,6 +110,7 @@ def setup_server_environment():
     # 共通設定
     os.environ['PYTHONUNBUFFERED'] = '1'
     
+    _configured_server_type = server_type
     return server_type
 
 def print_server_info():
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+リクエスト/レスポンスとWSGIアダプター
+APIハンドラーは Request を受け取り Response を返す関数として実装し、
+CGI・常駐デーモン・WSGIサーバーのいずれからでも同じコードで実行する
+"""
+
+import os
+import sys
+import json
+import zlib
+from urllib.parse import parse_qsl
+
+from . import timing
+from . import metrics
+from . import profiling
+from .shim import MAX_BODY_SIZE
+
+# ステータスコードとメッセージ
+STATUS_MESSAGES = {
+    200: 'OK',
+    201: 'Created',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    403: 'Forbidden',
+    404: 'Not Found',
+    409: 'Conflict',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error'
+}
+
+# この大きさ（バイト）未満の本文は圧縮しない（環境変数 MF_COMPRESS_MIN_SIZE で変更可能、0で常に圧縮）
+COMPRESS_MIN_SIZE = int(os.environ.get('MF_COMPRESS_MIN_SIZE', '1024'))
+
+# zlib の圧縮レベル（1〜9）
+COMPRESS_LEVEL = 6
+
+# 圧縮する Content-Type
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+# 対応する圧縮方式（同じ優先度の場合は先頭を選ぶ）
+SUPPORTED_ENCODINGS = ('gzip', 'deflate')
+
+
+class Request:
+    """WSGI environ をラップしたリクエストオブジェクト"""
+
+    def __init__(self, environ):
+        self.environ = environ
+        self._query = None
+        self._cookies = None
+        self._body = None
+
+    @property
+    def method(self):
+        return self.environ.get('REQUEST_METHOD', 'GET').upper()
+
+    @property
+    def path(self):
+        return self.environ.get('SCRIPT_NAME', '') + self.environ.get('PATH_INFO', '')
+
+    @property
+    def stream(self):
+        """リクエスト本文の入力ストリーム"""
+        return self.environ['wsgi.input']
+
+    @property
+    def content_length(self):
+        try:
+            return int(self.environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return 0
+
+    @property
+    def query(self):
+        """GETクエリパラメータ（同名キーは最後の値を採用）"""
+        if self._query is None:
+            self._query = dict(parse_qsl(self.environ.get('QUERY_STRING', ''), keep_blank_values=True))
+        return self._query
+
+    @property
+    def cookies(self):
+        """Cookie（名前と値の辞書）"""
+        if self._cookies is None:
+            self._cookies = {}
+            cookie_string = self.environ.get('HTTP_COOKIE', '')
+            if cookie_string:
+                import http.cookies
+                cookie = http.cookies.SimpleCookie()
+                cookie.load(cookie_string)
+                self._cookies = {name: morsel.value for name, morsel in cookie.items()}
+        return self._cookies
+
+    def header(self, name, default=None):
+        """リクエストヘッダーを取得"""
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        return self.environ.get(key, default)
+
+    @property
+    def body(self):
+        """リクエスト本文（バイト列）"""
+        if self._body is None:
+            length = self.content_length
+            self._body = self.stream.read(length) if length > 0 else b''
+        return self._body
+
+    def get_json(self):
+        """リクエスト本文をJSONとして解析（失敗時は空の辞書）"""
+        try:
+            if not self.body:
+                return {}
+            return json.loads(self.body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            return {}
+
+
+class LimitedInput:
+    """
+    Content-Length までしか読まないリクエスト本文の入力ストリーム（常駐デーモン・FastCGIの wsgi.input）
+    read_chunk(size) は次の本文の断片を返す関数（size を超えてもよく、終端では b''）で、
+    本文全体をメモリに溜めずに、ハンドラーが読んだ分だけ受信する
+    """
+
+    def __init__(self, read_chunk, length):
+        self.read_chunk = read_chunk
+        self.remaining = length
+        self.buffer = b''
+
+    def _next_chunk(self, size):
+        if self.buffer:
+            data, self.buffer = self.buffer, b''
+        elif self.remaining > 0:
+            data = self.read_chunk(min(size, self.remaining))
+            if not data:
+                # 本文が Content-Length より短い（以降は読まない）
+                self.remaining = 0
+        else:
+            return b''
+        if len(data) > size:
+            data, self.buffer = data[:size], data[size:]
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        chunks = []
+        while size > 0:
+            data = self._next_chunk(size)
+            if not data:
+                break
+            chunks.append(data)
+            size -= len(data)
+            self.remaining -= len(data)
+        return b''.join(chunks)
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        chunks = []
+        while size > 0:
+            data = self._next_chunk(size)
+            if not data:
+                break
+            end = data.find(b'\n') + 1
+            if end:
+                data, self.buffer = data[:end], data[end:] + self.buffer
+            chunks.append(data)
+            size -= len(data)
+            self.remaining -= len(data)
+            if end:
+                break
+        return b''.join(chunks)
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def drain(self, chunk_size=64 * 1024):
+        """読み残した本文を受信して捨てる（応答の前に接続上の本文を読み終える場合）"""
+        while self.read(chunk_size):
+            pass
+
+
+class Response:
+    """ステータス・ヘッダー・本文を保持するレスポンスオブジェクト"""
+
+    def __init__(self, body=b'', status=200, content_type='application/json; charset=utf-8', cookies=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.body = body
+        self.status = status
+        self.headers = [('Content-Type', content_type)] if content_type else []
+        for cookie in cookies or []:
+            self.headers.append(('Set-Cookie', cookie))
+        # Accept-Encoding に応じて圧縮してよいか
+        self.compressible = bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+    @property
+    def status_line(self):
+        return f'{self.status} {STATUS_MESSAGES.get(self.status, "Unknown")}'
+
+    def add_header(self, name, value):
+        self.headers.append((name, value))
+
+    def get_header(self, name):
+        """ヘッダーの値を取得（なければ None）"""
+        for key, value in self.headers:
+            if key.lower() == name.lower():
+                return value
+        return None
+
+    def add_vary(self, field):
+        """Vary ヘッダーに項目を追加（既存の Vary ヘッダーがあればまとめる）"""
+        for i, (key, value) in enumerate(self.headers):
+            if key.lower() == 'vary':
+                if field.lower() not in [item.strip().lower() for item in value.split(',')]:
+                    self.headers[i] = (key, f'{value}, {field}')
+                return
+        self.headers.append(('Vary', field))
+
+
+def negotiate_encoding(accept_encoding):
+    """Accept-Encoding から使用する圧縮方式（gzip / deflate）を選ぶ（圧縮しない場合は None）"""
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding] = quality
+
+    best, best_quality = None, 0.0
+    for coding in SUPPORTED_ENCODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress_body(body, encoding, level=COMPRESS_LEVEL):
+    """本文を gzip / deflate（zlib形式）で圧縮"""
+    wbits = zlib.MAX_WBITS | 16 if encoding == 'gzip' else zlib.MAX_WBITS
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_response(response, environ):
+    """クライアントが対応していれば本文を圧縮し、Content-Encoding と Vary を設定する"""
+    if (not response.compressible or len(response.body) < COMPRESS_MIN_SIZE
+            or response.get_header('Content-Encoding')):
+        return response
+
+    # 圧縮するかどうかが Accept-Encoding によって変わるため、圧縮しない場合も付ける
+    response.add_vary('Accept-Encoding')
+    encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+    if encoding:
+        response.body = compress_body(response.body, encoding)
+        response.add_header('Content-Encoding', encoding)
+    return response
+
+
+def payload_too_large_response():
+    """本文が MAX_BODY_SIZE を超えるリクエストへの応答"""
+    from .utils import json_response
+
+    if MAX_BODY_SIZE >= 1024 * 1024:
+        limit = f'{MAX_BODY_SIZE // (1024 * 1024)}MB'
+    else:
+        limit = f'{MAX_BODY_SIZE // 1024}KB'
+    return json_response({'error': f'リクエストが大きすぎます。最大{limit}までです'}, status=413)
+
+
+def process_request(handler, environ, endpoint=None):
+    """
+    ハンドラーを実行し、圧縮と計測結果（Server-Timing ヘッダー・ログ）を付けたレスポンスを返す
+    リクエスト数・応答時間は監視用のメトリクス（common.metrics）にも集計する
+    プロファイルの取得が指定されていれば cProfile で計測して保存する（common.profiling）
+    本文が MAX_BODY_SIZE を超えるリクエストは、ハンドラーを呼ばず、本文も読み込まずに 413 を返す
+    endpoint を省略した場合はスクリプト名（manuals_get など）を使う。ハンドラーの例外はそのまま送出する
+    """
+    if endpoint is None:
+        endpoint = os.path.splitext(os.path.basename(environ.get('SCRIPT_NAME', '')))[0] or None
+    request_timing = timing.start_request(endpoint, environ.get('REQUEST_METHOD'))
+    profiler = profiling.start_request(endpoint, environ)
+    response = None
+    try:
+        request = Request(environ)
+        with request_timing.phase('app'):
+            if request.content_length > MAX_BODY_SIZE:
+                response = payload_too_large_response()
+            else:
+                response = handler(request)
+        with request_timing.phase('compress'):
+            compress_response(response, environ)
+        if profiler is not None:
+            profile_file = profiling.finish_request(profiler, endpoint)
+            profiler = None
+            if profile_file:
+                response.add_header(profiling.PROFILE_RESPONSE_HEADER, profile_file)
+        timing.finish_response(request_timing, response, environ.get('wsgi.errors'))
+        return response
+    finally:
+        if profiler is not None:
+            # ハンドラーが例外を送出した場合も、そこまでのプロファイルは保存する
+            profiling.finish_request(profiler, endpoint)
+        timing.end_request()
+        # ハンドラーが例外を送出した場合は500として集計する
+        metrics.record_request(endpoint, request_timing.method,
+                               response.status if response is not None else 500, request_timing.total)
+        metrics.request_finished(environ.get('wsgi.run_once', False))
+
+
+def to_wsgi(handler):
+    """ハンドラー関数（Request -> Response）をWSGIアプリケーションに変換"""
+    def app(environ, start_response):
+        response = process_request(handler, environ)
+        start_response(response.status_line, response.headers)
+        return [response.body]
+    return app
+
+
+def cgi_environ(stdin=None):
+    """CGIの環境変数と標準入力からWSGI environ を作成"""
+    environ = dict(os.environ)
+    environ.update({
+        'wsgi.input': stdin or getattr(sys.stdin, 'buffer', sys.stdin),
+        'wsgi.errors': sys.stderr,
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': True,
+        'wsgi.url_scheme': 'https' if environ.get('HTTPS', 'off').lower() in ('on', '1') else 'http',
+    })
+    return environ
+
+
+def render_cgi(app, environ):
+    """WSGIアプリケーションを実行し、CGI形式の出力（バイト列）を返す"""
+    status_headers = []
+
+    def start_response(status, headers, exc_info=None):
+        status_headers[:] = [status, headers]
+
+    result = app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    status, headers = status_headers
+    head = f'Status: {status}\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers)
+    return head.encode('latin-1', 'replace') + b'\r\n' + body
+
+
+def run_cgi(handler):
+    """ハンドラー関数をCGIとして実行（CGIエントリーポイント用アダプター）"""
+    output = render_cgi(to_wsgi(handler), cgi_environ())
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    stdout.write(output)
+    stdout.flush()
+
+
+class ThreadPoolMixIn:
+    """
+    固定数のスレッドでリクエストを処理する socketserver 用ミックスイン
+    スレッドを使い回すため、スレッドごとのDB接続も再利用される
+    """
+
+    pool_size = 8
+
+    def process_request(self, request, client_address):
+        if getattr(self, '_pool', None) is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(max_workers=self.pool_size)
+        self._pool.submit(self._process_request_in_thread, request, client_address)
+
+    def _process_request_in_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if getattr(self, '_pool', None) is not None:
+            self._pool.shutdown(wait=False)
+
+
+def serve_preforked(server, workers=1):
+    """
+    待ち受け済みのサーバーを複数プロセスで処理する（os.fork が使える環境のみ）
+    workers が1以下、またはWindowsの場合は現在のプロセスで処理する
+    """
+    import signal
+
+    # SIGTERMでも終了処理（atexit・子プロセスの停止）を行う
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    children = []
+    if workers > 1 and hasattr(os, 'fork'):
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    server.serve_forever()
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    os._exit(0)
+            children.append(pid)
+
+    try:
+        if children:
+            for pid in children:
+                os.waitpid(pid, 0)
+        else:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        server.server_close()
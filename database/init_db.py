@@ -12,11 +12,27 @@ import sys
 # データベースパス
 DB_PATH = os.path.join(os.path.dirname(__file__), 'manual_factory.db')
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema.sql')
+SEARCH_SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'search_schema.sql')
 
 def hash_password(password):
     """パスワードをSHA-256でハッシュ化"""
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
+def create_search_index(conn):
+    """全文検索インデックスを作成（FTS5 trigram が使えない環境では作成せず、検索は LIKE で行う）"""
+    if sqlite3.sqlite_version_info < (3, 34, 0):
+        print(f'SQLite {sqlite3.sqlite_version} は trigram 全文検索に対応していないため、全文検索インデックスを作成しません。')
+        return False
+    with open(SEARCH_SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        search_sql = f.read()
+    try:
+        conn.executescript(search_sql)
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        print(f'全文検索インデックスを作成できませんでした（{e}）。検索は LIKE で行います。')
+        return False
+    return True
+
 def init_database():
     """データベースを初期化"""
     # 既存のデータベースがあれば削除
@@ -38,6 +54,9 @@ def init_database():
         schema_sql = f.read()
         cursor.executescript(schema_sql)
     
+    # 全文検索インデックスを作成
+    create_search_index(conn)
+    
     # 初期管理者ユーザーを作成
     admin_email = 'admin@example.com'
     admin_password = 'admin123'  # 本番環境では必ず変更してください
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+データベース移行スクリプト
+既存のデータベースを削除せずに、schema.sql に追加された列・テーブル・インデックスを適用する
+（schema.sql は IF NOT EXISTS で記述しているため、何度実行しても問題ない）
+"""
+
+import sqlite3
+import os
+import sys
+
+# データベースパス
+DB_PATH = os.environ.get('MF_DB_PATH') or os.path.join(os.path.dirname(__file__), 'manual_factory.db')
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema.sql')
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cgi-bin'))
+from init_db import create_search_index
+from common.imageinfo import identify_image_file
+from common.imagestore import image_file_path
+
+# 既存のテーブルに後から追加した列（テーブル名, 列名, 型と既定値）
+ADDED_COLUMNS = [
+    ('users', 'session_generation', 'INTEGER DEFAULT 0'),
+    ('images', 'width', 'INTEGER'),
+    ('images', 'height', 'INTEGER'),
+    ('images', 'format', 'TEXT'),
+    ('manuals', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+]
+
+
+def add_missing_columns(conn):
+    """既存のテーブルに不足している列を追加"""
+    for table, column, definition in ADDED_COLUMNS:
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        if columns and column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            print(f'列を追加しました: {table}.{column}')
+
+
+def backfill_image_info(conn):
+    """幅・高さが未登録の画像をファイルのヘッダーから補完"""
+    rows = conn.execute('SELECT sha256, path FROM images WHERE width IS NULL').fetchall()
+    updated = 0
+    for sha256, path in rows:
+        try:
+            info = identify_image_file(image_file_path(path))
+        except OSError:
+            continue
+        if info:
+            conn.execute('UPDATE images SET width = ?, height = ?, format = ?, mime_type = ? WHERE sha256 = ?',
+                         (info.width, info.height, info.format, info.mime_type, sha256))
+            updated += 1
+    if updated:
+        print(f'{updated} 件の画像の幅・高さを登録しました')
+
+
+def migrate_database(db_path=DB_PATH):
+    """既存のデータベースにスキーマの差分を適用"""
+    if not os.path.exists(db_path):
+        print(f'データベース {db_path} が見つかりません。先に init_db.py を実行してください。')
+        return False
+
+    conn = sqlite3.connect(db_path)
+    try:
+        # schema.sql のトリガー・インデックスが新しい列を参照するため、先に列を追加する
+        add_missing_columns(conn)
+        with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+            conn.executescript(f.read())
+        # 全文検索インデックスを作成し、既存の手順書から再構築
+        create_search_index(conn)
+        backfill_image_info(conn)
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+
+    print('データベースの移行が完了しました。')
+    print(f'データベースパス: {db_path}')
+    return True
+
+
+if __name__ == '__main__':
+    if os.environ.get('REQUEST_METHOD'):
+        # CGIとして呼び出された場合は何もしない
+        print('Status: 404 Not Found')
+        print()
+        sys.exit(0)
+    sys.exit(0 if migrate_database() else 1)
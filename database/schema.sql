@@ -7,6 +7,7 @@ CREATE TABLE IF NOT EXISTS users (
     role TEXT NOT NULL DEFAULT 'user', -- 'admin' or 'user'
     department TEXT,
     is_deleted INTEGER DEFAULT 0,
+    session_generation INTEGER DEFAULT 0, -- 署名付きセッションの世代（変更で発行済みトークンを無効化）
     created_at TEXT DEFAULT (datetime('now', 'localtime')),
     updated_at TEXT DEFAULT (datetime('now', 'localtime'))
 );
@@ -31,6 +32,7 @@ CREATE TABLE IF NOT EXISTS manuals (
     created_at TEXT DEFAULT (datetime('now', 'localtime')),
     updated_at TEXT DEFAULT (datetime('now', 'localtime')),
     is_deleted INTEGER DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 1, -- 更新のたびに1ずつ増える版数（楽観的排他制御）
     FOREIGN KEY (author_id) REFERENCES users(id)
 );
 
@@ -86,6 +88,35 @@ CREATE TABLE IF NOT EXISTS view_logs (
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+-- 閲覧数集計テーブル（閲覧ログの反映時に更新）
+CREATE TABLE IF NOT EXISTS view_counts (
+    manual_id INTEGER PRIMARY KEY,
+    view_count INTEGER NOT NULL DEFAULT 0,
+    last_viewed_at TEXT,
+    FOREIGN KEY (manual_id) REFERENCES manuals(id) ON DELETE CASCADE
+);
+
+-- 変更カウンター（条件付きGETのETag用、一覧・詳細の内容に関わるテーブルの変更でトリガーにより加算）
+CREATE TABLE IF NOT EXISTS change_counter (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    value INTEGER NOT NULL DEFAULT 0,
+    changed_at TEXT DEFAULT (datetime('now')) -- UTC
+);
+INSERT OR IGNORE INTO change_counter (id, value) VALUES (1, 0);
+
+-- 画像テーブル（内容のSHA-256で重複を排除して保存、ref_count はステップからの参照数）
+CREATE TABLE IF NOT EXISTS images (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL, -- uploads/images からの相対パス（ab/cd/<sha256>.<拡張子>）
+    size INTEGER NOT NULL,
+    mime_type TEXT NOT NULL,
+    width INTEGER, -- 表示時の幅・高さ（ピクセル）
+    height INTEGER,
+    format TEXT, -- png, jpeg, gif, webp, bmp
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT DEFAULT (datetime('now', 'localtime'))
+);
+
 -- インデックス作成
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
@@ -97,3 +128,100 @@ CREATE INDEX IF NOT EXISTS idx_manual_tags_manual ON manual_tags(manual_id);
 CREATE INDEX IF NOT EXISTS idx_manual_tags_tag ON manual_tags(tag_id);
 CREATE INDEX IF NOT EXISTS idx_manual_histories_manual ON manual_histories(manual_id);
 CREATE INDEX IF NOT EXISTS idx_view_logs_manual ON view_logs(manual_id);
+
+-- 削除・権限変更・パスワード変更で署名付きセッションを無効化
+CREATE TRIGGER IF NOT EXISTS users_session_generation
+AFTER UPDATE OF role, password_hash, is_deleted ON users
+WHEN OLD.role IS NOT NEW.role
+  OR OLD.password_hash IS NOT NEW.password_hash
+  OR OLD.is_deleted IS NOT NEW.is_deleted
+BEGIN
+    UPDATE users SET session_generation = session_generation + 1 WHERE id = NEW.id;
+END;
+
+-- 変更カウンターの更新
+CREATE TRIGGER IF NOT EXISTS change_counter_manuals_insert AFTER INSERT ON manuals
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_manuals_update AFTER UPDATE ON manuals
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_manuals_delete AFTER DELETE ON manuals
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_manual_steps_insert AFTER INSERT ON manual_steps
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_manual_steps_update AFTER UPDATE ON manual_steps
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_manual_steps_delete AFTER DELETE ON manual_steps
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_manual_tags_insert AFTER INSERT ON manual_tags
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_manual_tags_delete AFTER DELETE ON manual_tags
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_tags_update AFTER UPDATE OF name ON tags
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_users_update AFTER UPDATE OF name, email, is_deleted ON users
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS change_counter_manual_histories_insert AFTER INSERT ON manual_histories
+BEGIN
+    UPDATE change_counter SET value = value + 1, changed_at = datetime('now') WHERE id = 1;
+END;
+
+-- 画像の参照数の更新
+-- ステップの image_path（.../uploads/images/ab/cd/<sha256>.<拡張子>）から SHA-256 を取り出して images と対応付ける
+CREATE TRIGGER IF NOT EXISTS images_ref_manual_steps_insert AFTER INSERT ON manual_steps
+WHEN instr(NEW.image_path, '/uploads/images/') > 0
+BEGIN
+    UPDATE images SET ref_count = ref_count + 1
+    WHERE sha256 = substr(NEW.image_path, instr(NEW.image_path, '/uploads/images/') + 22, 64);
+END;
+
+CREATE TRIGGER IF NOT EXISTS images_ref_manual_steps_update AFTER UPDATE OF image_path ON manual_steps
+WHEN OLD.image_path IS NOT NEW.image_path
+BEGIN
+    UPDATE images SET ref_count = MAX(ref_count - 1, 0)
+    WHERE sha256 = substr(OLD.image_path, instr(OLD.image_path, '/uploads/images/') + 22, 64);
+    UPDATE images SET ref_count = ref_count + 1
+    WHERE sha256 = substr(NEW.image_path, instr(NEW.image_path, '/uploads/images/') + 22, 64);
+END;
+
+CREATE TRIGGER IF NOT EXISTS images_ref_manual_steps_delete AFTER DELETE ON manual_steps
+WHEN instr(OLD.image_path, '/uploads/images/') > 0
+BEGIN
+    UPDATE images SET ref_count = MAX(ref_count - 1, 0)
+    WHERE sha256 = substr(OLD.image_path, instr(OLD.image_path, '/uploads/images/') + 22, 64);
+END;
+
+-- 一覧のソート順（キーセットページネーション）用の複合インデックス
+CREATE INDEX IF NOT EXISTS idx_manuals_list_updated ON manuals(is_deleted, updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_manuals_list_created ON manuals(is_deleted, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_manuals_list_title ON manuals(is_deleted, title, id);
+CREATE INDEX IF NOT EXISTS idx_users_list_created ON users(is_deleted, created_at, id);
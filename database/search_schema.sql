@@ -0,0 +1,107 @@
+-- 全文検索インデックス（FTS5 trigram トークナイザー、SQLite 3.34.0 以降）
+-- FTS5 が使えない環境では init_db.py / migrate.py が適用をスキップし、検索は LIKE で行う
+
+-- 検索対象のテキスト（手順書ごとにタイトル・説明・全ステップ・タグをまとめる）
+CREATE VIEW IF NOT EXISTS manuals_search_source AS
+SELECT
+    m.id,
+    m.title,
+    COALESCE(m.description, '') AS description,
+    COALESCE((
+        SELECT group_concat(step_text, char(10))
+        FROM (
+            SELECT s.title || ' ' || COALESCE(s.content, '') || ' ' || COALESCE(s.note, '') AS step_text
+            FROM manual_steps s
+            WHERE s.manual_id = m.id
+            ORDER BY s.step_number
+        )
+    ), '') AS steps,
+    COALESCE((
+        SELECT group_concat(t.name, ' ')
+        FROM manual_tags mt
+        JOIN tags t ON mt.tag_id = t.id
+        WHERE mt.manual_id = m.id
+    ), '') AS tags
+FROM manuals m
+WHERE m.is_deleted = 0;
+
+-- rowid は手順書ID
+CREATE VIRTUAL TABLE IF NOT EXISTS manuals_fts USING fts5(
+    title,
+    description,
+    steps,
+    tags,
+    tokenize = 'trigram'
+);
+
+-- 再構築が必要な手順書（ステップ・タグを1行ずつ変更するたびに再構築すると、全ステップの連結を行数分繰り返すため、
+-- トリガーでは手順書IDを記録するだけにし、コミット前に1手順書1回だけ再構築する: common/search.py refresh_search_index）
+CREATE TABLE IF NOT EXISTS manuals_fts_pending (
+    manual_id INTEGER PRIMARY KEY
+);
+
+-- 行ごとに再構築していた以前のトリガーを置き換える
+DROP TRIGGER IF EXISTS manuals_fts_insert;
+DROP TRIGGER IF EXISTS manuals_fts_update;
+DROP TRIGGER IF EXISTS manuals_fts_delete;
+DROP TRIGGER IF EXISTS manual_steps_fts_insert;
+DROP TRIGGER IF EXISTS manual_steps_fts_update;
+DROP TRIGGER IF EXISTS manual_steps_fts_delete;
+DROP TRIGGER IF EXISTS manual_tags_fts_insert;
+DROP TRIGGER IF EXISTS manual_tags_fts_delete;
+DROP TRIGGER IF EXISTS tags_fts_update;
+
+-- 手順書の変更
+CREATE TRIGGER manuals_fts_insert AFTER INSERT ON manuals
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER manuals_fts_update AFTER UPDATE OF title, description, is_deleted ON manuals
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER manuals_fts_delete AFTER DELETE ON manuals
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id) VALUES (OLD.id);
+END;
+
+-- ステップの変更
+CREATE TRIGGER manual_steps_fts_insert AFTER INSERT ON manual_steps
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id) VALUES (NEW.manual_id);
+END;
+
+CREATE TRIGGER manual_steps_fts_update AFTER UPDATE OF title, content, note ON manual_steps
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id) VALUES (NEW.manual_id);
+END;
+
+CREATE TRIGGER manual_steps_fts_delete AFTER DELETE ON manual_steps
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id) VALUES (OLD.manual_id);
+END;
+
+-- タグの変更
+CREATE TRIGGER manual_tags_fts_insert AFTER INSERT ON manual_tags
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id) VALUES (NEW.manual_id);
+END;
+
+CREATE TRIGGER manual_tags_fts_delete AFTER DELETE ON manual_tags
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id) VALUES (OLD.manual_id);
+END;
+
+CREATE TRIGGER tags_fts_update AFTER UPDATE OF name ON tags
+BEGIN
+    INSERT OR IGNORE INTO manuals_fts_pending (manual_id)
+    SELECT manual_id FROM manual_tags WHERE tag_id = NEW.id;
+END;
+
+-- 既存データからインデックスを再構築
+DELETE FROM manuals_fts;
+DELETE FROM manuals_fts_pending;
+INSERT INTO manuals_fts (rowid, title, description, steps, tags)
+SELECT id, title, description, steps, tags FROM manuals_search_source;
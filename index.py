@@ -125,7 +125,11 @@ HTML = """<!DOCTYPE html>
 
             manuals.forEach(manual => {
                 html += '<tr>';
-                html += `<td><a href="./manuals/view.py?id=${manual.id}">${escapeHtml(manual.title)}</a></td>`;
+                html += `<td><a href="./manuals/view.py?id=${manual.id}">${escapeHtml(manual.title)}</a>`;
+                if (manual.snippet) {
+                    html += `<div class="search-snippet">${highlightSnippet(manual.snippet)}</div>`;
+                }
+                html += '</td>';
                 html += `<td>${escapeHtml(manual.author_name)}</td>`;
                 html += `<td>${manual.step_count}</td>`;
                 html += `<td>${manual.is_published ? '<span class="badge badge-success">公開</span>' : '<span class="badge badge-warning">下書き</span>'}</td>`;
@@ -143,6 +143,10 @@ HTML = """<!DOCTYPE html>
                         ここに画像を貼り付け（Ctrl+V / Cmd+V）
                     </div>
                     <div class="step-image-preview" style="margin-top: 0.5rem;"></div>
+                    <label style="display: block; margin-top: 0.5rem; font-weight: normal;">
+                        <input type="checkbox" class="step-image-keep-original"> 元の画像のままアップロード（縮小・圧縮しない）
+                    </label>
+                    <div class="step-image-upload-status" style="margin-top: 0.25rem; color: #666; font-size: 0.9rem;"></div>
                 </div>
             `;
 
@@ -166,6 +170,16 @@ HTML = """<!DOCTYPE html>
                 if (file) {
                     stepDiv.pastedImageFile = null;
                     updateImagePreview(file);
+                    startStepImageUpload(stepDiv, file);
+                } else if (!stepDiv.pastedImageFile) {
+                    cancelStepImageUpload(stepDiv);
+                }
+            });
+
+            // 縮小の有無を変更したらアップロードし直す
+            stepDiv.querySelector('.step-image-keep-original').addEventListener('change', function() {
+                if (stepDiv.imageUpload) {
+                    startStepImageUpload(stepDiv, stepDiv.imageUpload.file);
                 }
             });
 
@@ -186,6 +200,7 @@ HTML = """<!DOCTYPE html>
                         stepDiv.pastedImageFile = pastedFile;
                         imageInput.value = '';
                         updateImagePreview(pastedFile);
+                        startStepImageUpload(stepDiv, pastedFile);
                         e.preventDefault();
                         showAlert('画像を貼り付けました', 'success');
                         return;
@@ -258,23 +273,16 @@ HTML = """<!DOCTYPE html>
 
                 // ステップを取得
                 const steps = [];
-                const stepDivs = document.querySelectorAll('[id^="step-"]');
+                const stepDivs = Array.from(document.querySelectorAll('[id^="step-"]'));
+
+                // 画像は選択・貼り付けの時点でアップロードを開始しているため、未完了のものだけをまとめて待つ
+                const uploadedPaths = await Promise.all(stepDivs.map(waitForStepImageUpload));
 
-                for (const stepDiv of stepDivs) {
+                for (const [index, stepDiv] of stepDivs.entries()) {
                     const stepTitle = stepDiv.querySelector('.step-title').value;
                     const stepContent = stepDiv.querySelector('.step-content').value;
                     const stepNote = stepDiv.querySelector('.step-note').value;
-                    const stepImageInput = stepDiv.querySelector('.step-image');
-
-                    let imagePath = '';
-
-                    const uploadFile = stepImageInput.files[0] || stepDiv.pastedImageFile;
-
-                    // 画像がある場合はアップロード
-                    if (uploadFile) {
-                        const imageData = await ManualAPI.uploadImage(uploadFile);
-                        imagePath = imageData.path;
-                    }
+                    const imagePath = uploadedPaths[index] || '';
 
                     steps.push({
                         title: stepTitle || `ステップ ${steps.length + 1}`,
@@ -90,6 +90,8 @@ HTML = """<!DOCTYPE html>
         let currentUser = null;
         let manualId = null;
         let stepCounter = 0;
+        // 読み込んだ時点の手順書（保存時に比較し、変更された部分だけを送る）
+        let originalManual = null;
 
         // 初期化
         async function init() {
@@ -132,6 +134,8 @@ HTML = """<!DOCTYPE html>
                     return;
                 }
 
+                originalManual = manualSnapshot(manual);
+
                 // フォームに値を設定
                 document.getElementById('title').value = manual.title;
                 document.getElementById('description').value = manual.description || '';
@@ -198,7 +202,12 @@ HTML = """<!DOCTYPE html>
                         ここに画像を貼り付け（Ctrl+V / Cmd+V）
                     </div>
                     <input type="hidden" class="step-existing-image" value="${stepData && stepData.image_path ? stepData.image_path : ''}">
+                    <input type="hidden" class="step-id" value="${stepData && stepData.id ? stepData.id : ''}">
                     <div class="step-image-preview" style="margin-top: 0.5rem;"></div>
+                    <label style="display: block; margin-top: 0.5rem; font-weight: normal;">
+                        <input type="checkbox" class="step-image-keep-original"> 元の画像のままアップロード（縮小・圧縮しない）
+                    </label>
+                    <div class="step-image-upload-status" style="margin-top: 0.25rem; color: #666; font-size: 0.9rem;"></div>
                 </div>
             `;
 
@@ -209,7 +218,7 @@ HTML = """<!DOCTYPE html>
                 const imagePath = resolveAppAssetPath(stepData.image_path);
                 existingImageContainer.innerHTML = `
                     <div style="position: relative; display: inline-block; margin-bottom: 0.5rem;">
-                        <img src="${imagePath}" style="max-width: 300px; border-radius: 4px;">
+                        <img src="${imagePath}"${imageSizeAttributes(stepData)} loading="lazy" decoding="async" style="max-width: 300px; height: auto; border-radius: 4px;">
                         <button type="button" class="btn btn-danger remove-existing-image-btn" style="position: absolute; top: 0.25rem; right: 0.25rem; width: 1.8rem; height: 1.8rem; padding: 0; line-height: 1; border-radius: 999px;">×</button>
                     </div>
                 `;
@@ -242,6 +251,7 @@ HTML = """<!DOCTYPE html>
                         imagePreview.innerHTML = '';
                         imageInput.value = '';
                         stepDiv.pastedImageFile = null;
+                        cancelStepImageUpload(stepDiv);
                         showAlert('選択中の画像を削除しました', 'success');
                     });
                 };
@@ -253,6 +263,16 @@ HTML = """<!DOCTYPE html>
                 if (file) {
                     stepDiv.pastedImageFile = null;
                     updateImagePreview(file);
+                    startStepImageUpload(stepDiv, file);
+                } else if (!stepDiv.pastedImageFile) {
+                    cancelStepImageUpload(stepDiv);
+                }
+            });
+
+            // 縮小の有無を変更したらアップロードし直す
+            stepDiv.querySelector('.step-image-keep-original').addEventListener('change', function() {
+                if (stepDiv.imageUpload) {
+                    startStepImageUpload(stepDiv, stepDiv.imageUpload.file);
                 }
             });
 
@@ -273,6 +293,7 @@ HTML = """<!DOCTYPE html>
                         stepDiv.pastedImageFile = pastedFile;
                         imageInput.value = '';
                         updateImagePreview(pastedFile);
+                        startStepImageUpload(stepDiv, pastedFile);
                         e.preventDefault();
                         showAlert('画像を貼り付けました', 'success');
                         return;
@@ -379,26 +400,24 @@ HTML = """<!DOCTYPE html>
 
                 // ステップを取得
                 const steps = [];
-                const stepDivs = document.querySelectorAll('[id^="step-"]');
+                const stepDivs = Array.from(document.querySelectorAll('[id^="step-"]'));
+
+                // 画像は選択・貼り付けの時点でアップロードを開始しているため、未完了のものだけをまとめて待つ
+                const uploadedPaths = await Promise.all(stepDivs.map(waitForStepImageUpload));
 
-                for (const stepDiv of stepDivs) {
+                for (const [index, stepDiv] of stepDivs.entries()) {
                     const stepTitle = stepDiv.querySelector('.step-title').value;
                     const stepContent = stepDiv.querySelector('.step-content').value;
                     const stepNote = stepDiv.querySelector('.step-note').value;
-                    const stepImageInput = stepDiv.querySelector('.step-image');
                     const existingImage = stepDiv.querySelector('.step-existing-image').value;
+                    const stepId = stepDiv.querySelector('.step-id').value;
 
-                    let imagePath = existingImage;
-
-                    const uploadFile = stepImageInput.files[0] || stepDiv.pastedImageFile;
-
-                    // 新しい画像がある場合はアップロード
-                    if (uploadFile) {
-                        const imageData = await ManualAPI.uploadImage(uploadFile);
-                        imagePath = imageData.path;
-                    }
+                    // 新しい画像をアップロードした場合はそのパス、なければ既存の画像
+                    const imagePath = uploadedPaths[index] || existingImage;
 
+                    // 保存済みのステップはIDで読み込み時の内容と対応付ける
                     steps.push({
+                        id: stepId ? Number(stepId) : null,
                         title: stepTitle || `ステップ ${steps.length + 1}`,
                         content: stepContent,
                         note: stepNote,
@@ -416,8 +435,8 @@ HTML = """<!DOCTYPE html>
                     steps: steps
                 };
 
-                // API呼び出し
-                await ManualAPI.update(manualId, manualData);
+                // 読み込み時からの変更だけを操作の一覧にして送る
+                await saveManualChanges(manualData);
 
                 showAlert('手順書を更新しました', 'success');
 
@@ -434,6 +453,39 @@ HTML = """<!DOCTYPE html>
             }
         });
 
+        // 読み込み時からの変更を保存する
+        // 他のユーザーが先に保存していた場合（409）は、応答に含まれる最新の内容に自分の変更を重ねて保存し直す
+        async function saveManualChanges(manualData) {
+            let base = originalManual;
+            let target = manualData;
+            for (let attempt = 0; attempt < 3; attempt++) {
+                const operations = buildManualPatch(base, target);
+                if (operations.length === 0) {
+                    return;
+                }
+                try {
+                    await ManualAPI.patch(manualId, operations, base.version);
+                    return;
+                } catch (error) {
+                    if (error.status !== 409) {
+                        throw error;
+                    }
+                    const latest = error.data.manual;
+                    const { merged, conflicts } = mergeManualEdits(base, target, latest);
+                    if (conflicts.length > 0 && !confirm(
+                        '他のユーザーが同じ箇所を変更しています。\\n' + conflicts.join('\\n') +
+                        '\\n\\nこの画面の内容で上書きしますか？（キャンセルすると保存しません）')) {
+                        throw new Error('保存を中止しました。ページを再読み込みして最新の内容を確認してください');
+                    }
+                    // 以降は最新の内容を基準にし、マージした結果との差分を送る
+                    originalManual = latest;
+                    base = latest;
+                    target = merged;
+                }
+            }
+            throw new Error('他のユーザーによる更新が続いているため保存できませんでした。時間をおいて再度お試しください');
+        }
+
         // ユーティリティ
         function escapeHtml(text) {
             const div = document.createElement('div');
@@ -171,7 +171,7 @@ HTML = """<!DOCTYPE html>
 
                     if (step.image_path) {
                         const imagePath = resolveAppAssetPath(step.image_path);
-                        html += `<img src="${imagePath}" alt="${escapeHtml(step.title)}">`;
+                        html += `<img src="${imagePath}" alt="${escapeHtml(step.title)}"${imageSizeAttributes(step)} loading="lazy" decoding="async">`;
                     }
 
                     if (step.note) {
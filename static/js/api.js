@@ -36,6 +36,128 @@ const APP_ROOT = detectAppRoot(path);
 const API_BASE = `${APP_ROOT}/cgi-bin/api`;
 
 // APIリクエストを送信
+// GETの応答をETagとともに保持し、304 Not Modified の場合に再利用する
+const RESPONSE_CACHE_LIMIT = 100;
+const responseCache = new Map();
+
+function rememberResponse(url, etag, data) {
+    responseCache.delete(url);
+    responseCache.set(url, { etag, data });
+    // 古いものから削除する（Map は挿入順）
+    while (responseCache.size > RESPONSE_CACHE_LIMIT) {
+        responseCache.delete(responseCache.keys().next().value);
+    }
+}
+
+function clearResponseCache() {
+    responseCache.clear();
+}
+
+// アップロード前の画像の縮小・再エンコード設定
+// maxDimension: 長辺の最大ピクセル数 / types: 出力形式（ブラウザが対応している先頭の形式を使う） / quality: 非可逆圧縮の品質
+const IMAGE_UPLOAD_OPTIONS = {
+    maxDimension: 1600,
+    types: ['image/webp', 'image/jpeg'],
+    quality: 0.85
+};
+
+const IMAGE_EXTENSIONS = {
+    'image/webp': '.webp',
+    'image/jpeg': '.jpg',
+    'image/png': '.png'
+};
+
+function loadImageSource(file) {
+    if (window.createImageBitmap) {
+        return createImageBitmap(file);
+    }
+    return new Promise((resolve, reject) => {
+        const url = URL.createObjectURL(file);
+        const img = new Image();
+        img.onload = () => {
+            URL.revokeObjectURL(url);
+            resolve(img);
+        };
+        img.onerror = () => {
+            URL.revokeObjectURL(url);
+            reject(new Error('画像を読み込めませんでした'));
+        };
+        img.src = url;
+    });
+}
+
+function canvasToBlob(canvas, type, quality) {
+    return new Promise((resolve) => canvas.toBlob(resolve, type, quality));
+}
+
+// 画像を長辺 maxDimension 以下に縮小し、WebP（非対応のブラウザではJPEG）に再エンコードする
+// アニメーションGIFや縮小・変換できない画像、変換後のほうが大きくなる画像は元のファイルを返す
+async function prepareImageForUpload(file, options = {}) {
+    const { maxDimension, types, quality } = { ...IMAGE_UPLOAD_OPTIONS, ...options };
+    if (!file.type.startsWith('image/') || file.type === 'image/gif' || !window.HTMLCanvasElement) {
+        return file;
+    }
+
+    let source;
+    try {
+        source = await loadImageSource(file);
+    } catch (error) {
+        return file;
+    }
+
+    const width = source.width;
+    const height = source.height;
+    const scale = Math.min(1, maxDimension / Math.max(width, height));
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.max(1, Math.round(width * scale));
+    canvas.height = Math.max(1, Math.round(height * scale));
+    const context = canvas.getContext('2d');
+    context.imageSmoothingQuality = 'high';
+
+    for (const type of types) {
+        if (type === 'image/jpeg') {
+            // JPEGは透過を扱えないため白で塗りつぶす
+            context.fillStyle = '#fff';
+            context.fillRect(0, 0, canvas.width, canvas.height);
+        } else {
+            context.clearRect(0, 0, canvas.width, canvas.height);
+        }
+        context.drawImage(source, 0, 0, canvas.width, canvas.height);
+
+        const blob = await canvasToBlob(canvas, type, quality);
+        // 指定した形式に対応していないブラウザはPNGを返すため、次の形式を試す
+        if (!blob || blob.type !== type) {
+            continue;
+        }
+        if (scale === 1 && blob.size >= file.size) {
+            break;
+        }
+        const name = file.name.replace(/\.[^.]*$/, '') + IMAGE_EXTENSIONS[type];
+        if (source.close) {
+            source.close();
+        }
+        return new File([blob], name, { type });
+    }
+
+    if (source.close) {
+        source.close();
+    }
+    return file;
+}
+
+// ファイル内容のSHA-256（16進数）を計算（HTTPなど Web Crypto が使えない環境では null）
+async function sha256Hex(file) {
+    if (!window.crypto || !window.crypto.subtle || !file.arrayBuffer) {
+        return null;
+    }
+    try {
+        const hash = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(hash), (b) => b.toString(16).padStart(2, '0')).join('');
+    } catch (error) {
+        return null;
+    }
+}
+
 async function apiRequest(endpoint, options = {}) {
     const url = `${API_BASE}/${endpoint}`;
     
@@ -50,16 +172,35 @@ async function apiRequest(endpoint, options = {}) {
     const config = { ...defaultOptions, ...options };
     
     // GETリクエストの場合はbodyを削除
-    if (config.method === 'GET') {
+    const isGet = config.method === 'GET';
+    const cached = isGet ? responseCache.get(url) : null;
+    if (isGet) {
         delete config.body;
     }
+    if (cached) {
+        // 条件付きGET（304はブラウザのキャッシュを経由せず、保持している応答を使う）
+        config.headers = { ...config.headers, 'If-None-Match': cached.etag };
+        config.cache = 'no-store';
+    }
     
     try {
         const response = await fetch(url, config);
+        if (response.status === 304 && cached) {
+            return cached.data;
+        }
         const data = await response.json();
         
         if (!response.ok) {
-            throw new Error(data.error || 'リクエストに失敗しました');
+            // 409（版数の競合）などで応答の内容を使えるよう、ステータスと本文を付ける
+            const error = new Error(data.error || 'リクエストに失敗しました');
+            error.status = response.status;
+            error.data = data;
+            throw error;
+        }
+        
+        const etag = response.headers.get('ETag');
+        if (isGet && etag) {
+            rememberResponse(url, etag, data);
         }
         
         return data;
@@ -69,9 +210,22 @@ async function apiRequest(endpoint, options = {}) {
     }
 }
 
+// カーソルページネーションで一覧を取得（next_cursor がなくなるまで1ページずつ返す）
+// 例: for await (const page of ManualAPI.pages({ limit: 50 })) { ... page.manuals ... }
+async function* iterateCursorPages(endpoint, params = {}) {
+    let cursor = '';
+    while (cursor !== null && cursor !== undefined) {
+        const query = new URLSearchParams({ ...params, cursor }).toString();
+        const data = await apiRequest(`${endpoint}?${query}`);
+        yield data;
+        cursor = data.pagination.next_cursor;
+    }
+}
+
 // 認証API
 const AuthAPI = {
     login: async (email, password) => {
+        clearResponseCache();
         return apiRequest('auth_login.py', {
             method: 'POST',
             body: JSON.stringify({ email, password })
@@ -79,6 +233,7 @@ const AuthAPI = {
     },
     
     logout: async () => {
+        clearResponseCache();
         return apiRequest('auth_logout.py', {
             method: 'POST'
         });
@@ -96,6 +251,10 @@ const UserAPI = {
         return apiRequest(`users_list.py?${query}`);
     },
     
+    pages: (params = {}) => {
+        return iterateCursorPages('users_list.py', params);
+    },
+    
     create: async (userData) => {
         return apiRequest('users_create.py', {
             method: 'POST',
@@ -117,6 +276,171 @@ const UserAPI = {
     }
 };
 
+// 手順書の部分更新で比較する基本情報とステップの項目
+const MANUAL_PATCH_FIELDS = ['title', 'description', 'visibility', 'is_published'];
+const STEP_PATCH_FIELDS = ['title', 'content', 'note', 'image_path'];
+
+// 手順書詳細APIの手順書を、buildManualPatch・mergeManualEdits で比較する形式にする
+// （409の応答の manual は最初からこの形式）
+function manualSnapshot(manual) {
+    const snapshot = { version: manual.version };
+    MANUAL_PATCH_FIELDS.forEach(field => { snapshot[field] = manual[field]; });
+    snapshot.description = manual.description || '';
+    snapshot.tags = (manual.tags || []).map(tag => tag.name);
+    snapshot.steps = (manual.steps || []).map(step => {
+        const value = { id: step.id };
+        STEP_PATCH_FIELDS.forEach(field => { value[field] = step[field]; });
+        return value;
+    });
+    return snapshot;
+}
+
+// 読み込み時（base）からの自分の変更（mine）を、他のユーザーが保存した内容（theirs）に重ねる
+// 同じ項目を双方が異なる値に変更した場合は自分の値を採用し、conflicts に項目名を入れる
+// 戻り値: { merged, conflicts }（merged は buildManualPatch(theirs, merged) で送る）
+function mergeManualEdits(base, mine, theirs) {
+    const conflicts = [];
+    const changed = (a, b) => (a || '') !== (b || '');
+    const merged = { version: theirs.version };
+
+    for (const field of MANUAL_PATCH_FIELDS) {
+        if (field in mine && changed(mine[field], base[field])) {
+            if (changed(theirs[field], base[field]) && changed(theirs[field], mine[field])) {
+                conflicts.push(field);
+            }
+            merged[field] = mine[field];
+        } else {
+            merged[field] = theirs[field];
+        }
+    }
+
+    // タグ: 相手の一覧から自分が外したタグを除き、自分が追加したタグを加える
+    const removedTags = base.tags.filter(tag => !mine.tags.includes(tag));
+    merged.tags = theirs.tags.filter(tag => !removedTags.includes(tag));
+    mine.tags.filter(tag => !base.tags.includes(tag) && !merged.tags.includes(tag))
+        .forEach(tag => merged.tags.push(tag));
+
+    // ステップの内容: 相手の内容に、自分が変更した項目だけを重ねる
+    const baseSteps = new Map(base.steps.map(step => [step.id, step]));
+    const theirSteps = new Map(theirs.steps.map(step => [step.id, step]));
+    const mySteps = new Map(mine.steps.filter(step => baseSteps.has(step.id)).map(step => [step.id, step]));
+    const mergeStep = (id) => {
+        const original = baseSteps.get(id);
+        const step = mySteps.get(id);
+        const result = { ...theirSteps.get(id) };
+        for (const field of STEP_PATCH_FIELDS) {
+            if (changed(step[field], original[field])) {
+                if (changed(result[field], original[field]) && changed(result[field], step[field])) {
+                    conflicts.push(`${step.title || result.title}: ${field}`);
+                }
+                result[field] = step[field];
+            }
+        }
+        return result;
+    };
+    // 相手が削除したステップを自分が変更していた場合は競合とし、削除を優先する
+    mySteps.forEach((step, id) => {
+        if (!theirSteps.has(id) && STEP_PATCH_FIELDS.some(field => changed(step[field], baseSteps.get(id)[field]))) {
+            conflicts.push(`${step.title}: 削除済み`);
+        }
+    });
+
+    // ステップの並び: 自分が並べ替えていれば自分の並び、そうでなければ相手の並びを基準にして
+    // 双方が削除したステップを除き、もう一方で追加されたステップを（その直前のステップの後ろに）入れる
+    // 保存済みのステップは id、自分が追加したステップ（id なし）はオブジェクト自体で識別する
+    const keyOf = (step) => (baseSteps.has(step.id) || theirSteps.has(step.id)) ? step.id : step;
+    const keptOrder = base.steps.map(step => step.id).filter(id => mySteps.has(id));
+    const mineOrder = mine.steps.map(step => step.id).filter(id => mySteps.has(id));
+    const reordered = keptOrder.some((id, index) => mineOrder[index] !== id);
+    const primary = reordered ? mine.steps : theirs.steps;
+    const secondary = reordered ? theirs.steps : mine.steps;
+
+    const order = primary.filter(step => !baseSteps.has(step.id) || (mySteps.has(step.id) && theirSteps.has(step.id)));
+    let previous = null;
+    secondary.forEach(step => {
+        const key = keyOf(step);
+        if (!baseSteps.has(step.id)) {
+            const index = previous === null ? -1 : order.findIndex(item => keyOf(item) === previous);
+            order.splice(index + 1, 0, step);
+        }
+        if (order.some(item => keyOf(item) === key)) {
+            previous = key;
+        }
+    });
+
+    merged.steps = order.map(step => {
+        if (baseSteps.has(step.id)) {
+            return mergeStep(step.id);
+        }
+        return theirSteps.has(step.id) ? { ...theirSteps.get(step.id) } : { ...step, id: null };
+    });
+
+    return { merged, conflicts };
+}
+
+// 編集前と編集後の手順書から、manuals_patch.py に送る JSON Patch 形式の操作の一覧を作成
+// 手順書は { title, description, visibility, is_published, tags: [タグ名], steps: [{ id, title, content, note, image_path }] }
+// （編集前は手順書詳細APIの値。編集後の新しいステップは id を null にする）
+function buildManualPatch(original, current) {
+    const operations = [];
+
+    for (const field of MANUAL_PATCH_FIELDS) {
+        if (field in current && current[field] !== original[field]) {
+            operations.push({ op: 'replace', path: `/${field}`, value: current[field] });
+        }
+    }
+
+    // ステップ: 削除したものを後ろから外し、残りを編集後の並びに移動・追加しながら変更された項目を置換する
+    // （サーバーは操作を順に適用するため、適用後の並びを working で再現して位置を求める）
+    const originalSteps = new Map(original.steps.map(step => [step.id, step]));
+    const keptIds = new Set(current.steps.map(step => step.id).filter(id => originalSteps.has(id)));
+    const working = original.steps.map(step => step.id);
+    for (let i = working.length - 1; i >= 0; i--) {
+        if (!keptIds.has(working[i])) {
+            operations.push({ op: 'remove', path: `/steps/${i}` });
+            working.splice(i, 1);
+        }
+    }
+
+    const placed = new Set();
+    current.steps.forEach((step, index) => {
+        if (!keptIds.has(step.id) || placed.has(step.id)) {
+            const value = {};
+            STEP_PATCH_FIELDS.forEach(field => { value[field] = step[field] || ''; });
+            operations.push({ op: 'add', path: `/steps/${index}`, value });
+            working.splice(index, 0, null);
+            return;
+        }
+
+        placed.add(step.id);
+        const from = working.indexOf(step.id, index);
+        if (from !== index) {
+            operations.push({ op: 'move', from: `/steps/${from}`, path: `/steps/${index}` });
+            working.splice(from, 1);
+            working.splice(index, 0, step.id);
+        }
+        const stored = originalSteps.get(step.id);
+        for (const field of STEP_PATCH_FIELDS) {
+            if ((step[field] || '') !== (stored[field] || '')) {
+                operations.push({ op: 'replace', path: `/steps/${index}/${field}`, value: step[field] || '' });
+            }
+        }
+    });
+
+    // タグ: 外したタグを後ろから削除し（別の編集で並びが変わっていれば test で失敗させる）、新しいタグを末尾に追加
+    for (let i = original.tags.length - 1; i >= 0; i--) {
+        if (!current.tags.includes(original.tags[i])) {
+            operations.push({ op: 'test', path: `/tags/${i}`, value: original.tags[i] });
+            operations.push({ op: 'remove', path: `/tags/${i}` });
+        }
+    }
+    current.tags
+        .filter((tag, index) => !original.tags.includes(tag) && current.tags.indexOf(tag) === index)
+        .forEach(tag => operations.push({ op: 'add', path: '/tags/-', value: tag }));
+
+    return operations;
+}
+
 // 手順書API
 const ManualAPI = {
     list: async (params = {}) => {
@@ -124,6 +448,10 @@ const ManualAPI = {
         return apiRequest(`manuals_list.py?${query}`);
     },
     
+    pages: (params = {}) => {
+        return iterateCursorPages('manuals_list.py', params);
+    },
+    
     get: async (manualId) => {
         return apiRequest(`manuals_get.py?id=${manualId}`);
     },
@@ -142,33 +470,193 @@ const ManualAPI = {
         });
     },
     
+    // operations は JSON Patch 形式の操作の一覧（buildManualPatch で作成）
+    // version を指定すると、他の更新で版数が進んでいた場合に409（error.data.manual に現在の内容）になる
+    patch: async (manualId, operations, version = null) => {
+        return apiRequest(`manuals_patch.py?id=${manualId}`, {
+            method: 'PATCH',
+            body: JSON.stringify({ operations, version })
+        });
+    },
+    
     delete: async (manualId) => {
         return apiRequest(`manuals_delete.py?id=${manualId}`, {
             method: 'POST'
         });
     },
     
-    uploadImage: async (imageFile) => {
+    // options.keepOriginal が true の場合は縮小・再エンコードせずに元のファイルを送る
+    // options.onProgress(loaded, total) で送信の進み具合を受け取る
+    uploadImage: async (imageFile, options = {}) => {
+        if (!options.keepOriginal) {
+            imageFile = await prepareImageForUpload(imageFile);
+        }
+        
+        // 同じ内容の画像が保存済みであればアップロードせずに既存のパスを使う
+        const digest = await sha256Hex(imageFile);
+        if (digest) {
+            const known = await apiRequest(`upload_image.py?sha256=${digest}`, { method: 'POST' });
+            if (known.exists !== false) {
+                return known;
+            }
+        }
+        
         const formData = new FormData();
         formData.append('image', imageFile);
         
-        const response = await fetch(`${API_BASE}/upload_image.py`, {
-            method: 'POST',
-            body: formData,
-            credentials: 'same-origin'
+        // fetch では送信の進み具合を取得できないため XMLHttpRequest を使う
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+            xhr.open('POST', `${API_BASE}/upload_image.py`);
+            if (options.onProgress) {
+                xhr.upload.addEventListener('progress', (e) => {
+                    if (e.lengthComputable) {
+                        options.onProgress(e.loaded, e.total);
+                    }
+                });
+            }
+            xhr.addEventListener('load', () => {
+                let data = {};
+                try {
+                    data = JSON.parse(xhr.responseText);
+                } catch (error) {
+                    // JSON以外の応答（Webサーバーのエラーページなど）
+                }
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(data);
+                } else {
+                    reject(new Error(data.error || '画像のアップロードに失敗しました'));
+                }
+            });
+            xhr.addEventListener('error', () => reject(new Error('画像のアップロードに失敗しました')));
+            xhr.send(formData);
         });
-        
-        const data = await response.json();
-        
-        if (!response.ok) {
-            throw new Error(data.error || '画像のアップロードに失敗しました');
-        }
-        
-        return data;
     }
 };
 
 
+// 画像アップロードの同時実行数
+const IMAGE_UPLOAD_CONCURRENCY = 3;
+
+// 同時に実行する処理の数を制限するキュー
+class UploadQueue {
+    constructor(concurrency) {
+        this.concurrency = concurrency;
+        this.running = 0;
+        this.waiting = [];
+    }
+
+    // task（Promise を返す関数）を実行枠が空いてから開始し、その結果を返す
+    add(task) {
+        return new Promise((resolve, reject) => {
+            this.waiting.push({ task, resolve, reject });
+            this.next();
+        });
+    }
+
+    next() {
+        while (this.running < this.concurrency && this.waiting.length > 0) {
+            const { task, resolve, reject } = this.waiting.shift();
+            this.running++;
+            Promise.resolve()
+                .then(task)
+                .then(resolve, reject)
+                .finally(() => {
+                    this.running--;
+                    this.next();
+                });
+        }
+    }
+}
+
+const imageUploadQueue = new UploadQueue(IMAGE_UPLOAD_CONCURRENCY);
+
+function showStepUploadStatus(stepDiv, html) {
+    const status = stepDiv.querySelector('.step-image-upload-status');
+    if (status) {
+        status.innerHTML = html;
+    }
+}
+
+// ステップの画像を選択・貼り付けた時点でアップロードを開始する（保存時は waitForStepImageUpload で完了を待つ）
+function startStepImageUpload(stepDiv, file) {
+    const keepOriginalInput = stepDiv.querySelector('.step-image-keep-original');
+    const keepOriginal = keepOriginalInput ? keepOriginalInput.checked : false;
+    const upload = { file, path: null, error: null };
+    stepDiv.imageUpload = upload;
+
+    // 別の画像に差し替えた・取り消した後は表示を更新しない
+    const show = (html) => {
+        if (stepDiv.imageUpload === upload) {
+            showStepUploadStatus(stepDiv, html);
+        }
+    };
+
+    show('アップロード待ち...');
+    upload.promise = imageUploadQueue.add(() => {
+        if (stepDiv.imageUpload !== upload) {
+            return null;
+        }
+        show('<progress max="100" value="0"></progress> アップロード中...');
+        return ManualAPI.uploadImage(file, {
+            keepOriginal,
+            onProgress: (loaded, total) => {
+                const percent = Math.round(loaded / total * 100);
+                show(`<progress max="100" value="${percent}"></progress> アップロード中 ${percent}%`);
+            }
+        });
+    }).then((data) => {
+        if (data) {
+            upload.path = data.path;
+            show('アップロード完了');
+        }
+        return upload;
+    }, (error) => {
+        upload.error = error;
+        show(`<span style="color: #dc2626;">アップロードに失敗しました: ${escapeHtml(error.message)}（保存時に再試行します）</span>`);
+        return upload;
+    });
+    return upload.promise;
+}
+
+// 選択中の画像のアップロードを取り消す（送信済みの画像は tools/gc_uploads.py で削除される）
+function cancelStepImageUpload(stepDiv) {
+    stepDiv.imageUpload = null;
+    showStepUploadStatus(stepDiv, '');
+}
+
+// ステップの画像のアップロード完了を待ってパスを返す（画像が選択されていなければ null、失敗していれば再試行する）
+async function waitForStepImageUpload(stepDiv) {
+    let retried = false;
+    for (;;) {
+        const upload = stepDiv.imageUpload;
+        if (!upload) {
+            return null;
+        }
+        await upload.promise;
+        if (stepDiv.imageUpload !== upload) {
+            // 待っている間に画像が差し替えられた
+            continue;
+        }
+        if (!upload.error) {
+            return upload.path;
+        }
+        if (retried) {
+            throw upload.error;
+        }
+        retried = true;
+        startStepImageUpload(stepDiv, upload.file);
+    }
+}
+
+
+// ステップの画像の幅・高さ属性（APIが返した場合のみ。読み込み前に表示領域を確保する）
+function imageSizeAttributes(step) {
+    if (!step.image_width || !step.image_height) {
+        return '';
+    }
+    return ` width="${Number(step.image_width)}" height="${Number(step.image_height)}"`;
+}
 
 function renderGlobalNav(currentUser, links = {}) {
     const {
@@ -215,6 +703,14 @@ function escapeHtml(text) {
     return div.innerHTML;
 }
 
+// 検索結果のスニペットを表示用HTMLに変換（一致箇所は \x02 と \x03 で囲まれている）
+function highlightSnippet(snippet) {
+    return escapeHtml(snippet)
+        .replace(/\x02/g, '<mark>')
+        .replace(/\x03/g, '</mark>')
+        .replace(/\n/g, ' ');
+}
+
 // アラート表示
 function showAlert(message, type = 'info') {
     const alertDiv = document.createElement('div');
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+DB接続オーバーヘッドのベンチマーク
+従来方式（コンテキストごとに sqlite3.connect / close）と
+接続マネージャー（スレッドごとに接続を再利用し、PRAGMAを適用）を比較する
+
+一時ディレクトリに作成したデータベースを使用するため、本番のデータベースには影響しない
+
+使い方:
+    python tools/bench_db_connection.py
+    python tools/bench_db_connection.py --requests 2000 --writers 8 --writes 200
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+if os.environ.get('REQUEST_METHOD'):
+    # CGIとして呼び出された場合は何もしない
+    print('Status: 404 Not Found')
+    print()
+    sys.exit(0)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_PATH = os.path.join(ROOT_DIR, 'database', 'schema.sql')
+sys.path.insert(0, os.path.join(ROOT_DIR, 'cgi-bin'))
+
+# 1リクエストで接続を取得する回数（セッション確認 + ハンドラー本体 + 閲覧ログ等）
+CONTEXTS_PER_REQUEST = 3
+
+
+def create_database(path):
+    """スキーマと最小限のデータを持つデータベースを作成"""
+    conn = sqlite3.connect(path)
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    conn.execute("""
+        INSERT INTO users (email, password_hash, name, role)
+        VALUES ('bench@example.com', '', 'bench', 'admin')
+    """)
+    for i in range(100):
+        conn.execute("""
+            INSERT INTO manuals (title, description, author_id, is_published)
+            VALUES (?, '', 1, 1)
+        """, (f'manual {i}',))
+    conn.commit()
+    conn.close()
+
+
+def legacy_request(db_path):
+    """従来の get_db_connection 相当（毎回接続して閉じる）"""
+    for _ in range(CONTEXTS_PER_REQUEST):
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = str
+        try:
+            conn.execute('SELECT * FROM manuals WHERE id = ?', (1,)).fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def pooled_request(database):
+    """接続マネージャーを使用"""
+    for _ in range(CONTEXTS_PER_REQUEST):
+        with database.get_db_connection() as conn:
+            conn.execute('SELECT * FROM manuals WHERE id = ?', (1,)).fetchone()
+
+
+def measure(func, arg, count):
+    """1リクエストあたりの処理時間（マイクロ秒）のリストを返す"""
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func(arg)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f'  {label:<10} mean {statistics.mean(samples):9.1f} us'
+          f'  p50 {statistics.median(samples):9.1f} us  p99 {p99:9.1f} us')
+
+
+def legacy_writer(db_path, writes, queue):
+    """従来方式の書き込みワーカー"""
+    latencies, errors = [], 0
+    for i in range(writes):
+        start = time.perf_counter()
+        try:
+            conn = sqlite3.connect(db_path)
+            try:
+                conn.execute('INSERT INTO view_logs (manual_id, user_id) VALUES (?, 1)', (i % 100 + 1,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1e3)
+    queue.put((latencies, errors))
+
+
+def pooled_writer(db_path, writes, queue):
+    """接続マネージャーを使用した書き込みワーカー"""
+    os.environ['MF_DB_PATH'] = db_path
+    from common import database
+    database.DB_PATH = db_path
+    latencies, errors = [], 0
+    for i in range(writes):
+        start = time.perf_counter()
+        try:
+            with database.get_db_connection() as conn:
+                conn.execute('INSERT INTO view_logs (manual_id, user_id) VALUES (?, 1)', (i % 100 + 1,))
+        except sqlite3.OperationalError:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1e3)
+    queue.put((latencies, errors))
+
+
+def run_writers(target, db_path, writers, writes):
+    """複数プロセスから同時に書き込み、レイテンシーとロックエラー数を集計"""
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=target, args=(db_path, writes, queue)) for _ in range(writers)]
+    for process in processes:
+        process.start()
+    latencies, errors = [], 0
+    for _ in processes:
+        worker_latencies, worker_errors = queue.get()
+        latencies.extend(worker_latencies)
+        errors += worker_errors
+    for process in processes:
+        process.join()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DB接続オーバーヘッドのベンチマーク')
+    parser.add_argument('--requests', type=int, default=1000, help='計測するリクエスト数')
+    parser.add_argument('--writers', type=int, default=4, help='同時書き込みプロセス数（0で省略）')
+    parser.add_argument('--writes', type=int, default=100, help='プロセスごとの書き込み回数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        legacy_db = os.path.join(tmpdir, 'legacy.db')
+        pooled_db = os.path.join(tmpdir, 'pooled.db')
+        create_database(legacy_db)
+        create_database(pooled_db)
+
+        os.environ['MF_DB_PATH'] = pooled_db
+        from common import database
+        database.DB_PATH = pooled_db
+
+        print(f'接続取得 {CONTEXTS_PER_REQUEST} 回 + 主キー検索 / リクエスト（{args.requests} リクエスト）')
+        summarize('legacy', measure(legacy_request, legacy_db, args.requests))
+        summarize('pooled', measure(pooled_request, database, args.requests))
+        database.close_db_connection()
+
+        if args.writers > 0:
+            print(f'\n同時書き込み: {args.writers} プロセス × {args.writes} 回（レイテンシーはミリ秒）')
+            for label, target, db_path in (('legacy', legacy_writer, legacy_db), ('pooled', pooled_writer, pooled_db)):
+                latencies, errors = run_writers(target, db_path, args.writers, args.writes)
+                latencies.sort()
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                print(f'  {label:<10} p50 {statistics.median(latencies):8.2f} ms'
+                      f'  p99 {p99:8.2f} ms  max {latencies[-1]:8.2f} ms  locked errors {errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+JSONレスポンスのサイズと転送時間のベンチマーク
+従来方式（indent=2・非圧縮）と、コンパクトなJSON・gzip・deflate を比較する
+
+典型的な一覧（手順書20件）と詳細（ステップ30件・履歴20件）のレスポンスを生成し
+（--db を指定した場合は実際のデータベースから一覧・詳細APIの結果を取得し）、
+サーバー側の処理時間（JSON化 + 圧縮）を計測したうえで、
+指定した回線速度・往復遅延での最終バイト到達時間（time-to-last-byte）を見積もる
+
+使い方:
+    python tools/bench_json_response.py
+    python tools/bench_json_response.py --bandwidth 2 --rtt 40 --repeat 500
+    python tools/bench_json_response.py --db --manual-id 3
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+if os.environ.get('REQUEST_METHOD'):
+    # CGIとして呼び出された場合は何もしない
+    print('Status: 404 Not Found')
+    print()
+    sys.exit(0)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'cgi-bin'))
+
+from common.wsgi import Response, compress_response, COMPRESS_MIN_SIZE
+
+# ヘッダー等、本文以外に送るおおよそのバイト数
+HEADER_BYTES = 300
+
+
+def sample_manual(manual_id):
+    """一覧に含まれる手順書1件"""
+    return {
+        'id': manual_id,
+        'title': f'手順書 {manual_id} サーバー設定とバックアップ手順',
+        'description': f'説明 {manual_id}：' + 'サーバーの設定を変更する前に必ずバックアップを取得すること。' * 2,
+        'is_published': 1,
+        'visibility': 'public',
+        'created_at': '2026-10-01 09:00:00',
+        'updated_at': '2026-10-17 12:34:56',
+        'author_id': 1,
+        'author_name': '管理者',
+        'tags': ['作業手順', 'サーバー', 'バックアップ'],
+        'step_count': 12,
+    }
+
+
+def sample_list():
+    """典型的な一覧レスポンス（20件）"""
+    return {
+        'manuals': [sample_manual(i) for i in range(1, 21)],
+        'pagination': {'page': 1, 'limit': 20, 'total': 240, 'pages': 12},
+    }
+
+
+def sample_detail():
+    """典型的な詳細レスポンス（ステップ30件・履歴20件）"""
+    manual = sample_manual(1)
+    manual.pop('step_count')
+    manual['view_count'] = 1234
+    manual['steps'] = [{
+        'id': i,
+        'manual_id': 1,
+        'step_number': i,
+        'title': f'ステップ {i}：設定ファイルを編集する',
+        'content': f'手順 {i} の内容です。' + '管理画面にログインし、対象の設定項目を確認してから値を変更します。' * 4,
+        'image_path': f'/manual_factory/uploads/images/step_{i}_20261017_123456.png',
+        'notes': '変更前の値を控えておくこと。',
+        'created_at': '2026-10-01 09:00:00',
+        'updated_at': '2026-10-17 12:34:56',
+    } for i in range(1, 31)]
+    manual['histories'] = [{
+        'id': i,
+        'manual_id': 1,
+        'user_id': 1,
+        'user_name': '管理者',
+        'action': 'update',
+        'changes': json.dumps({'title': f'手順書 1 改訂 {i}'}, ensure_ascii=False),
+        'created_at': '2026-10-17 12:34:56',
+    } for i in range(1, 21)]
+    return {'manual': manual}
+
+
+def load_from_db(manual_id):
+    """一覧・詳細APIを実行し、実際のレスポンスの内容を取得"""
+    # 計測のための閲覧を閲覧数に反映しないよう、一時的なスプールに記録する
+    os.environ['MF_VIEW_SPOOL_PATH'] = os.path.join(tempfile.mkdtemp(), 'view_spool.db')
+    os.environ['MF_VIEW_FLUSH_BATCH'] = '0'
+    from common.app import load_handlers
+    from common.wsgi import Request
+
+    handlers = load_handlers({'manuals_list': 'get_manuals', 'manuals_get': 'get_manual'})
+    results = []
+    for endpoint, query in (('manuals_list', 'limit=20'), ('manuals_get', f'id={manual_id}')):
+        environ = {'REQUEST_METHOD': 'GET', 'QUERY_STRING': query, 'wsgi.input': io.BytesIO()}
+        response = handlers[endpoint](Request(environ))
+        if response.status != 200:
+            sys.exit(f'{endpoint}?{query} が {response.status} を返しました: {response.body.decode("utf-8")}')
+        results.append(json.loads(response.body.decode('utf-8')))
+    return results
+
+
+def encode(data, mode):
+    """指定した方式で本文を作成し、(本文, Content-Encoding) を返す"""
+    if mode == 'legacy':
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'), None
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    environ = {'HTTP_ACCEPT_ENCODING': mode if mode != 'compact' else ''}
+    response = compress_response(Response(body), environ)
+    return response.body, response.get_header('Content-Encoding')
+
+
+def measure(data, mode, repeat):
+    """(本文のバイト数, 処理時間の中央値（ミリ秒）) を返す"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body, _ = encode(data, mode)
+        samples.append((time.perf_counter() - start) * 1e3)
+    return len(body), statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSONレスポンスのサイズと転送時間のベンチマーク')
+    parser.add_argument('--bandwidth', type=float, default=1.0, help='回線速度（Mbps）')
+    parser.add_argument('--rtt', type=float, default=30.0, help='往復遅延（ミリ秒）')
+    parser.add_argument('--repeat', type=int, default=200, help='処理時間の計測回数')
+    parser.add_argument('--db', action='store_true', help='生成したデータの代わりにデータベースの内容を使う')
+    parser.add_argument('--manual-id', type=int, default=1, help='--db で詳細を取得する手順書ID')
+    args = parser.parse_args()
+
+    if args.db:
+        list_data, detail_data = load_from_db(args.manual_id)
+        samples = (('一覧（limit=20）', list_data), (f'詳細（id={args.manual_id}）', detail_data))
+    else:
+        samples = (('一覧（20件）', sample_list()), ('詳細（ステップ30・履歴20）', sample_detail()))
+
+    bytes_per_ms = args.bandwidth * 1e6 / 8 / 1e3
+    print(f'回線 {args.bandwidth} Mbps / RTT {args.rtt} ms（圧縮の閾値 {COMPRESS_MIN_SIZE} バイト）')
+
+    for label, data in samples:
+        print(f'\n{label}')
+        legacy_size = None
+        for mode in ('legacy', 'compact', 'gzip', 'deflate'):
+            size, server_ms = measure(data, mode, args.repeat)
+            legacy_size = legacy_size or size
+            # 最終バイト到達時間 ≒ 往復遅延 + サーバー処理 + 転送時間
+            ttlb = args.rtt + server_ms + (size + HEADER_BYTES) / bytes_per_ms
+            print(f'  {mode:<8} {size:8d} bytes ({size / legacy_size * 100:5.1f}%)'
+                  f'  server {server_ms:6.2f} ms  TTLB {ttlb:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+閲覧ログの反映
+スプール（database/view_spool.db）に溜まった閲覧イベントを view_logs / view_counts に反映する
+CGIのみで運用している場合は、タスクスケジューラや cron で定期的に実行する
+
+使い方:
+    python tools/flush_view_logs.py
+    python tools/flush_view_logs.py --rebuild-counts   # view_counts を view_logs から再集計
+"""
+
+import os
+import sys
+import argparse
+
+if os.environ.get('REQUEST_METHOD'):
+    # CGIとして呼び出された場合は何もしない
+    print('Status: 404 Not Found')
+    print()
+    sys.exit(0)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'cgi-bin'))
+
+from common.database import get_db_connection
+from common.viewlog import flush_view_logs, SPOOL_PATH
+
+
+def rebuild_counts():
+    """view_counts を view_logs の内容から作り直す"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM view_counts')
+        cursor.execute('''
+            INSERT INTO view_counts (manual_id, view_count, last_viewed_at)
+            SELECT v.manual_id, COUNT(*), MAX(v.viewed_at)
+            FROM view_logs v
+            JOIN manuals m ON m.id = v.manual_id
+            GROUP BY v.manual_id
+        ''')
+        return cursor.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description='閲覧ログの反映')
+    parser.add_argument('--rebuild-counts', action='store_true',
+                        help='反映後に view_counts を view_logs から再集計する')
+    args = parser.parse_args()
+
+    flushed = flush_view_logs()
+    print(f'{flushed} 件の閲覧ログを反映しました（スプール: {SPOOL_PATH}）')
+
+    if args.rebuild_counts:
+        print(f'{rebuild_counts()} 件の手順書の閲覧数を再集計しました')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+参照されていないアップロード画像の削除（マーク・アンド・スイープ）
+ステップの image_path など画像を参照する列をすべて走査して参照中の画像を記録し（マーク）、
+uploads/images 以下のどこからも参照されていないファイルのうち、猶予期間より古いものを
+削除または隔離する（スイープ）
+
+手順書の更新でステップから外れた画像や、アップロード後に手順書の保存に失敗した画像が対象になる
+アップロード直後でまだ保存されていない画像を消さないよう、更新日時が猶予期間内のファイルは残す
+
+使い方:
+    python tools/gc_uploads.py                      # 対象の確認のみ（既定）
+    python tools/gc_uploads.py --quarantine         # database/upload_quarantine へ移動
+    python tools/gc_uploads.py --delete --grace-hours 72
+    python tools/gc_uploads.py --recount            # images.ref_count を再集計
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+from urllib.parse import unquote
+
+if os.environ.get('REQUEST_METHOD'):
+    # CGIとして呼び出された場合は何もしない
+    print('Status: 404 Not Found')
+    print()
+    sys.exit(0)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'cgi-bin'))
+
+from common.database import get_db_connection
+from common.imagestore import IMAGES_DIR, IMAGES_URL_PATH, is_sha256, image_file_path
+
+# 画像を参照する列（テーブル名, 列名）。画像を参照するテーブルを追加した場合はここに追加する
+REFERENCE_COLUMNS = [
+    ('manual_steps', 'image_path'),
+]
+
+# 隔離先の既定（Webサーバーから配信されない database ディレクトリの下）
+DEFAULT_QUARANTINE_DIR = os.path.join(ROOT_DIR, 'database', 'upload_quarantine')
+
+# 参照の読み込み単位
+FETCH_SIZE = 1000
+
+
+def image_reference(path):
+    """image_path の値から uploads/images 以下の相対パスを取り出す（画像への参照でなければ None）"""
+    if not path:
+        return None
+    marker = IMAGES_URL_PATH.lstrip('/')
+    index = path.find(marker)
+    if index < 0:
+        return None
+    relative_path = path[index + len(marker):].split('?', 1)[0].split('#', 1)[0]
+    return unquote(relative_path) or None
+
+
+def iter_references(cursor):
+    """画像を参照する列をすべて走査し、参照先の相対パスを順に返す（結果は少しずつ読み込む）"""
+    for table, column in REFERENCE_COLUMNS:
+        cursor.execute(f"SELECT {column} FROM {table} WHERE {column} LIKE '%' || ? || '%'",
+                       (IMAGES_URL_PATH.lstrip('/'),))
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                relative_path = image_reference(row[0])
+                if relative_path:
+                    yield relative_path
+
+
+def mark(cursor):
+    """参照中の画像の相対パスの集合を返す"""
+    return set(iter_references(cursor))
+
+
+def iter_files(directory, prefix=''):
+    """ディレクトリ以下のファイルを (相対パス, DirEntry) として順に返す"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            relative_path = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path, relative_path + '/')
+            elif entry.is_file(follow_symlinks=False):
+                yield relative_path, entry
+
+
+def content_digest(relative_path):
+    """内容アドレス形式（ab/cd/<sha256>.<拡張子>）のパスであれば SHA-256 を返す"""
+    name = relative_path.rsplit('/', 1)[-1]
+    digest = name.split('.', 1)[0]
+    return digest if is_sha256(digest) else None
+
+
+def remove_empty_dirs(directory):
+    """空になったシャーディング用のディレクトリを削除"""
+    for current, dirs, files in os.walk(directory, topdown=False):
+        if current != directory and not os.listdir(current):
+            try:
+                os.rmdir(current)
+            except OSError:
+                pass
+
+
+def sweep(referenced, grace_seconds, action, quarantine_dir):
+    """参照されていない古いファイルを処理し、集計結果の辞書を返す"""
+    stats = {'scanned': 0, 'referenced': 0, 'recent': 0, 'removed': 0, 'bytes': 0}
+    threshold = time.time() - grace_seconds
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+
+    for relative_path, entry in iter_files(IMAGES_DIR):
+        stats['scanned'] += 1
+        if relative_path in referenced:
+            stats['referenced'] += 1
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime > threshold:
+            stats['recent'] += 1
+            continue
+
+        digest = content_digest(relative_path)
+        if action != 'dry-run' and digest and not release_image(digest):
+            # マークの後にステップから参照された
+            stats['referenced'] += 1
+            continue
+
+        print(f'  {action:<10} {relative_path} ({stat.st_size} bytes)')
+        if action == 'delete':
+            os.remove(entry.path)
+        elif action == 'quarantine':
+            destination = os.path.join(quarantine_dir, stamp, *relative_path.split('/'))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.move(entry.path, destination)
+        stats['removed'] += 1
+        stats['bytes'] += stat.st_size
+
+    if action != 'dry-run':
+        remove_empty_dirs(IMAGES_DIR)
+    return stats
+
+
+def release_image(digest):
+    """参照数が0の画像を images から削除する（参照されていた場合は False）"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM images WHERE sha256 = ? AND ref_count = 0', (digest,))
+        if cursor.rowcount:
+            return True
+        cursor.execute('SELECT 1 FROM images WHERE sha256 = ?', (digest,))
+        return cursor.fetchone() is None
+
+
+def purge_missing(cursor):
+    """ファイルが失われていて参照もされていない images の行を削除し、件数を返す"""
+    cursor.execute('SELECT sha256, path FROM images WHERE ref_count = 0')
+    missing = [(sha256,) for sha256, path in cursor.fetchall() if not os.path.exists(image_file_path(path))]
+    cursor.executemany('DELETE FROM images WHERE sha256 = ? AND ref_count = 0', missing)
+    return len(missing)
+
+
+def recount(cursor):
+    """images.ref_count をステップからの参照数で再集計し、修正した件数を返す"""
+    counts = {}
+    for relative_path in iter_references(cursor):
+        digest = content_digest(relative_path)
+        if digest:
+            counts[digest] = counts.get(digest, 0) + 1
+
+    cursor.execute('SELECT sha256, ref_count FROM images')
+    fixes = [(counts.get(sha256, 0), sha256) for sha256, ref_count in cursor.fetchall()
+             if counts.get(sha256, 0) != ref_count]
+    cursor.executemany('UPDATE images SET ref_count = ? WHERE sha256 = ?', fixes)
+    return len(fixes)
+
+
+def format_bytes(size):
+    """バイト数を読みやすい単位で表示"""
+    if size < 1024:
+        return f'{size} B'
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024
+        if size < 1024 or unit == 'GB':
+            return f'{size:.1f} {unit}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='参照されていないアップロード画像の削除')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--delete', action='store_true', help='参照されていない画像を削除する')
+    group.add_argument('--quarantine', action='store_true', help='参照されていない画像を隔離先へ移動する')
+    parser.add_argument('--grace-hours', type=float, default=24,
+                        help='この時間内に更新されたファイルは対象外（既定24時間）')
+    parser.add_argument('--quarantine-dir', default=DEFAULT_QUARANTINE_DIR, help='隔離先のディレクトリ')
+    parser.add_argument('--recount', action='store_true', help='images.ref_count を再集計する')
+    args = parser.parse_args()
+
+    action = 'delete' if args.delete else 'quarantine' if args.quarantine else 'dry-run'
+
+    if not os.path.isdir(IMAGES_DIR):
+        print(f'アップロードディレクトリが見つかりません: {IMAGES_DIR}')
+        return
+
+    if args.recount:
+        with get_db_connection() as conn:
+            print(f'{recount(conn.cursor())} 件の画像の参照数を修正しました')
+
+    with get_db_connection() as conn:
+        referenced = mark(conn.cursor())
+    print(f'参照中の画像: {len(referenced)} 件')
+
+    stats = sweep(referenced, args.grace_hours * 3600, action, args.quarantine_dir)
+    verb = {'dry-run': '対象', 'delete': '削除', 'quarantine': '隔離'}[action]
+    print(f'走査 {stats["scanned"]} 件 / 参照中 {stats["referenced"]} 件 / 猶予期間内 {stats["recent"]} 件')
+    print(f'{verb} {stats["removed"]} 件（{format_bytes(stats["bytes"])}）')
+    if action != 'dry-run':
+        with get_db_connection() as conn:
+            purged = purge_missing(conn.cursor())
+        if purged:
+            print(f'ファイルのない画像の登録 {purged} 件を削除しました')
+    if action == 'dry-run' and stats['removed']:
+        print('実際に処理するには --delete または --quarantine を指定してください')
+
+
+if __name__ == '__main__':
+    main()
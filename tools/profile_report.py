@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+リクエストのプロファイルの集計
+common.profiling が保存した .prof ファイルをエンドポイントごとにまとめ、
+累積時間（cumulative）の長い関数を表示する
+
+使い方:
+    python tools/profile_report.py                          # database/profiles の全ファイル
+    python tools/profile_report.py --endpoint manuals_get --limit 40
+    python tools/profile_report.py --sort tottime /path/to/profiles
+"""
+
+import os
+import sys
+import glob
+import pstats
+import argparse
+
+if os.environ.get('REQUEST_METHOD'):
+    # CGIとして呼び出された場合は何もしない
+    print('Status: 404 Not Found')
+    print()
+    sys.exit(0)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'cgi-bin'))
+
+from common.profiling import PROFILE_DIR, parse_filename
+
+# 並べ替えに使用できる項目
+SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+
+def group_profiles(directory, endpoints=None):
+    """ディレクトリの .prof ファイルを {エンドポイント名: [ファイルのパス, ...]} にまとめる"""
+    groups = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.prof'))):
+        endpoint = parse_filename(path)
+        if endpoint is None or (endpoints and endpoint not in endpoints):
+            continue
+        groups.setdefault(endpoint, []).append(path)
+    return groups
+
+
+def print_report(endpoint, paths, sort, limit, strip_dirs, stream=sys.stdout):
+    """1エンドポイントのプロファイルを合算して表示"""
+    stats = pstats.Stats(paths[0], stream=stream)
+    for path in paths[1:]:
+        stats.add(path)
+    if strip_dirs:
+        stats.strip_dirs()
+
+    print(f'=== {endpoint}: {len(paths)}リクエスト '
+          f'合計 {stats.total_tt:.3f}秒 / 平均 {stats.total_tt / len(paths) * 1e3:.1f}ミリ秒 ===', file=stream)
+    stats.sort_stats(sort).print_stats(limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='リクエストのプロファイル（.prof）をエンドポイントごとに集計')
+    parser.add_argument('directory', nargs='?', default=PROFILE_DIR, help=f'.prof ファイルのディレクトリ（既定 {PROFILE_DIR}）')
+    parser.add_argument('--endpoint', action='append', help='集計するエンドポイント（複数指定可）')
+    parser.add_argument('--sort', choices=SORT_KEYS, default='cumulative', help='並べ替えの項目（既定 cumulative）')
+    parser.add_argument('--limit', type=int, default=25, help='エンドポイントごとに表示する関数の数（既定25）')
+    parser.add_argument('--full-path', action='store_true', help='ファイル名をフルパスで表示する')
+    args = parser.parse_args()
+
+    groups = group_profiles(args.directory, args.endpoint)
+    if not groups:
+        print(f'プロファイルがありません: {args.directory}', file=sys.stderr)
+        return 1
+
+    for endpoint, paths in sorted(groups.items()):
+        print_report(endpoint, paths, args.sort, args.limit, not args.full_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CGIの起動時間（モジュールの読み込み時間）の計測
+各エントリーポイント（cgi-bin/api/*.py と各画面）をCGIと同じ環境変数で `python -X importtime` として実行し、
+インタープリター自体の起動分を除いた読み込み時間と読み込んだモジュールの数を表示する
+読み込み時間が上限（BUDGETS_MS / DEFAULT_BUDGET_MS）を超えたエントリーポイントがあれば終了コード1で終了する
+
+リクエストはゲスト（Cookieなし）の GET として処理される（--cookie でログイン後の状態も計測できる）
+データベースは一時ディレクトリにコピーしたものを使い、閲覧ログ・メトリクス・スロークエリログも一時ディレクトリに
+書き込むため、計測しても元のデータベースやログには何も残らない。常駐デーモンへの転送も行わない
+
+使い方:
+    python tools/startup_budget.py                          # 全エントリーポイント
+    python tools/startup_budget.py api/manuals_get --tree   # 読み込んだモジュールのツリーも表示
+    python tools/startup_budget.py --budget-ms 120 --repeat 5
+"""
+
+import os
+import sys
+import glob
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+if os.environ.get('REQUEST_METHOD'):
+    # CGIとして呼び出された場合は何もしない
+    print('Status: 404 Not Found')
+    print()
+    sys.exit(0)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 計測に使うデータベース（一時ディレクトリにコピーして使う）
+SOURCE_DB_PATH = os.environ.get('MF_DB_PATH') or os.path.join(ROOT_DIR, 'database', 'manual_factory.db')
+
+# 読み込み時間の上限（ミリ秒）。BUDGETS_MS に指定がないエントリーポイントは DEFAULT_BUDGET_MS
+DEFAULT_BUDGET_MS = 150
+BUDGETS_MS = {
+    # ゲストの閲覧は最も多いリクエストのため、使わないモジュールを読み込まないようにする
+    'api/manuals_get': 100,
+    'api/manuals_list': 100,
+}
+
+# エントリーポイントごとのクエリ文字列
+QUERY_STRINGS = {
+    'api/manuals_get': 'id=1',
+    'manuals/view': 'id=1',
+    'manuals/edit': 'id=1',
+}
+
+# 計測するエントリーポイント（ROOT_DIR からの相対パスのパターン）
+ENTRY_POINT_PATTERNS = ('cgi-bin/api/*.py', '*.py', 'manuals/*.py', 'users/*.py')
+
+# エントリーポイントではないスクリプト
+EXCLUDED_SCRIPTS = ('cgi-bin/api/__init__.py', 'setup_windows.py')
+
+
+class ImportNode:
+    """-X importtime の1行（モジュールと、その読み込み中に読み込まれたモジュール）"""
+
+    def __init__(self, name, self_us, cumulative_us):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.children = []
+
+    def count(self):
+        return 1 + sum(child.count() for child in self.children)
+
+
+def find_entry_points():
+    """エントリーポイントの一覧（拡張子を除いた ROOT_DIR からの相対パス。cgi-bin/ は省略）"""
+    entry_points = []
+    for pattern in ENTRY_POINT_PATTERNS:
+        for path in sorted(glob.glob(os.path.join(ROOT_DIR, pattern))):
+            relative = os.path.relpath(path, ROOT_DIR).replace(os.sep, '/')
+            if relative in EXCLUDED_SCRIPTS:
+                continue
+            name = relative[:-len('.py')]
+            if name.startswith('cgi-bin/'):
+                name = name[len('cgi-bin/'):]
+            entry_points.append((name, path))
+    return entry_points
+
+
+def parse_importtime(output):
+    """-X importtime の出力を読み込みのツリーにし、最上位のモジュールの一覧を返す"""
+    pending = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # 見出しの行
+            continue
+        name_field = fields[2].rstrip()
+        depth = (len(name_field) - len(name_field.lstrip()) - 1) // 2
+        node = ImportNode(name_field.strip(), int(fields[0]), int(fields[1]))
+        # 子のモジュールは親より先に出力される
+        node.children = pending.pop(depth + 1, [])
+        pending.setdefault(depth, []).append(node)
+    return pending.get(0, [])
+
+
+def cgi_environ(name, path, data_dir, cookie=None):
+    """エントリーポイントをCGIとして実行する環境変数"""
+    environ = dict(os.environ)
+    for key in ('MF_PROFILE', 'HTTP_X_MF_PROFILE', 'MF_TIMING_LOG', 'HTTP_COOKIE'):
+        environ.pop(key, None)
+    script_name = '/' + os.path.relpath(path, ROOT_DIR).replace(os.sep, '/')
+    environ.update({
+        'GATEWAY_INTERFACE': 'CGI/1.1',
+        'REQUEST_METHOD': 'GET',
+        'QUERY_STRING': QUERY_STRINGS.get(name, ''),
+        'SCRIPT_NAME': script_name,
+        'SCRIPT_FILENAME': path,
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_LENGTH': '0',
+        # 常駐デーモンが起動していても転送せず、CGIとして処理する
+        'MF_DAEMON_ADDRESS': 'off',
+        # 計測のための閲覧・リクエスト・遅いSQLを元のデータベースやログに残さない
+        'MF_DB_PATH': os.path.join(data_dir, 'manual_factory.db'),
+        'MF_VIEW_SPOOL_PATH': os.path.join(data_dir, 'view_spool.db'),
+        'MF_METRICS_PATH': os.path.join(data_dir, 'metrics.db'),
+        'MF_SLOW_QUERY_LOG': os.path.join(data_dir, 'slow_query.log'),
+    })
+    if cookie:
+        environ['HTTP_COOKIE'] = cookie
+    return environ
+
+
+def copy_database(data_dir):
+    """データベースを一時ディレクトリにコピー（WALの内容も含めて整合した状態で複製する）"""
+    source = sqlite3.connect(f'file:{SOURCE_DB_PATH}?mode=ro', uri=True)
+    target = sqlite3.connect(os.path.join(data_dir, 'manual_factory.db'))
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    # 署名付きセッション（--cookie）を検証できるよう、データベースと同じディレクトリの秘密鍵も複製する
+    secret_path = os.path.join(os.path.dirname(SOURCE_DB_PATH), 'session_secret.key')
+    if os.path.exists(secret_path):
+        shutil.copyfile(secret_path, os.path.join(data_dir, 'session_secret.key'))
+
+
+def run_importtime(args, environ, cwd):
+    """-X importtime でスクリプトを実行し、最上位のモジュールの一覧を返す"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + args,
+        env=environ, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    return parse_importtime(result.stderr.decode('utf-8', 'replace'))
+
+
+def measure(name, path, baseline, repeat, data_dir, cookie=None):
+    """
+    エントリーポイントの読み込み時間（ミリ秒、中央値）と、最後の実行の読み込みのツリーを返す
+    インタープリターの起動時に読み込まれるモジュール（baseline）は除く
+    """
+    environ = cgi_environ(name, path, data_dir, cookie)
+    cwd = os.path.dirname(path)
+    # 1回目はバイトコードのキャッシュ（__pycache__）の作成を含むため除く
+    run_importtime([path], environ, cwd)
+
+    times = []
+    roots = []
+    for _ in range(repeat):
+        roots = [node for node in run_importtime([path], environ, cwd) if node.name not in baseline]
+        times.append(sum(node.cumulative_us for node in roots) / 1000)
+    return statistics.median(times), roots
+
+
+def print_tree(nodes, min_ms, indent=1, stream=sys.stdout):
+    """読み込みのツリーを表示（累積時間が min_ms 未満のモジュールは省略）"""
+    for node in sorted(nodes, key=lambda node: node.cumulative_us, reverse=True):
+        if node.cumulative_us / 1000 < min_ms:
+            continue
+        print(f'{node.cumulative_us / 1000:9.1f}ms {node.self_us / 1000:7.1f}ms  {"  " * indent}{node.name}', file=stream)
+        print_tree(node.children, min_ms, indent + 1, stream)
+
+
+def parse_budget(value):
+    """--budget の値（名前=ミリ秒）を解析"""
+    name, separator, budget = value.partition('=')
+    try:
+        if not separator:
+            raise ValueError
+        return name, float(budget)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'名前=ミリ秒 の形式で指定してください: {value}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CGIエントリーポイントの起動時間（モジュールの読み込み時間）を計測')
+    parser.add_argument('entry_points', nargs='*', help='計測するエントリーポイント（例: api/manuals_get、省略時はすべて）')
+    parser.add_argument('--repeat', type=int, default=3, help='計測の回数（中央値を使う、既定3）')
+    parser.add_argument('--budget-ms', type=float, help=f'既定の上限（ミリ秒、既定 {DEFAULT_BUDGET_MS}）')
+    parser.add_argument('--budget', type=parse_budget, action='append', default=[],
+                        metavar='NAME=MS', help='エントリーポイントごとの上限（複数指定可）')
+    parser.add_argument('--tree', action='store_true', help='読み込んだモジュールのツリーを表示')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='ツリーに表示する累積時間の下限（ミリ秒、既定1）')
+    parser.add_argument('--cookie', help='Cookieヘッダーの値（ログイン後の状態で計測する場合）')
+    args = parser.parse_args()
+
+    entry_points = find_entry_points()
+    if args.entry_points:
+        known = dict(entry_points)
+        unknown = [name for name in args.entry_points if name not in known]
+        if unknown:
+            parser.error(f'エントリーポイントが見つかりません: {", ".join(unknown)}')
+        entry_points = [(name, known[name]) for name in args.entry_points]
+
+    budgets = dict(BUDGETS_MS)
+    budgets.update(args.budget)
+    default_budget = args.budget_ms if args.budget_ms is not None else DEFAULT_BUDGET_MS
+
+    # インタープリター自体の起動時に読み込まれるモジュール
+    baseline = {node.name for node in run_importtime(['-c', 'pass'], dict(os.environ), ROOT_DIR)}
+
+    if not os.path.exists(SOURCE_DB_PATH):
+        print(f'データベースがありません: {SOURCE_DB_PATH}（database/init_db.py で作成してください）', file=sys.stderr)
+        return 2
+
+    failures = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        copy_database(data_dir)
+        print(f'{"エントリーポイント":<24} {"読み込み":>10} {"モジュール":>8} {"上限":>8}  結果')
+        for name, path in entry_points:
+            elapsed, roots = measure(name, path, baseline, max(args.repeat, 1), data_dir, args.cookie)
+            budget = budgets.get(name, default_budget)
+            ok = elapsed <= budget
+            if not ok:
+                failures.append(name)
+            modules = sum(node.count() for node in roots)
+            print(f'{name:<24} {elapsed:>8.1f}ms {modules:>8} {budget:>6.0f}ms  {"OK" if ok else "超過"}')
+            if args.tree:
+                print_tree(roots, args.min_ms)
+                print()
+
+    if failures:
+        print(f'\n上限を超えたエントリーポイント: {", ".join(failures)}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())